@@ -0,0 +1,93 @@
+"""
+admin_events.py
+Delta events for the admin dashboard.
+Each event carries the rows that changed, plus the dashboard summaries
+it affects (analytics, top products), computed once here instead of by
+every open dashboard. Every event is appended to the admin_events log,
+which assigns a global sequence number (shared by all workers through
+the database), then broadcast through admin_ws_manager.
+
+    NEW_ORDER          order, products (new stock levels), analytics, top_products
+    ORDER_UPDATED      order_id, status  |  order_id, deleted, analytics, top_products
+    INVENTORY_UPDATED  products, analytics  |  deleted_product_ids, analytics
+    VOICE_LOG_UPDATED  log
+
+A dashboard that sees a sequence gap (dropped or coalesced events) asks
+/api/admin/events?after_seq=N for the missing events; `seq_from` on a
+coalesced event marks the earlier events it supersedes.
+"""
+import json
+
+import db
+import db_async
+from services import get_admin_analytics, get_top_products
+from ws_manager import admin_ws_manager
+
+
+async def emit(event_type, entity, **data):
+    """Log an event, stamp it with its sequence number and push it to every dashboard."""
+    message = {"type": event_type, "entity": entity, **data}
+    message["seq"] = await db_async.append_admin_event(event_type, json.dumps(message))
+    await admin_ws_manager.broadcast(message)
+    return message["seq"]
+
+
+def _products(product_ids):
+    by_id = db.get_catalog().by_id
+    return [by_id[pid] for pid in product_ids if pid in by_id]
+
+
+def _order_summaries():
+    return {"analytics": get_admin_analytics(), "top_products": get_top_products()}
+
+
+def _new_order_payload(order_id, product_ids):
+    return dict(order=db.get_order(order_id), products=_products(product_ids), **_order_summaries())
+
+
+async def order_created(result):
+    """After create_order(): `result` is its return value."""
+    if not result.get('order_id'):
+        return None
+    payload = await db_async.run(_new_order_payload, result['order_id'], result.get('product_ids', ()))
+    return await emit("NEW_ORDER", f"order:{result['order_id']}", **payload)
+
+
+async def order_status_changed(order_id, status):
+    return await emit("ORDER_UPDATED", f"order:{order_id}", order_id=order_id, status=status)
+
+
+async def order_deleted(order_id):
+    summaries = await db_async.run(_order_summaries)
+    return await emit("ORDER_UPDATED", f"order:{order_id}", order_id=order_id, deleted=True, **summaries)
+
+
+def _inventory_payload(product_ids):
+    return {"products": _products(product_ids), "analytics": get_admin_analytics()}
+
+
+async def product_changed(product_id):
+    payload = await db_async.run(_inventory_payload, (product_id,))
+    return await emit("INVENTORY_UPDATED", f"product:{product_id}", **payload)
+
+
+async def product_deleted(product_id):
+    analytics = await db_async.run(get_admin_analytics)
+    return await emit("INVENTORY_UPDATED", f"product:{product_id}", deleted_product_ids=[product_id], analytics=analytics)
+
+
+async def voice_logged(log):
+    if log is None:
+        return None
+    return await emit("VOICE_LOG_UPDATED", f"voice_log:{log['id']}", log=log)
+
+
+async def events_since(after_seq=None, limit=500):
+    """Resync: {"seq": latest, "reset": bool, "events": [...]}; on reset, reload everything."""
+    latest, complete, rows = await db_async.get_admin_events(after_seq, limit)
+    events = []
+    for seq, payload in rows:
+        event = json.loads(payload)
+        event["seq"] = seq
+        events.append(event)
+    return {"seq": latest, "reset": not complete, "events": events}
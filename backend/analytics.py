@@ -0,0 +1,108 @@
+"""
+analytics.py
+Materialized aggregates behind the admin analytics endpoints:
+  analytics_totals    one row: order count and revenue over all orders
+  daily_order_stats   order count and revenue per day (date(created_at), UTC)
+  product_sales       quantity sold per product
+create_order and delete_order keep them current inside their own write
+transaction, so /api/admin/analytics and /api/admin/top-products read a
+handful of indexed rows instead of scanning orders and order_items.
+Order status is not part of any metric, so status changes leave them as
+they are.
+
+scripts/fix_db.py and scripts/reset_demo_db.py rebuild them after
+rewriting orders. If orders or order_items are edited by hand,
+recompute everything with: python analytics.py --rebuild
+"""
+import sys
+
+from db_pool import connection
+
+
+def record_order(c, order_id, total, lines):
+    """Add a just-inserted order. `lines` is [(product_id, quantity), ...]. Runs in the caller's transaction."""
+    c.execute('''INSERT INTO daily_order_stats (day, order_count, revenue)
+                 SELECT date(created_at), 1, ? FROM orders WHERE id = ?
+                 ON CONFLICT(day) DO UPDATE SET order_count = order_count + 1,
+                                                revenue = revenue + excluded.revenue''',
+              (total, order_id))
+    c.execute('UPDATE analytics_totals SET order_count = order_count + 1, revenue = revenue + ? WHERE id = 1',
+              (total,))
+    c.executemany('''INSERT INTO product_sales (product_id, quantity) VALUES (?, ?)
+                     ON CONFLICT(product_id) DO UPDATE SET quantity = quantity + excluded.quantity''',
+                  lines)
+
+
+def unrecord_order(c, order_id):
+    """Subtract an order that is about to be deleted (call before deleting its rows)."""
+    c.execute('SELECT date(created_at), COALESCE(total, 0) FROM orders WHERE id = ?', (order_id,))
+    row = c.fetchone()
+    if row is None:
+        return
+    day, total = row
+    c.execute('UPDATE daily_order_stats SET order_count = order_count - 1, revenue = revenue - ? WHERE day = ?',
+              (total, day))
+    c.execute('UPDATE analytics_totals SET order_count = order_count - 1, revenue = revenue - ? WHERE id = 1',
+              (total,))
+    c.execute('''UPDATE product_sales
+                 SET quantity = quantity - (SELECT COALESCE(SUM(quantity), 0) FROM order_items
+                                            WHERE order_id = ? AND product_id = product_sales.product_id)
+                 WHERE product_id IN (SELECT product_id FROM order_items WHERE order_id = ?)''',
+              (order_id, order_id))
+
+
+def rebuild_aggregates(c):
+    """Recompute every aggregate from orders and order_items. Runs in the caller's transaction."""
+    c.execute('DELETE FROM analytics_totals')
+    c.execute('''INSERT INTO analytics_totals (id, order_count, revenue)
+                 SELECT 1, COUNT(id), COALESCE(SUM(total), 0) FROM orders''')
+    c.execute('DELETE FROM daily_order_stats')
+    c.execute('''INSERT INTO daily_order_stats (day, order_count, revenue)
+                 SELECT date(created_at), COUNT(id), COALESCE(SUM(total), 0) FROM orders
+                 GROUP BY date(created_at)''')
+    c.execute('DELETE FROM product_sales')
+    c.execute('''INSERT INTO product_sales (product_id, quantity)
+                 SELECT product_id, SUM(quantity) FROM order_items GROUP BY product_id''')
+
+
+def read_order_summary(c, days=7):
+    """Totals, most-sold product and the last `days` days that had orders (oldest first)."""
+    c.execute('SELECT order_count, revenue FROM analytics_totals WHERE id = 1')
+    order_count, revenue = c.fetchone() or (0, 0)
+
+    # Walks idx_product_sales_quantity from the top; skips products deleted since
+    c.execute('''SELECT p.name_en FROM product_sales s JOIN products p ON p.id = s.product_id
+                 WHERE s.quantity > 0 ORDER BY s.quantity DESC LIMIT 1''')
+    most_sold = c.fetchone()
+
+    c.execute('''SELECT day, order_count FROM daily_order_stats
+                 WHERE order_count > 0 ORDER BY day DESC LIMIT ?''', (days,))
+    daily = [{"date": day, "orders": count} for day, count in reversed(c.fetchall())]
+
+    return {
+        "order_count": order_count,
+        "revenue": round(revenue, 2),
+        "most_sold_product": most_sold[0] if most_sold else "N/A",
+        "daily": daily,
+    }
+
+
+def read_top_products(c, limit=5):
+    c.execute('''SELECT p.name_en, s.quantity FROM product_sales s JOIN products p ON p.id = s.product_id
+                 WHERE s.quantity > 0 ORDER BY s.quantity DESC LIMIT ?''', (limit,))
+    return [{"product_name": name, "total_orders": quantity} for name, quantity in c.fetchall()]
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print("Usage: python analytics.py --rebuild")
+        sys.exit(1)
+    from migrations import migrate
+    with connection() as conn:
+        migrate(conn)
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        rebuild_aggregates(c)
+        conn.commit()
+        c.execute('SELECT order_count, revenue FROM analytics_totals')
+        print("Analytics aggregates rebuilt: %d orders, revenue %.2f" % c.fetchone())
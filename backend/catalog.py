@@ -0,0 +1,59 @@
+"""
+catalog.py
+In-process product catalog cache for CartTalk.
+Holds an immutable snapshot of the products table with id- and
+category-indexed views, tagged with the catalog version it was read at.
+The version lives in SQLite (catalog_version, migration 9) and triggers
+on products bump it inside every writing transaction — add/update/delete,
+order stock deductions, scripts — so every worker sees it move. Each
+read checks it with a single-row lookup and reloads the snapshot only
+when it moved, instead of every voice turn doing its own full table scan.
+The same row keeps a names version (migration 10) that moves only when
+product names or merchant TTS lexicon entries change, so the phonetic
+lexicon in tts_text.py is not recompiled on every stock update.
+"""
+import threading
+
+
+class CatalogSnapshot:
+    """Read-only view of the catalog at a given version. Do not mutate."""
+    __slots__ = ('version', 'names_version', 'products', 'by_id', 'by_category')
+
+    def __init__(self, version, names_version, products):
+        self.version = version
+        self.names_version = names_version
+        self.products = products
+        self.by_id = {p['id']: p for p in products}
+        grouped = {}
+        for p in products:
+            grouped.setdefault(p.get('category') or 'General', []).append(p)
+        self.by_category = grouped
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def peek(self):
+        """The last loaded snapshot, possibly stale, without touching SQLite (None before the first load)."""
+        return self._snapshot
+
+    def snapshot(self):
+        """Return the current snapshot, reloading from SQLite only if a shared version moved."""
+        from db import catalog_version, load_catalog
+        versions = catalog_version()
+        snap = self._snapshot
+        if snap is not None and (snap.version, snap.names_version) == versions:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if snap is None or (snap.version, snap.names_version) != versions:
+                # Version and rows are read together, so a write that commits
+                # meanwhile is simply picked up on the next read.
+                snap = CatalogSnapshot(*load_catalog())
+                self._snapshot = snap
+            return snap
+
+
+catalog_cache = CatalogCache()
@@ -6,111 +6,41 @@ product inventory, user authentication, orders, and persistent carts.
 """
 import sqlite3
 import os
+import re
+import time
+from analytics import record_order, unrecord_order
+from purchase_profile import record_purchases, unrecord_purchases
+from db_pool import DB_FILE, connection
+from catalog import catalog_cache
+from migrations import migrate
+from search_index import product_index
+from tts_text import phonetic_lexicon
 
-DB_FILE = "cartalk.db"
+# How long a checkout may hold stock between validation and commit
+RESERVATION_TTL_SECONDS = 120
 
-def init_db():
-    """Initialize database with schema"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY,
-        name_en TEXT,
-        name_ml TEXT,
-        category TEXT,
-        price REAL,
-        stock INTEGER,
-        image_url TEXT
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY,
-        customer_phone TEXT,
-        customer_name TEXT,
-        customer_address TEXT,
-        total REAL,
-        status TEXT,
-        language TEXT,
-        transcript TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY,
-        order_id INTEGER,
-        product_id INTEGER,
-        quantity REAL,
-        price REAL,
-        FOREIGN KEY(order_id) REFERENCES orders(id),
-        FOREIGN KEY(product_id) REFERENCES products(id)
-    )''')
-    
-    # Phase 1: Authentication & Persistent Cart
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        phone TEXT PRIMARY KEY,
-        name TEXT,
-        address TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS cart_items (
-        id INTEGER PRIMARY KEY,
-        phone TEXT,
-        product_id INTEGER,
-        quantity INTEGER,
-        FOREIGN KEY(phone) REFERENCES users(phone),
-        FOREIGN KEY(product_id) REFERENCES products(id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS voice_logs (
-        id INTEGER PRIMARY KEY,
-        voice_input TEXT,
-        ai_interpretation TEXT,
-        action_performed TEXT,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Auto-Migration: Check for missing columns in existing tables
-    c.execute("PRAGMA table_info(products)")
-    prod_cols = [row[1] for row in c.fetchall()]
-    
-    if 'image_url' not in prod_cols:
-        try:
-            print("Migrating DB: Adding image_url column to products...")
-            c.execute("ALTER TABLE products ADD COLUMN image_url TEXT")
-        except Exception as e:
-            print(f"Migration Error (image_url): {e}")
+_QTY_RE = re.compile(r'[\d\.]+')
 
-    if 'safety_stock' not in prod_cols:
-        try:
-            print("Migrating DB: Adding safety_stock column to products...")
-            c.execute("ALTER TABLE products ADD COLUMN safety_stock INTEGER DEFAULT 5")
-        except Exception as e:
-            print(f"Migration Error (safety_stock): {e}")
+# Max bound parameters per IN (...) query
+SQL_IN_BATCH = 500
 
-    c.execute("PRAGMA table_info(orders)")
-    current_cols = [row[1] for row in c.fetchall()]
-    
-    if 'customer_name' not in current_cols:
-        try:
-            print("Migrating DB: Adding customer_name column...")
-            c.execute("ALTER TABLE orders ADD COLUMN customer_name TEXT")
-        except Exception as e:
-            print(f"Migration Error: {e}")
+# Admin dashboard events kept for /api/admin/events resync
+ADMIN_EVENT_RETENTION = int(os.getenv("ADMIN_EVENT_RETENTION", "1000"))
 
-    if 'customer_address' not in current_cols:
-        try:
-            print("Migrating DB: Adding customer_address column...")
-            c.execute("ALTER TABLE orders ADD COLUMN customer_address TEXT")
-        except Exception as e:
-            print(f"Migration Error: {e}")
-            
-    # Seed sample data (Run AFTER schema is guaranteed)
-    seed_products(conn)
+ORDER_COLUMNS = ('id', 'customer_phone', 'customer_name', 'customer_address', 'total',
+                 'status', 'language', 'transcript', 'created_at')
+USER_ORDER_COLUMNS = ('id', 'customer_name', 'customer_address', 'total', 'status', 'created_at', 'transcript')
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Bring the schema up to date (see migrations.py) and seed sample data"""
+    with connection() as conn:
+        migrate(conn)
+
+        # Seed sample data (Run AFTER schema is guaranteed)
+        seed_products(conn)
+
+        conn.commit()
+        phonetic_lexicon.invalidate()
 
 def seed_products(conn):
     """Seed initial product catalog if empty"""
@@ -138,48 +68,57 @@ def seed_products(conn):
     print("Database seeded with sample products.")
 
 def get_products():
-    """Get all products"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    # Check if image_url exists
-    try:
-        # Added safety_stock to SELECT
-        c.execute('SELECT id, name_en, name_ml, price, stock, category, image_url, safety_stock FROM products')
-        products = [{'id': row[0], 'name_en': row[1], 'name_ml': row[2], 'price': row[3], 'stock': row[4], 'category': row[5], 'image_url': row[6], 'safety_stock': row[7] if row[7] is not None else 5} for row in c.fetchall()]
-    except sqlite3.OperationalError:
-        # Fallback
-        c.execute('SELECT id, name_en, name_ml, price, stock, category FROM products')
-        products = [{'id': row[0], 'name_en': row[1], 'name_ml': row[2], 'price': row[3], 'stock': row[4], 'category': row[5], 'image_url': '', 'safety_stock': 5} for row in c.fetchall()]
-        
-    conn.close()
-    return products
+    """Get all products (served from the versioned catalog cache; treat as read-only)"""
+    return list(catalog_cache.snapshot().products)
+
+def get_catalog():
+    """Get the current catalog snapshot with id- and category-indexed views"""
+    return catalog_cache.snapshot()
+
+def catalog_version():
+    """Shared (catalog version, names version), bumped by the products and tts_lexicon triggers"""
+    with connection() as conn:
+        return tuple(conn.execute('SELECT version, names_version FROM catalog_version WHERE id = 1').fetchone())
+
+def load_catalog():
+    """(catalog version, names version, products) read in one transaction, so the versions match the rows"""
+    with connection() as conn:
+        outer = conn.in_transaction
+        if not outer:
+            conn.execute('BEGIN')
+        try:
+            return (*catalog_version(), load_products())
+        finally:
+            if not outer:
+                conn.rollback()
+
+def load_products():
+    """Full products table scan. The catalog cache reads it through load_catalog()."""
+    with connection() as conn:
+        c = conn.cursor()
+        # Check if image_url exists
+        try:
+            # Added safety_stock to SELECT
+            c.execute('SELECT id, name_en, name_ml, price, stock, category, image_url, safety_stock FROM products')
+            products = [{'id': row[0], 'name_en': row[1], 'name_ml': row[2], 'price': row[3], 'stock': row[4], 'category': row[5], 'image_url': row[6], 'safety_stock': row[7] if row[7] is not None else 5} for row in c.fetchall()]
+        except sqlite3.OperationalError:
+            # Fallback
+            c.execute('SELECT id, name_en, name_ml, price, stock, category FROM products')
+            products = [{'id': row[0], 'name_en': row[1], 'name_ml': row[2], 'price': row[3], 'stock': row[4], 'category': row[5], 'image_url': '', 'safety_stock': 5} for row in c.fetchall()]
+
+        return products
 
 def get_product_stock(product_id):
     """Get the current live stock for a single product. Returns None if product not found."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT stock FROM products WHERE id = ?', (product_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def validate_cart_stock(cart_items):
-    """
-    Validates every item in the cart against live DB stock (minus safety_stock buffer).
-    Returns a dict:
-      {
-        'valid_cart': [...],          # cart with quantities clamped to available stock
-        'violations': [              # list of violations found
-          {'id': int, 'name': str, 'requested': float, 'available': float}
-        ]
-      }
-    """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    valid_cart = []
-    violations = []
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT stock FROM products WHERE id = ?', (product_id,))
+        row = c.fetchone()
+        return row[0] if row else None
 
+def _parse_cart_lines(cart_items):
+    """Normalize id / qty aliases once. Returns [(item, product_id, qty)]."""
+    parsed = []
     for item in cart_items:
         if not isinstance(item, dict):
             continue
@@ -196,10 +135,39 @@ def validate_cart_stock(cart_items):
             qty = float(qty_raw)
         except (ValueError, TypeError):
             qty = 1.0
+        parsed.append((item, pid, qty))
+    return parsed
 
-        # Fetch live stock AND safety_stock buffer from DB
-        c.execute('SELECT stock, safety_stock, name_en FROM products WHERE id = ?', (pid,))
-        row = c.fetchone()
+def _fetch_stock_rows(c, ids, reservation_id=None):
+    """
+    Live stock for the given products in one query, net of unexpired
+    reservations held by anyone other than `reservation_id`.
+    Returns {id: (stock, safety_stock, name_en, price, reserved_by_others)}.
+    """
+    if not ids:
+        return {}
+    c.execute(f'''
+        SELECT p.id, p.stock, p.safety_stock, p.name_en, p.price, COALESCE(r.reserved, 0)
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS reserved
+            FROM stock_reservations
+            WHERE expires_at > ? AND reservation_id IS NOT ?
+            GROUP BY product_id
+        ) r ON r.product_id = p.id
+        WHERE p.id IN ({','.join('?' * len(ids))})
+    ''', [time.time(), reservation_id, *ids])
+    return {row[0]: row[1:] for row in c.fetchall()}
+
+def _check_cart_stock(c, cart_items, reservation_id=None):
+    parsed = _parse_cart_lines(cart_items)
+    rows = _fetch_stock_rows(c, list({pid for _, pid, _ in parsed}), reservation_id)
+
+    valid_cart = []
+    violations = []
+
+    for item, pid, qty in parsed:
+        row = rows.get(pid)
         if row is None:
             # Product doesn't exist — skip it
             violations.append({'id': pid, 'name': item.get('name', f'Product #{pid}'), 'requested': qty, 'available': 0})
@@ -208,8 +176,9 @@ def validate_cart_stock(cart_items):
         raw_stock = row[0]
         safety = row[1] if row[1] is not None else 5
         product_name = row[2]
-        # Enforce safety_stock buffer (same as what InventoryService shows the AI)
-        available_stock = max(0, raw_stock - safety)
+        # Enforce safety_stock buffer (same as what InventoryService shows the AI),
+        # minus stock other callers are holding for checkout
+        available_stock = max(0, raw_stock - safety - row[4])
 
         if qty > available_stock:
             violations.append({
@@ -228,322 +197,465 @@ def validate_cart_stock(cart_items):
         else:
             valid_cart.append(item)
 
-    conn.close()
     return {'valid_cart': valid_cart, 'violations': violations}
 
-def create_order(order_data):
-    """Create new order"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('INSERT INTO orders (customer_phone, customer_name, customer_address, total, status, language, transcript) VALUES (?, ?, ?, ?, ?, ?, ?)',
-              (order_data.get('phone'), order_data.get('name'), order_data.get('address'), order_data.get('total'), 'completed', order_data.get('language'), order_data.get('transcript')))
-    order_id = c.lastrowid
-
-    # Add order items and deduct stock
-    import re as _re
-    items = order_data.get('items', [])
-    for item in items:
+def validate_cart_stock(cart_items, reservation_id=None):
+    """
+    Validates every item in the cart against live DB stock (minus safety_stock buffer
+    and stock reserved by other checkouts). All lines are resolved in one query.
+    Returns a dict:
+      {
+        'valid_cart': [...],          # cart with quantities clamped to available stock
+        'violations': [              # list of violations found
+          {'id': int, 'name': str, 'requested': float, 'available': float}
+        ]
+      }
+    """
+    with connection() as conn:
+        return _check_cart_stock(conn.cursor(), cart_items, reservation_id)
+
+def reserve_stock(reservation_id, cart_items, ttl_seconds=RESERVATION_TTL_SECONDS):
+    """
+    Validate the cart and hold the (clamped) quantities for `reservation_id`
+    for `ttl_seconds`, atomically. Replaces any earlier hold under the same id.
+    Returns the same structure as validate_cart_stock().
+    """
+    now = time.time()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('DELETE FROM stock_reservations WHERE expires_at <= ? OR reservation_id = ?', (now, reservation_id))
+        result = _check_cart_stock(c, cart_items, reservation_id)
+
+        held = {}
+        for item, pid, qty in _parse_cart_lines(result['valid_cart']):
+            held[pid] = held.get(pid, 0) + qty
+        c.executemany(
+            'INSERT INTO stock_reservations (reservation_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)',
+            [(reservation_id, pid, qty, now + ttl_seconds) for pid, qty in held.items()]
+        )
+        conn.commit()
+        return result
+
+def release_reservation(reservation_id):
+    """Drop any stock held under `reservation_id`."""
+    with connection() as conn:
+        conn.execute('DELETE FROM stock_reservations WHERE reservation_id = ?', (reservation_id,))
+        conn.commit()
+
+def create_order(order_data, all_or_nothing=False, reservation_id=None):
+    """
+    Create new order in a single write transaction.
+    Every line is checked against live stock (net of other callers' reservations)
+    under BEGIN IMMEDIATE, then stock deductions and order_items are written with
+    executemany. The stored total is recomputed from the lines actually committed.
+    With all_or_nothing=True, any line that cannot be fulfilled rejects the whole
+    order. If `reservation_id` is given, that hold is consumed by this order.
+    """
+    # Normalize lines: BUG 3 FIX — always parse qty to float, AI may send strings like "0.5"
+    lines = []
+    for item in order_data.get('items', []):
         if not isinstance(item, dict):
             continue
-        product_id = item.get('product_id') or item.get('id')
-        # BUG 3 FIX: Always parse qty to float — AI may send strings like "0.5"
+        try:
+            product_id = int(item.get('product_id') or item.get('id'))
+        except (ValueError, TypeError):
+            print(f"Warning: Skipping order item with invalid ID: {item}")
+            continue
         qty_raw = str(item.get('quantity') or item.get('qty') or 1)
-        q_match = _re.search(r'[\d\.]+', qty_raw)
+        q_match = _QTY_RE.search(qty_raw)
         qty = float(q_match.group()) if q_match else 1.0
-        price = item.get('price', 0)
-
-        # 1. Deduct Stock atomically (only if sufficient stock exists)
-        c.execute('UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?', (qty, product_id, qty))
-
-        if c.rowcount > 0:
-            # 2. Insert Item only if stock was successfully deducted
-            c.execute('INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
-                      (order_id, product_id, qty, price))
-        else:
-            print(f"Warning: Stock deduction failed for Product {product_id} (Insufficient Stock or Invalid ID). Item NOT added to order.")
-
-    conn.commit()
-    conn.close()
-    return {'order_id': order_id, 'total': order_data.get('total'), 'status': 'confirmed'}
+        try:
+            price = float(item['price']) if item.get('price') is not None else None
+        except (ValueError, TypeError):
+            price = None
+        lines.append((product_id, qty, price))
+
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        rows = _fetch_stock_rows(c, list({pid for pid, _, _ in lines}), reservation_id)
+        remaining = {pid: row[0] - row[4] for pid, row in rows.items()}
+
+        committed = []
+        failed = []
+        for product_id, qty, price in lines:
+            if product_id not in rows or remaining[product_id] < qty:
+                print(f"Warning: Stock deduction failed for Product {product_id} (Insufficient Stock or Invalid ID). Item NOT added to order.")
+                failed.append({'id': product_id, 'requested': qty})
+                continue
+            remaining[product_id] -= qty
+            committed.append((product_id, qty, price if price is not None else rows[product_id][3]))
+
+        if failed and all_or_nothing:
+            conn.rollback()
+            return {'order_id': None, 'total': 0, 'status': 'rejected', 'failed_items': failed}
+
+        total = round(sum(qty * price for _, qty, price in committed), 2)
+        c.execute('INSERT INTO orders (customer_phone, customer_name, customer_address, total, status, language, transcript) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  (order_data.get('phone'), order_data.get('name'), order_data.get('address'), total, 'completed', order_data.get('language'), order_data.get('transcript')))
+        order_id = c.lastrowid
+
+        deductions = {}
+        for product_id, qty, _ in committed:
+            deductions[product_id] = deductions.get(product_id, 0) + qty
+        c.executemany('UPDATE products SET stock = stock - ? WHERE id = ?',
+                      [(qty, product_id) for product_id, qty in deductions.items()])
+        c.executemany('INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
+                      [(order_id, product_id, qty, price) for product_id, qty, price in committed])
+        record_order(c, order_id, total, [(product_id, qty) for product_id, qty, _ in committed])
+        record_purchases(c, order_id, [(product_id, qty) for product_id, qty, _ in committed])
+        if reservation_id is not None:
+            c.execute('DELETE FROM stock_reservations WHERE reservation_id = ?', (reservation_id,))
+
+        conn.commit()
+        return {'order_id': order_id, 'total': total, 'status': 'confirmed', 'failed_items': failed,
+                'product_ids': sorted(deductions)}
 
 def update_order_status(order_id, status):
     """Update order status"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
-    conn.commit()
-    conn.close()
-    return {'id': order_id, 'status': status}
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+        conn.commit()
+        return {'id': order_id, 'status': status}
 
 def add_product(product_data):
     """Add new product manually"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    safety = product_data.get('safety_stock', 5)
-    
-    # Check if image_url col exists
-    try:
-        c.execute('INSERT INTO products (name_en, name_ml, category, price, stock, image_url, safety_stock) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                  (product_data['name_en'], product_data.get('name_ml', ''), product_data['category'], product_data['price'], product_data['stock'], product_data.get('image_url', ''), safety))
-    except sqlite3.OperationalError:
-        c.execute('INSERT INTO products (name_en, name_ml, category, price, stock) VALUES (?, ?, ?, ?, ?)',
-                  (product_data['name_en'], product_data.get('name_ml', ''), product_data['category'], product_data['price'], product_data['stock']))
-    
-    pid = c.lastrowid
-    conn.commit()
-    conn.close()
-    return {'id': pid, 'name': product_data['name_en']}
+    with connection() as conn:
+        c = conn.cursor()
+
+        safety = product_data.get('safety_stock', 5)
+
+        # Check if image_url col exists
+        try:
+            c.execute('INSERT INTO products (name_en, name_ml, category, price, stock, image_url, safety_stock) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (product_data['name_en'], product_data.get('name_ml', ''), product_data['category'], product_data['price'], product_data['stock'], product_data.get('image_url', ''), safety))
+        except sqlite3.OperationalError:
+            c.execute('INSERT INTO products (name_en, name_ml, category, price, stock) VALUES (?, ?, ?, ?, ?)',
+                      (product_data['name_en'], product_data.get('name_ml', ''), product_data['category'], product_data['price'], product_data['stock']))
+
+        pid = c.lastrowid
+        conn.commit()
+        product_index.upsert(pid, product_data['name_en'], product_data.get('name_ml', ''), product_data['category'])
+        return {'id': pid, 'name': product_data['name_en']}
 
 # ... (delete_product, etc) ...
 
 def delete_product(product_id):
     """Delete a product"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('DELETE FROM products WHERE id = ?', (product_id,))
-    conn.commit()
-    conn.close()
-    return {'id': product_id, 'status': 'deleted'}
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM products WHERE id = ?', (product_id,))
+        conn.commit()
+        product_index.remove(product_id)
+        return {'id': product_id, 'status': 'deleted'}
 
 def update_product(product_id, data):
     """Update existing product"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Dynamic update based on provided keys
-    fields = []
-    values = []
-    
-    if 'price' in data:
-        fields.append("price = ?")
-        values.append(data['price'])
-    if 'stock' in data:
-        fields.append("stock = ?")
-        values.append(data['stock'])
-    if 'image_url' in data:
-        fields.append("image_url = ?")
-        values.append(data['image_url'])
-    if 'name_ml' in data:
-        fields.append("name_ml = ?")
-        values.append(data['name_ml'])
-    if 'safety_stock' in data:
-        fields.append("safety_stock = ?")
-        values.append(data['safety_stock'])
-        
-    if not fields:
-        conn.close()
-        return None
-        
-    query = f"UPDATE products SET {', '.join(fields)} WHERE id = ?"
-    values.append(product_id)
-    c.execute(query, values)
-    conn.commit()
-    conn.close()
-    return {'id': product_id, 'status': 'updated'}
+    with connection() as conn:
+        c = conn.cursor()
+
+        # Dynamic update based on provided keys
+        fields = []
+        values = []
+
+        if 'price' in data:
+            fields.append("price = ?")
+            values.append(data['price'])
+        if 'stock' in data:
+            fields.append("stock = ?")
+            values.append(data['stock'])
+        if 'image_url' in data:
+            fields.append("image_url = ?")
+            values.append(data['image_url'])
+        if 'name_ml' in data:
+            fields.append("name_ml = ?")
+            values.append(data['name_ml'])
+        if 'safety_stock' in data:
+            fields.append("safety_stock = ?")
+            values.append(data['safety_stock'])
+
+        if not fields:
+            return None
+
+        query = f"UPDATE products SET {', '.join(fields)} WHERE id = ?"
+        values.append(product_id)
+        c.execute(query, values)
+        conn.commit()
+        if 'name_ml' in data:
+            product_index.upsert(product_id, name_ml=data['name_ml'])
+        return {'id': product_id, 'status': 'updated'}
 
 def delete_order(order_id):
     """Delete order and its items"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    # Cascade delete (order_items first, though foreign keys should handle typical constraints, explicit is safer here if PRAGMA foreign_keys not on)
-    c.execute('DELETE FROM order_items WHERE order_id = ?', (order_id,))
-    c.execute('DELETE FROM orders WHERE id = ?', (order_id,))
-    conn.commit()
-    conn.close()
-    return {'id': order_id, 'status': 'deleted'}
-
-def get_orders_by_user(phone):
-    """Get orders for a specific user"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT id, customer_name, customer_address, total, status, created_at, transcript 
-        FROM orders 
-        WHERE customer_phone = ? 
-        ORDER BY created_at DESC
-    ''', (phone,))
-    
-    columns = [col[0] for col in c.description]
-    user_orders = [dict(zip(columns, row)) for row in c.fetchall()]
-    
-    for order in user_orders:
-        c.execute('''
-            SELECT p.name_en as name, oi.quantity, oi.price
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = ?
-        ''', (order['id'],))
-        order['items'] = [{'name': row[0], 'quantity': row[1], 'price': row[2]} for row in c.fetchall()]
-
-    conn.close()
-    return user_orders
-
-def get_orders():
-    """Get all orders"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT * FROM orders ORDER BY created_at DESC')
-    columns = [description[0] for description in c.description]
-    orders = [dict(zip(columns, row)) for row in c.fetchall()]
-    
-    for order in orders:
-        c.execute('''
-            SELECT p.name_en as name, oi.quantity, oi.price
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        unrecord_order(c, order_id)
+        unrecord_purchases(c, order_id)
+        # Cascade delete (order_items first, though foreign keys should handle typical constraints, explicit is safer here if PRAGMA foreign_keys not on)
+        c.execute('DELETE FROM order_items WHERE order_id = ?', (order_id,))
+        c.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+        conn.commit()
+        return {'id': order_id, 'status': 'deleted'}
+
+def _fetch_order_items(c, order_ids):
+    """Line items for many orders at once (IN-batched). Returns {order_id: [item, ...]}."""
+    items = {}
+    for i in range(0, len(order_ids), SQL_IN_BATCH):
+        chunk = order_ids[i:i + SQL_IN_BATCH]
+        c.execute(f'''
+            SELECT oi.order_id, p.name_en as name, oi.quantity, oi.price
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = ?
-        ''', (order['id'],))
-        order['items'] = [{'name': row[0], 'quantity': row[1], 'price': row[2]} for row in c.fetchall()]
+            WHERE oi.order_id IN ({','.join('?' * len(chunk))})
+            ORDER BY oi.order_id, oi.id
+        ''', chunk)
+        for order_id, name, quantity, price in c.fetchall():
+            items.setdefault(order_id, []).append({'name': name, 'quantity': quantity, 'price': price})
+    return items
 
-    conn.close()
-    return orders
+def _query_orders(default_columns, where='', params=(), before_id=None, limit=None, fields=None):
+    """
+    Shared order listing: one query for the orders page plus one IN-batched query
+    for their items. Keyset pagination on id (newest first): pass the last id of
+    the previous page as `before_id`. `fields` projects a subset of columns
+    ('items' is a pseudo-field); 'id' is always included.
+    """
+    if fields:
+        wanted = set(fields)
+        columns = ['id'] + [col for col in default_columns if col in wanted and col != 'id']
+        with_items = 'items' in wanted
+    else:
+        columns = list(default_columns)
+        with_items = True
+
+    clauses = [where] if where else []
+    params = list(params)
+    if before_id is not None:
+        clauses.append('id < ?')
+        params.append(before_id)
+    query = f"SELECT {', '.join(columns)} FROM orders"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        orders = [dict(zip(columns, row)) for row in c.fetchall()]
+        if with_items and orders:
+            items = _fetch_order_items(c, [o['id'] for o in orders])
+            for order in orders:
+                order['items'] = items.get(order['id'], [])
+        return orders
+
+def get_orders_by_user(phone, before_id=None, limit=None, fields=None):
+    """Get orders for a specific user (newest first, optionally paginated)"""
+    return _query_orders(USER_ORDER_COLUMNS, 'customer_phone = ?', (phone,), before_id, limit, fields)
+
+def get_orders(before_id=None, limit=None, fields=None):
+    """Get all orders (newest first, optionally paginated / projected)"""
+    return _query_orders(ORDER_COLUMNS, before_id=before_id, limit=limit, fields=fields)
+
+def get_order(order_id):
+    """Get one order with its items, or None"""
+    rows = _query_orders(ORDER_COLUMNS, 'id = ?', (order_id,))
+    return rows[0] if rows else None
 
 # --- Phase 1: User & Cart Management ---
 
 def get_user(phone):
     """Get user details by phone"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT phone, name, address FROM users WHERE phone = ?', (phone,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return {'phone': row[0], 'name': row[1], 'address': row[2]}
-    return None
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT phone, name, address FROM users WHERE phone = ?', (phone,))
+        row = c.fetchone()
+        if row:
+            return {'phone': row[0], 'name': row[1], 'address': row[2]}
+        return None
 
 def update_user(phone, name=None, address=None):
     """Create or Update User"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Check exist
-    c.execute('SELECT phone FROM users WHERE phone = ?', (phone,))
-    exists = c.fetchone()
-    
-    if exists:
-        if name:
-            c.execute('UPDATE users SET name = ? WHERE phone = ?', (name, phone))
-        if address:
-            c.execute('UPDATE users SET address = ? WHERE phone = ?', (address, phone))
-    else:
-        c.execute('INSERT INTO users (phone, name, address) VALUES (?, ?, ?)', (phone, name or '', address or ''))
-    
-    conn.commit()
-    conn.close()
-    return get_user(phone)
+    with connection() as conn:
+        c = conn.cursor()
+
+        # Check exist
+        c.execute('SELECT phone FROM users WHERE phone = ?', (phone,))
+        exists = c.fetchone()
+
+        if exists:
+            if name:
+                c.execute('UPDATE users SET name = ? WHERE phone = ?', (name, phone))
+            if address:
+                c.execute('UPDATE users SET address = ? WHERE phone = ?', (address, phone))
+        else:
+            c.execute('INSERT INTO users (phone, name, address) VALUES (?, ?, ?)', (phone, name or '', address or ''))
+
+        conn.commit()
+        return get_user(phone)
 
 def get_cart(phone):
     """Get active cart for user"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT c.product_id, c.quantity, p.price, p.name_en 
-        FROM cart_items c 
-        JOIN products p ON c.product_id = p.id 
-        WHERE c.phone = ?
-    ''', (phone,))
-    items = [{'id': row[0], 'qty': row[1], 'price': row[2], 'name': row[3]} for row in c.fetchall()]
-    conn.close()
-    return items
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT c.product_id, c.quantity, p.price, p.name_en 
+            FROM cart_items c 
+            JOIN products p ON c.product_id = p.id 
+            WHERE c.phone = ?
+        ''', (phone,))
+        items = [{'id': row[0], 'qty': row[1], 'price': row[2], 'name': row[3]} for row in c.fetchall()]
+        return items
 
 def save_cart(phone, items):
     """Replace user's cart with new items"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    with connection() as conn:
+        c = conn.cursor()
 
-    # clear old cart
-    c.execute('DELETE FROM cart_items WHERE phone = ?', (phone,))
+        # clear old cart
+        c.execute('DELETE FROM cart_items WHERE phone = ?', (phone,))
 
-    # add new
-    for item in items:
-        if not isinstance(item, dict):
-            print(f"Skipping malformed cart item: {item}")
-            continue
+        # add new
+        for item in items:
+            if not isinstance(item, dict):
+                print(f"Skipping malformed cart item: {item}")
+                continue
 
-        pid = item.get('id') or item.get('product_id') or item.get('item_id')
-        qty = item.get('qty') if item.get('qty') is not None else item.get('quantity')
-        # BUG 10 FIX: Use explicit None check — qty=0 is falsy but valid
-        if pid is not None and qty is not None:
-            c.execute('INSERT INTO cart_items (phone, product_id, quantity) VALUES (?, ?, ?)', (phone, pid, qty))
+            pid = item.get('id') or item.get('product_id') or item.get('item_id')
+            qty = item.get('qty') if item.get('qty') is not None else item.get('quantity')
+            # BUG 10 FIX: Use explicit None check — qty=0 is falsy but valid
+            if pid is not None and qty is not None:
+                c.execute('INSERT INTO cart_items (phone, product_id, quantity) VALUES (?, ?, ?)', (phone, pid, qty))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
 def get_user_frequent_items(phone):
     """Get frequent items for a user for Smart Reorder"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # We aggregate items from all past orders of this user
-    # Returning top 5 most frequently bought items
-    c.execute('''
-        SELECT p.id, p.name_en, SUM(oi.quantity) as total_qty
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.order_id
-        JOIN products p ON oi.product_id = p.id
-        WHERE o.customer_phone = ?
-        GROUP BY p.id
-        ORDER BY total_qty DESC
-        LIMIT 5
-    ''', (phone,))
-    
-    items = [{'id': row[0], 'name': row[1], 'qty': row[2]} for row in c.fetchall()]
-    conn.close()
-    return items
+    with connection() as conn:
+        c = conn.cursor()
+
+        # Top 5 most bought items, from the user's purchase profile (purchase_profile.py)
+        c.execute('''
+            SELECT p.id, p.name_en, s.total_qty
+            FROM user_product_stats s
+            JOIN products p ON p.id = s.product_id
+            WHERE s.phone = ?
+            ORDER BY s.total_qty DESC
+            LIMIT 5
+        ''', (phone,))
+
+        items = [{'id': row[0], 'name': row[1], 'qty': row[2]} for row in c.fetchall()]
+        return items
 
 def get_user_monthly_essentials(phone, min_months=4):
     """
     Identify items bought in >= min_months distinct months.
     Returns list of {'id': product_id, 'name': product_name}.
     """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Logic:
-    # 1. Get (Product ID, Month) for all user orders
-    # 2. Group by Product ID
-    # 3. Count distinct months
-    # 4. Filter where Count >= min_months
-    
-    # SQLite strftime('%Y-%m', created_at) extracts YYYY-MM
-    c.execute('''
-        SELECT p.id, p.name_en, COUNT(DISTINCT strftime('%Y-%m', o.created_at)) as distinct_months
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.order_id
-        JOIN products p ON oi.product_id = p.id
-        WHERE o.customer_phone = ?
-        GROUP BY p.id
-        HAVING distinct_months >= ?
-        ORDER BY distinct_months DESC
-    ''', (phone, min_months))
-    
-    items = [{'id': row[0], 'name': row[1]} for row in c.fetchall()]
-    conn.close()
-    return items
+    with connection() as conn:
+        c = conn.cursor()
+
+        # month_count is the number of distinct YYYY-MM months the item was ordered in
+        c.execute('''
+            SELECT p.id, p.name_en
+            FROM user_product_stats s
+            JOIN products p ON p.id = s.product_id
+            WHERE s.phone = ? AND s.month_count >= ?
+            ORDER BY s.month_count DESC
+        ''', (phone, min_months))
+
+        items = [{'id': row[0], 'name': row[1]} for row in c.fetchall()]
+        return items
 
 def get_forgotten_items(phone, min_orders=3, days_gap=30):
     """
     Find items the user has ordered at least `min_orders` times
     but NOT in the last `days_gap` days — likely forgotten regulars.
     """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute('''
-        SELECT p.id, p.name_en, COUNT(*) as order_count, 
-               MAX(o.created_at) as last_ordered
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.order_id
-        JOIN products p ON oi.product_id = p.id
-        WHERE o.customer_phone = ?
-        GROUP BY p.id
-        HAVING order_count >= ? 
-               AND julianday('now') - julianday(MAX(o.created_at)) > ?
-        ORDER BY order_count DESC
-        LIMIT 5
-    ''', (phone, min_orders, days_gap))
-    
-    items = [{'id': row[0], 'name': row[1], 'times_ordered': row[2]} for row in c.fetchall()]
-    conn.close()
-    return items
+    with connection() as conn:
+        c = conn.cursor()
+
+        c.execute('''
+            SELECT p.id, p.name_en, s.order_count
+            FROM user_product_stats s
+            JOIN products p ON p.id = s.product_id
+            WHERE s.phone = ? AND s.order_count >= ?
+                  AND julianday('now') - julianday(s.last_ordered) > ?
+            ORDER BY s.order_count DESC
+            LIMIT 5
+        ''', (phone, min_orders, days_gap))
+
+        items = [{'id': row[0], 'name': row[1], 'times_ordered': row[2]} for row in c.fetchall()]
+        return items
+
+# --- Admin dashboard event log ---
+
+def append_admin_event(event_type, payload):
+    """Record a dashboard event (payload is its JSON text). Returns its sequence number."""
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('INSERT INTO admin_events (type, payload) VALUES (?, ?)', (event_type, payload))
+        seq = c.lastrowid
+        if seq % 100 == 0:
+            c.execute('DELETE FROM admin_events WHERE seq <= ?', (seq - ADMIN_EVENT_RETENTION,))
+        conn.commit()
+        return seq
+
+def get_admin_events(after_seq=None, limit=500):
+    """
+    Events after `after_seq`, oldest first, as (latest_seq, complete, [(seq, payload), ...]).
+    `complete` is False when events after `after_seq` were already pruned (or more
+    than `limit` are waiting), so the caller has to reload its full state instead.
+    """
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT MIN(seq), MAX(seq) FROM admin_events')
+        oldest, latest = c.fetchone()
+        if latest is None:
+            # Empty log: fall back to the AUTOINCREMENT counter so seq keeps counting up
+            c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'admin_events'")
+            row = c.fetchone()
+            return (row[0] if row else 0), True, []
+        if after_seq is None:
+            return latest, True, []
+        if after_seq < oldest - 1 or after_seq > latest or latest - after_seq > limit:
+            return latest, False, []
+        c.execute('SELECT seq, payload FROM admin_events WHERE seq > ? ORDER BY seq LIMIT ?', (after_seq, limit))
+        return latest, True, c.fetchall()
+
+# --- Merchant TTS pronunciation lexicon (tts_text.py) ---
+
+def _load_tts_lexicon(c):
+    c.execute('SELECT term, spoken FROM tts_lexicon')
+    return dict(c.fetchall())
+
+def get_tts_lexicon():
+    """Merchant pronunciation entries as {term: spoken}"""
+    with connection() as conn:
+        return _load_tts_lexicon(conn.cursor())
+
+def set_tts_lexicon_entry(term, spoken):
+    """Add or replace how `term` is spoken by the Malayalam voice. Returns the merchant lexicon."""
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('''INSERT INTO tts_lexicon (term, spoken) VALUES (?, ?)
+                     ON CONFLICT(term) DO UPDATE SET spoken = excluded.spoken, updated_at = CURRENT_TIMESTAMP''',
+                  (term, spoken))
+        conn.commit()
+        entries = _load_tts_lexicon(c)
+    phonetic_lexicon.invalidate()
+    return entries
+
+def delete_tts_lexicon_entry(term):
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM tts_lexicon WHERE term = ?', (term,))
+        conn.commit()
+        entries = _load_tts_lexicon(c)
+    phonetic_lexicon.invalidate()
+    return entries
@@ -0,0 +1,76 @@
+"""
+db_async.py
+Awaitable facade over db.py for the FastAPI handlers and GeminiService.
+Every call is executed on a small dedicated thread pool (each worker
+holds its own pooled SQLite connection), so a slow commit or analytics
+query never blocks the asyncio event loop that drives the call sockets.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+# SQLite allows one writer at a time; a few workers are enough to keep
+# WAL readers flowing alongside it without piling up lock contention.
+DB_MAX_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="cartalk-db")
+
+
+async def run(fn, *args, **kwargs):
+    """Run any blocking data-access callable on the DB executor and await it."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _offload(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    """Stop accepting work and let in-flight queries finish."""
+    _executor.shutdown(wait=True)
+
+
+# ─── Products ────────────────────────────────────────────────
+get_products = _offload(db.get_products)
+get_catalog = _offload(db.get_catalog)
+get_product_stock = _offload(db.get_product_stock)
+validate_cart_stock = _offload(db.validate_cart_stock)
+reserve_stock = _offload(db.reserve_stock)
+release_reservation = _offload(db.release_reservation)
+add_product = _offload(db.add_product)
+update_product = _offload(db.update_product)
+delete_product = _offload(db.delete_product)
+
+# ─── Orders ──────────────────────────────────────────────────
+create_order = _offload(db.create_order)
+update_order_status = _offload(db.update_order_status)
+delete_order = _offload(db.delete_order)
+get_orders = _offload(db.get_orders)
+get_orders_by_user = _offload(db.get_orders_by_user)
+get_order = _offload(db.get_order)
+
+# ─── Users & Cart ────────────────────────────────────────────
+get_user = _offload(db.get_user)
+update_user = _offload(db.update_user)
+get_cart = _offload(db.get_cart)
+save_cart = _offload(db.save_cart)
+
+# ─── Smart Reorder ───────────────────────────────────────────
+get_user_frequent_items = _offload(db.get_user_frequent_items)
+get_user_monthly_essentials = _offload(db.get_user_monthly_essentials)
+get_forgotten_items = _offload(db.get_forgotten_items)
+
+# ─── Admin dashboard events ──────────────────────────────────
+append_admin_event = _offload(db.append_admin_event)
+get_admin_events = _offload(db.get_admin_events)
+
+# ─── TTS lexicon ─────────────────────────────────────────────
+get_tts_lexicon = _offload(db.get_tts_lexicon)
+set_tts_lexicon_entry = _offload(db.set_tts_lexicon_entry)
+delete_tts_lexicon_entry = _offload(db.delete_tts_lexicon_entry)
@@ -0,0 +1,91 @@
+"""
+db_pool.py
+Shared SQLite connection layer for CartTalk.
+Keeps one long-lived, tuned connection per thread (WAL journal,
+relaxed fsync, large page cache, memory-mapped I/O and a prepared
+statement cache) so db.py and the analytics helpers stop paying for
+a connect/close on every call.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_FILE = "cartalk.db"
+
+# Pragmas applied once per connection. WAL lets readers proceed while a
+# writer commits; synchronous=NORMAL is durable enough under WAL.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",       # ~16 MB page cache
+    "PRAGMA mmap_size=268435456",     # 256 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Number of compiled statements each connection keeps for reuse
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_all_connections = []
+_registry_lock = threading.Lock()
+_generation = 0  # bumped by close_all() so threads drop their stale handles
+
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DB_FILE,
+        timeout=5.0,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,  # only ever used by its owning thread; allows close_all()
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _registry_lock:
+        _all_connections.append(conn)
+    return conn
+
+
+def get_connection():
+    """Return this thread's pooled connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "generation", None) != _generation:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.generation = _generation
+    return conn
+
+
+@contextmanager
+def connection():
+    """
+    Borrow the pooled connection for the current thread.
+    Callers commit explicitly. When the outermost borrow ends, whatever is
+    still uncommitted is rolled back — also when the block swallowed its own
+    error and returned — so the next borrower never inherits a half-done
+    transaction or a stale read snapshot. Nested borrows (a db helper calling
+    another) share the outer block's transaction.
+    """
+    conn = get_connection()
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    try:
+        yield conn
+    finally:
+        _local.depth = depth
+        if depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+def close_all():
+    """Close every pooled connection (used on application shutdown)."""
+    global _generation
+    with _registry_lock:
+        conns = list(_all_connections)
+        _all_connections.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing pooled connection: {e}")
@@ -4,6 +4,7 @@ FastAPI entry point for CartTalk.
 Provides REST APIs for frontend interaction (inventory, auth, orders)
 and a WebSocket endpoint for real-time AI voice streaming.
 """
+import asyncio
 import shutil
 import json
 import uuid
@@ -11,18 +12,27 @@ import os
 from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from services import (
     GeminiService, InventoryService, OrderService, get_admin_analytics,
     get_recent_orders, get_low_stock_products, get_top_products, get_voice_logs,
     log_voice_interaction
 )
-from db import (
-    init_db, get_products, get_user, get_cart, update_user,
-    get_orders_by_user, update_order_status, add_product,
-    update_product, delete_product, delete_order, save_cart
-)
+from db import init_db
+from db_pool import close_all as close_db_connections
+import db_async
 from ws_manager import admin_ws_manager
+import admin_events
+from retrieval import RECENT_TURN_LINES, cart_product_ids
+from search_index import product_index
+from tts_cache import tts_cache
+from tts_pool import tts_pool
+from tts_prefetch import speculative_tts
+from tts_stream import stream_reply_audio
+from tts_text import phonetic_lexicon
+from sessions import session_store
+from user_context import user_contexts
 
 # Load environment variables
 load_dotenv()
@@ -52,8 +62,33 @@ inventory = InventoryService()
 gemini = GeminiService()
 orders = OrderService()
 
-# Store active calls -> user mapping
-call_sessions = {}
+# Orders per page when streaming /api/orders/export
+ORDER_EXPORT_BATCH = 500
+
+# Stream Gemini replies section by section on the call socket (0 = wait for the full reply)
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") != "0"
+
+@app.on_event("startup")
+async def warm_search_index():
+    """Build the product search index in the background so the first lookup is fast"""
+    asyncio.create_task(db_async.run(product_index.ensure_built))
+
+@app.on_event("startup")
+async def warm_tts_cache():
+    """Index the on-disk TTS cache off the event loop so the first lookup needs no directory scan"""
+    asyncio.create_task(asyncio.to_thread(tts_cache.warm))
+
+@app.on_event("startup")
+async def start_admin_pubsub():
+    """Join the cross-worker pub/sub bridge for admin dashboard events"""
+    await admin_ws_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_db_pool():
+    """Drain the DB executor and close pooled SQLite connections on shutdown"""
+    await admin_ws_manager.stop()
+    db_async.shutdown()
+    close_db_connections()
 
 # ─── Health Check ────────────────────────────────────────────
 
@@ -71,8 +106,8 @@ async def customer_login(data: dict):
     if not phone:
         return {"error": "Phone required"}
     
-    user = update_user(phone) 
-    cart = get_cart(phone)
+    user = await db_async.update_user(phone)
+    cart = await db_async.get_cart(phone)
     return {"user": user, "cart": cart}
 
 # ─── Voice Call ──────────────────────────────────────────────
@@ -83,11 +118,120 @@ async def start_call(data: dict = None):
     call_id = str(uuid.uuid4())
     
     user_id = data.get('user_id') if data else None
-    if user_id:
-        call_sessions[call_id] = user_id
-        
+    await session_store.start(call_id, user_id=user_id)
+    # The first reply opens with a fixed greeting: synthesize it while the client connects
+    speculative_tts.start_call(call_id, user_id)
+    # ...and load what the prompt needs to know about the caller
+    user_contexts.start_call(call_id, user_id)
+
     return {"call_id": call_id, "status": "ready"}
 
+async def _send_cart_update(websocket, cart, violations):
+    await websocket.send_json({"type": "cart", "cart": cart})
+
+    # ── STOCK GUARD: Notify frontend if quantities were clamped ──
+    if violations:
+        warn_parts = []
+        for v in violations:
+            if v['available'] == 0:
+                warn_parts.append(f"{v['name']} is out of stock and was removed from your cart.")
+            else:
+                warn_parts.append(
+                    f"Only {v['available']} unit(s) of {v['name']} available. "
+                    f"Your cart has been updated to {v['available']}."
+                )
+        warning_text = " ".join(warn_parts)
+        await websocket.send_json({
+            "type": "stock_warning",
+            "text": warning_text,
+            "violations": violations
+        })
+
+async def _buffered_turn(websocket, call_id, text_input, audio_data, final_context, user_phone):
+    """Wait for the full Gemini reply, then send text, cart and audio"""
+    if audio_data:
+        result = await gemini.process_audio(call_id, audio_data, final_context, user_id=user_phone)
+    else:
+        result = await gemini.process_text(call_id, text_input, final_context, user_id=user_phone)
+    if not result:
+        return result
+
+    # ── PHASE 1: Send text instantly (sub-second) ──
+    if result.get("user_transcript"):
+        await websocket.send_json({"type": "transcript", "role": "user", "text": result["user_transcript"]})
+
+    if result.get("ai_text"):
+        await websocket.send_json({"type": "transcript", "role": "ai", "text": result["ai_text"]})
+
+    if result.get("cart") is not None:
+        await _send_cart_update(websocket, result["cart"], result.get("stock_violations", []))
+
+    # Check for termination signal (sent before the audio so the client
+    # knows to end the call once the last chunk has played)
+    if result.get("terminate"):
+        await websocket.send_text(json.dumps({"type": "control", "action": "terminate"}))
+
+    # ── PHASE 2: Stream TTS sentence by sentence (playback starts on the first one) ──
+    ai_audio = result.get("ai_audio", "") or result.get("ai_text", "")
+    if ai_audio:
+        await stream_reply_audio(websocket, ai_audio, call_id=call_id)
+    return result
+
+async def _stream_turn(websocket, call_id, text_input, audio_data, final_context, user_phone):
+    """
+    Forward a streamed Gemini reply: the transcript, cart and on-screen text go
+    out as soon as each section completes, and TTS starts on the first spoken
+    sentence while the model is still writing the rest.
+    """
+    if audio_data:
+        events = gemini.stream_audio(call_id, audio_data, final_context, user_id=user_phone)
+    else:
+        events = gemini.stream_text(call_id, text_input, final_context, user_id=user_phone)
+
+    sentences = asyncio.Queue()
+    audio_task = None
+    shown_text = False
+    result = None
+
+    async def queued_sentences():
+        while (sentence := await sentences.get()) is not None:
+            yield sentence
+
+    try:
+        async for event in events:
+            kind = event["type"]
+            if kind == "transcript" and event["text"]:
+                await websocket.send_json({"type": "transcript", "role": "user", "text": event["text"]})
+            elif kind == "cart":
+                await _send_cart_update(websocket, event["cart"], event["stock_violations"])
+            elif kind == "response_text" and event["text"]:
+                await websocket.send_json({"type": "transcript", "role": "ai", "text": event["text"]})
+                shown_text = True
+            elif kind == "audio_sentence":
+                if audio_task is None:
+                    audio_task = asyncio.create_task(stream_reply_audio(websocket, queued_sentences(), call_id=call_id))
+                await sentences.put(event["text"])
+            elif kind == "result":
+                result = event["result"]
+
+        if result:
+            if not shown_text and result.get("ai_text"):
+                await websocket.send_json({"type": "transcript", "role": "ai", "text": result["ai_text"]})
+            if result.get("terminate"):
+                await websocket.send_text(json.dumps({"type": "control", "action": "terminate"}))
+    finally:
+        if audio_task is not None:
+            await sentences.put(None)
+
+    if audio_task is not None:
+        await audio_task
+    elif result:
+        # No RESPONSE_AUDIO section was streamed (fallback format or error reply)
+        ai_audio = result.get("ai_audio", "") or result.get("ai_text", "")
+        if ai_audio:
+            await stream_reply_audio(websocket, ai_audio, call_id=call_id)
+    return result
+
 @app.websocket("/api/call/{call_id}/stream")
 async def websocket_endpoint(websocket: WebSocket, call_id: str):
     """Real-time audio streaming via WebSocket"""
@@ -125,113 +269,102 @@ async def websocket_endpoint(websocket: WebSocket, call_id: str):
             if not text_input and not audio_data:
                 continue
 
-            # Context Preparation
-            base_context = inventory.get_context()
-
             # Personalization — always provide Guest defaults so AI knows what's missing
             user_context = "User Name: Guest\nUser Address: Unknown\n"
-            user_phone = call_sessions.get(call_id)
+            session = await session_store.get_or_create(call_id)
+            user_phone = session.user_id
+            pinned_ids = cart_product_ids(await gemini.get_session_cart(call_id))
+            suggested_ids = []
             if user_phone:
-                u = get_user(user_phone)
-                c = get_cart(user_phone)
+                # Loaded once per call (user_context.py); _build_prompt reads the same snapshot
+                user_ctx = await user_contexts.get(call_id, user_phone)
+                u, c = user_ctx.user, user_ctx.cart
                 if u:
                     user_context = f"User Name: {u['name'] or 'Guest'}\nUser Address: {u['address'] or 'Unknown'}\n"
                 if c:
                     cart_summary = ", ".join([f"{item['qty']}x {item['name']}" for item in c])
                     user_context += f"Previous Cart: {cart_summary}\n"
+                    pinned_ids += cart_product_ids(c)
+                suggested_ids = user_ctx.suggested_ids()
+
+            # Context Preparation — only the products relevant to this turn
+            # (audio turns have no text yet, so they get the full list)
+            if text_input:
+                base_context = await db_async.run(inventory.get_relevant_context, text_input, pinned_ids, suggested_ids,
+                                                  None, list(session.history[-RECENT_TURN_LINES:]))
+            else:
+                base_context = await db_async.run(inventory.get_context)
 
             final_context = user_context + "\n" + base_context
 
-            if audio_data:
-                result = await gemini.process_audio(call_id, audio_data, final_context, user_id=user_phone)
+            if GEMINI_STREAMING:
+                result = await _stream_turn(websocket, call_id, text_input, audio_data, final_context, user_phone)
             else:
-                result = await gemini.process_text(call_id, text_input, final_context, user_id=user_phone)
-            
+                result = await _buffered_turn(websocket, call_id, text_input, audio_data, final_context, user_phone)
+
+            # Start on the lines the next reply is likely to open with
+            speculative_tts.after_turn(call_id, result)
+
             if result:
-                # ── PHASE 1: Send text instantly (sub-second) ──
-                if result.get("user_transcript"):
-                    await websocket.send_json({"type": "transcript", "role": "user", "text": result["user_transcript"]})
-                
-                if result.get("ai_text"):
-                    await websocket.send_json({"type": "transcript", "role": "ai", "text": result["ai_text"]})
-                
-                if result.get("cart") is not None:
-                    await websocket.send_json({"type": "cart", "cart": result["cart"]})
-
-                # ── STOCK GUARD: Notify frontend if quantities were clamped ──
-                violations = result.get("stock_violations", [])
-                if violations:
-                    warn_parts = []
-                    for v in violations:
-                        if v['available'] == 0:
-                            warn_parts.append(f"{v['name']} is out of stock and was removed from your cart.")
-                        else:
-                            warn_parts.append(
-                                f"Only {v['available']} unit(s) of {v['name']} available. "
-                                f"Your cart has been updated to {v['available']}."
-                            )
-                    warning_text = " ".join(warn_parts)
-                    await websocket.send_json({
-                        "type": "stock_warning",
-                        "text": warning_text,
-                        "violations": violations
-                    })
-
-                # ── PHASE 2: Generate FULL TTS audio (Ensures clarity & natural flow) ──
-                from services import GeminiService
-                ai_audio = result.get("ai_audio", "") or result.get("ai_text", "")
-                if ai_audio:
-                    audio_bytes = await GeminiService.generate_tts(ai_audio)
-                    if audio_bytes:
-                        await websocket.send_bytes(audio_bytes)
-                
-                # Check for termination signal
                 if result.get("terminate"):
-                    await websocket.send_text(json.dumps({"type": "control", "action": "terminate"}))
                     action_perf = "Confirmed Order & Terminated"
                 else:
                     action_perf = f"Updated Cart" if result.get("cart") is not None else "Responded"
-                    
+
                 # Log voice interaction
                 if result.get("user_transcript"):
-                    log_voice_interaction(
+                    log = await db_async.run(
+                        log_voice_interaction,
                         voice_input=result["user_transcript"],
                         ai_interpretation=result.get("ai_text", ""),
                         action_performed=action_perf
                     )
-                    await admin_ws_manager.broadcast({"type": "VOICE_LOG_UPDATED"})
+                    await admin_events.voice_logged(log)
             else:
                 # Error Case: Unblock Frontend
                 await websocket.send_json({"type": "error", "text": "Sorry, I encountered an error. Please try again."})
     except Exception as e:
         print(f"WebSocket Error: {e}")
+    finally:
+        # End-of-call hook: free the session and any stock still reserved for it
+        await gemini.end_call(call_id)
+        speculative_tts.end_call(call_id)
+        user_contexts.end_call(call_id)
 
 # ─── Products ────────────────────────────────────────────────
 
 @app.get("/api/products")
 async def get_all_products():
     """Get all products"""
-    return inventory.list_all()
+    return await db_async.run(inventory.list_all)
+
+@app.get("/api/products/search")
+async def search_products(q: str = "", limit: int = 10):
+    """Bilingual fuzzy product search (English, Malayalam script or transliterated)"""
+    if not q.strip():
+        return []
+    return await db_async.run(product_index.search, q, limit)
 
 @app.post("/api/products")
 async def create_product(product: dict):
     """Add new product"""
-    res = add_product(product)
-    await admin_ws_manager.broadcast({"type": "INVENTORY_UPDATED"})
+    res = await db_async.add_product(product)
+    await admin_events.product_changed(res['id'])
     return res
 
 @app.put("/api/products/{product_id}")
 async def update_product_endpoint(product_id: int, data: dict):
     """Update product (stock, price, image)"""
-    res = update_product(product_id, data)
-    await admin_ws_manager.broadcast({"type": "INVENTORY_UPDATED"})
+    res = await db_async.update_product(product_id, data)
+    if res:
+        await admin_events.product_changed(product_id)
     return res
 
 @app.delete("/api/products/{product_id}")
 async def delete_product_endpoint(product_id: int):
     """Delete a product"""
-    res = delete_product(product_id)
-    await admin_ws_manager.broadcast({"type": "INVENTORY_UPDATED"})
+    res = await db_async.delete_product(product_id)
+    await admin_events.product_deleted(product_id)
     return res
 
 # ─── Orders ──────────────────────────────────────────────────
@@ -239,33 +372,58 @@ async def delete_product_endpoint(product_id: int):
 @app.post("/api/order/confirm")
 async def confirm_order(order_data: dict):
     """Confirm and save order"""
-    res = orders.create_order(order_data) # wait, the file doesn't have orders globally, it imports get_recent_orders etc. Wait, look at line 183 "orders.create_order(order_data)"
-    await admin_ws_manager.broadcast({"type": "NEW_ORDER"})
+    res = await db_async.run(orders.create_order, order_data)
+    user_contexts.order_placed(order_data.get('phone'))
+    await admin_events.order_created(res)
     return res
 
+def _parse_fields(fields):
+    return [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
 @app.get("/api/orders")
-async def get_orders_handler():
-    """Get all orders (merchant dashboard)"""
-    return orders.get_all()
+async def get_orders_handler(before_id: int = None, limit: int = None, fields: str = None):
+    """Get orders (merchant dashboard). Page with ?limit=&before_id=<last id>, project with ?fields=id,total,items"""
+    return await db_async.run(orders.get_all, before_id, limit, _parse_fields(fields))
+
+@app.get("/api/orders/export")
+async def export_orders(fields: str = None):
+    """Stream every order as a JSON array, fetched in keyset pages (merchant export)"""
+    field_list = _parse_fields(fields)
+
+    async def stream():
+        yield "["
+        before_id = None
+        first = True
+        while True:
+            batch = await db_async.get_orders(before_id=before_id, limit=ORDER_EXPORT_BATCH, fields=field_list)
+            if not batch:
+                break
+            for order in batch:
+                yield ("" if first else ",") + json.dumps(order)
+                first = False
+            before_id = batch[-1]['id']
+        yield "]"
+
+    return StreamingResponse(stream(), media_type="application/json")
 
 @app.get("/api/orders/user")
-async def get_user_orders(phone: str):
+async def get_user_orders(phone: str, before_id: int = None, limit: int = None):
     """Get orders for a specific customer"""
-    return get_orders_by_user(phone)
+    return await db_async.get_orders_by_user(phone, before_id=before_id, limit=limit)
 
 @app.put("/api/orders/{order_id}/status")
 async def update_status(order_id: int, status_data: dict):
     """Update order status (e.g. delivered)"""
     new_status = status_data.get('status')
-    res = update_order_status(order_id, new_status)
-    await admin_ws_manager.broadcast({"type": "ORDER_UPDATED"})
+    res = await db_async.update_order_status(order_id, new_status)
+    await admin_events.order_status_changed(order_id, new_status)
     return res
 
 @app.delete("/api/orders/{order_id}")
 async def delete_order_endpoint(order_id: int):
     """Delete order"""
-    res = delete_order(order_id)
-    await admin_ws_manager.broadcast({"type": "ORDER_UPDATED"})
+    res = await db_async.delete_order(order_id)
+    await admin_events.order_deleted(order_id)
     return res
 
 # ─── Cart ────────────────────────────────────────────────────
@@ -277,7 +435,8 @@ async def add_to_cart(data: dict):
     items = data.get('items', [])
     if not phone:
         return {"error": "Phone required"}
-    save_cart(phone, items)
+    await db_async.save_cart(phone, items)
+    user_contexts.cart_saved(phone)
     return {"status": "updated", "items_count": len(items)}
 
 # ─── Admin ───────────────────────────────────────────────────
@@ -286,26 +445,76 @@ async def add_to_cart(data: dict):
 async def get_analytics():
     """Get merchant dashboard analytics"""
     try:
-        return get_admin_analytics()
+        return await db_async.run(get_admin_analytics)
     except Exception as e:
         print(f"Error fetching analytics: {e}")
         return {"error": "Failed to fetch analytics"}
 
 @app.get("/api/admin/recent-orders")
 async def fetch_recent_orders():
-    return get_recent_orders(limit=10)
+    return await db_async.run(get_recent_orders, limit=10)
 
 @app.get("/api/admin/low-stock")
 async def fetch_low_stock():
-    return get_low_stock_products()
+    return await db_async.run(get_low_stock_products)
 
 @app.get("/api/admin/top-products")
 async def fetch_top_products():
-    return get_top_products(limit=5)
+    return await db_async.run(get_top_products, limit=5)
 
 @app.get("/api/admin/voice-logs")
 async def fetch_voice_logs():
-    return get_voice_logs(limit=20)
+    return await db_async.run(get_voice_logs, limit=20)
+
+@app.get("/api/admin/tts-cache")
+async def fetch_tts_cache_stats():
+    """TTS audio cache hit/miss counters and tier sizes"""
+    return tts_cache.stats()
+
+@app.get("/api/admin/tts-pool")
+async def fetch_tts_pool_stats():
+    """TTS worker pool: queue depth, running jobs, timeouts and edge-tts fallbacks per engine, plus speculative prefetch"""
+    return dict(tts_pool.stats(), prefetch=speculative_tts.stats())
+
+@app.get("/api/admin/tts-lexicon")
+async def fetch_tts_lexicon():
+    """Merchant pronunciation entries for the Malayalam voice, plus lexicon counters"""
+    entries = await db_async.get_tts_lexicon()
+    return {"entries": entries, "stats": phonetic_lexicon.stats()}
+
+@app.put("/api/admin/tts-lexicon")
+async def set_tts_lexicon_entry(data: dict):
+    """Add or change how a term is spoken, e.g. {"term": "Horlicks", "spoken": "ഹോർലിക്സ്"}"""
+    term = (data.get('term') or '').strip()
+    spoken = (data.get('spoken') or '').strip()
+    if not term or not spoken:
+        return {"error": "term and spoken required"}
+    return {"entries": await db_async.set_tts_lexicon_entry(term, spoken)}
+
+@app.delete("/api/admin/tts-lexicon/{term}")
+async def delete_tts_lexicon_entry(term: str):
+    return {"entries": await db_async.delete_tts_lexicon_entry(term)}
+
+@app.get("/api/admin/sessions")
+async def fetch_session_stats():
+    """Active call sessions, how many were ended, expired or evicted, and user-context snapshot counters"""
+    return dict(session_store.stats(), user_context=user_contexts.stats())
+
+@app.get("/api/admin/events")
+async def fetch_admin_events(after_seq: int = None, limit: int = 500):
+    """Dashboard resync: events after `after_seq` (or just the latest seq). reset=true means reload everything"""
+    return await admin_events.events_since(after_seq, min(limit, 500))
+
+@app.get("/api/admin/ws-stats")
+async def fetch_admin_ws_stats():
+    """Dashboard event fan-out: coalescing, per-dashboard queue and pub/sub bridge counters"""
+    bridge = admin_ws_manager.bridge
+    return {
+        **admin_ws_manager.stats(),
+        "bridge": bridge.name,
+        "bridge_role": getattr(bridge, 'role', None),
+        "bridge_stats": bridge.stats,
+    }
 
 @app.websocket("/api/admin/ws")
 async def admin_websocket(websocket: WebSocket):
@@ -0,0 +1,272 @@
+"""
+migrations.py
+Versioned schema migrations for CartTalk.
+Each migration runs exactly once, in order, inside its own transaction,
+and is recorded in the schema_version table. Run it at deploy time with
+`python migrations.py`; init_db() also calls migrate(), which is a single
+version lookup when the schema is already current.
+
+To change the schema, append a new (version, description, steps) entry to
+MIGRATIONS — never edit one that has already shipped.
+"""
+import sqlite3
+
+from analytics import rebuild_aggregates
+from db_pool import connection
+from purchase_profile import rebuild_purchase_profiles
+
+
+def _baseline(c):
+    """Original CartTalk schema, including the columns older databases gained via ALTER."""
+    c.execute('''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name_en TEXT,
+        name_ml TEXT,
+        category TEXT,
+        price REAL,
+        stock INTEGER,
+        image_url TEXT,
+        safety_stock INTEGER DEFAULT 5
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY,
+        customer_phone TEXT,
+        customer_name TEXT,
+        customer_address TEXT,
+        total REAL,
+        status TEXT,
+        language TEXT,
+        transcript TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        product_id INTEGER,
+        quantity REAL,
+        price REAL,
+        FOREIGN KEY(order_id) REFERENCES orders(id),
+        FOREIGN KEY(product_id) REFERENCES products(id)
+    )''')
+
+    # Phase 1: Authentication & Persistent Cart
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        phone TEXT PRIMARY KEY,
+        name TEXT,
+        address TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS cart_items (
+        id INTEGER PRIMARY KEY,
+        phone TEXT,
+        product_id INTEGER,
+        quantity INTEGER,
+        FOREIGN KEY(phone) REFERENCES users(phone),
+        FOREIGN KEY(product_id) REFERENCES products(id)
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS voice_logs (
+        id INTEGER PRIMARY KEY,
+        voice_input TEXT,
+        ai_interpretation TEXT,
+        action_performed TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # Databases created before versioning may predate these columns
+    legacy_columns = (
+        ('products', 'image_url', 'TEXT'),
+        ('products', 'safety_stock', 'INTEGER DEFAULT 5'),
+        ('orders', 'customer_name', 'TEXT'),
+        ('orders', 'customer_address', 'TEXT'),
+    )
+    for table, column, decl in legacy_columns:
+        c.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in c.fetchall()}:
+            print(f"Migrating DB: Adding {column} column to {table}...")
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _analytics_aggregates(c):
+    """Materialized analytics (analytics.py), backfilled from existing orders."""
+    c.execute('''CREATE TABLE IF NOT EXISTS analytics_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        order_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_order_stats (
+        day TEXT PRIMARY KEY,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER PRIMARY KEY,
+        quantity REAL NOT NULL DEFAULT 0
+    )''')
+    # Top sellers / most-sold product: read from the top of this index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_quantity ON product_sales(quantity)")
+    rebuild_aggregates(c)
+
+
+def _purchase_profiles(c):
+    """Per-customer Smart Reorder profile (purchase_profile.py), backfilled from existing orders."""
+    c.execute('''CREATE TABLE IF NOT EXISTS user_product_stats (
+        phone TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        total_qty REAL NOT NULL DEFAULT 0,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        month_count INTEGER NOT NULL DEFAULT 0,
+        last_ordered TIMESTAMP,
+        PRIMARY KEY (phone, product_id)
+    ) WITHOUT ROWID''')
+    # Frequent items: a customer's top rows straight off the index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_product_stats_qty ON user_product_stats(phone, total_qty)")
+    rebuild_purchase_profiles(c)
+
+
+MIGRATIONS = (
+    (1, "baseline schema", _baseline),
+    (2, "stock reservations", (
+        '''CREATE TABLE IF NOT EXISTS stock_reservations (
+            id INTEGER PRIMARY KEY,
+            reservation_id TEXT,
+            product_id INTEGER,
+            quantity REAL,
+            expires_at REAL,
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )''',
+    )),
+    (3, "secondary indexes for order history, analytics, carts and reservations", (
+        # Order history by phone (keyset on id) and Smart Reorder joins
+        "CREATE INDEX IF NOT EXISTS idx_orders_phone_id ON orders(customer_phone, id)",
+        # Date-bucketed analytics
+        "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)",
+        # Covering: an order's items without touching the table
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id, product_id, quantity, price)",
+        # Covering: per-product sales totals (top products)
+        "CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_cart_items_phone ON cart_items(phone, product_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_voice_logs_timestamp ON voice_logs(timestamp)",
+        # Covering: unexpired holds per product during stock checks
+        "CREATE INDEX IF NOT EXISTS idx_reservations_product ON stock_reservations(product_id, expires_at, reservation_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_rid ON stock_reservations(reservation_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_expires ON stock_reservations(expires_at)",
+        "ANALYZE",
+    )),
+    (4, "shared call sessions (SESSION_BACKEND=sqlite)", (
+        '''CREATE TABLE IF NOT EXISTS call_sessions (
+            call_id TEXT PRIMARY KEY,
+            payload BLOB,
+            expires_at REAL
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_call_sessions_expires ON call_sessions(expires_at)",
+    )),
+    (5, "admin dashboard event log for delta pushes and resync", (
+        # AUTOINCREMENT: seq is never reused, even after old events are pruned
+        '''CREATE TABLE IF NOT EXISTS admin_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT,
+            payload TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    )),
+    (6, "materialized analytics aggregates", _analytics_aggregates),
+    (7, "merchant TTS pronunciation lexicon", (
+        '''CREATE TABLE IF NOT EXISTS tts_lexicon (
+            term TEXT PRIMARY KEY,
+            spoken TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID''',
+    )),
+    (8, "per-customer purchase profiles for Smart Reorder", _purchase_profiles),
+    (9, "shared catalog version for the per-worker catalog caches", (
+        '''CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )''',
+        "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)",
+        # Bumped inside the writing transaction, whoever writes (API, scripts or hand edits)
+        '''CREATE TRIGGER IF NOT EXISTS products_version_insert AFTER INSERT ON products
+           BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_version_update AFTER UPDATE ON products
+           BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_version_delete AFTER DELETE ON products
+           BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END''',
+    )),
+    (10, "names version for the TTS phonetic lexicon", (
+        # Moves only when product names or merchant lexicon entries change, not on stock updates
+        "ALTER TABLE catalog_version ADD COLUMN names_version INTEGER NOT NULL DEFAULT 0",
+        '''CREATE TRIGGER IF NOT EXISTS products_names_insert AFTER INSERT ON products
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_names_update AFTER UPDATE OF name_en, name_ml ON products
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_names_delete AFTER DELETE ON products
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS tts_lexicon_names_insert AFTER INSERT ON tts_lexicon
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS tts_lexicon_names_update AFTER UPDATE ON tts_lexicon
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS tts_lexicon_names_delete AFTER DELETE ON tts_lexicon
+           BEGIN UPDATE catalog_version SET names_version = names_version + 1 WHERE id = 1; END''',
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # no schema_version table yet
+    return row[0] or 0
+
+
+def migrate(conn=None):
+    """Apply every pending migration in order. Returns the resulting schema version."""
+    if conn is None:
+        with connection() as conn:
+            return migrate(conn)
+
+    version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.commit()
+
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        c = conn.cursor()
+        try:
+            c.execute('BEGIN IMMEDIATE')
+            # Another process may have applied it while we waited for the lock
+            if current_version(conn) >= number:
+                conn.rollback()
+                continue
+            print(f"Migrating DB: {number} - {description}...")
+            if callable(steps):
+                steps(c)
+            else:
+                for sql in steps:
+                    c.execute(sql)
+            c.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (number, description))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Migration Error ({number} - {description}): {e}")
+            raise
+        version = number
+    return version
+
+
+if __name__ == "__main__":
+    print(f"Schema version: {migrate()} (latest {LATEST_VERSION})")
@@ -0,0 +1,228 @@
+"""
+pubsub.py
+Cross-worker fan-out for admin dashboard events.
+Each worker keeps its own dashboard sockets (ws_manager.py); a bridge
+carries every event published by one worker to all the others, which
+then deliver it to their own dashboards. ADMIN_PUBSUB picks the bridge:
+  local  no fan-out; events stay in this process (single worker; default)
+  unix   workers on one host meet on the Unix socket ADMIN_PUBSUB_SOCKET.
+         The first worker to take the lock file becomes the hub and
+         relays; if it exits, the others reconnect and elect a new hub.
+  redis  PUBLISH / SUBSCRIBE on ADMIN_PUBSUB_CHANNEL at ADMIN_PUBSUB_REDIS_URL
+         (any Redis-protocol server), for workers on several hosts.
+A worker delivers its own events locally right away; the bridge never
+echoes them back. Frames are one JSON line: {"o": origin, "m": message}.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+
+from redis_client import RedisClient
+
+ADMIN_PUBSUB = os.getenv("ADMIN_PUBSUB", "local").lower()
+ADMIN_PUBSUB_SOCKET = os.getenv("ADMIN_PUBSUB_SOCKET", "/tmp/cartalk-admin.sock")
+ADMIN_PUBSUB_REDIS_URL = os.getenv("ADMIN_PUBSUB_REDIS_URL", "redis://localhost:6379/0")
+ADMIN_PUBSUB_CHANNEL = os.getenv("ADMIN_PUBSUB_CHANNEL", "cartalk:admin")
+
+RECONNECT_DELAY = 1.0
+
+
+def encode_frame(origin, message):
+    return json.dumps({"o": origin, "m": message}, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class PubSubBridge:
+    name = 'local'
+
+    def __init__(self):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.on_message = None
+        self.stats = {'published': 0, 'received': 0, 'errors': 0}
+
+    async def start(self, on_message):
+        """on_message(message) is called on the event loop for every event from another worker."""
+        self.on_message = on_message
+
+    async def publish(self, message):
+        pass
+
+    async def stop(self):
+        pass
+
+    def _receive(self, line):
+        try:
+            frame = json.loads(line)
+        except ValueError:
+            self.stats['errors'] += 1
+            return
+        if frame.get('o') == self.origin:
+            return
+        self.stats['received'] += 1
+        self.on_message(frame['m'])
+
+
+class UnixSocketBridge(PubSubBridge):
+    name = 'unix'
+
+    def __init__(self, path=ADMIN_PUBSUB_SOCKET):
+        super().__init__()
+        self.path = path
+        self.role = None         # 'hub' or 'client' once connected
+        self._lock_file = None
+        self._server = None
+        self._peers = set()      # hub: connected workers
+        self._writer = None      # client: connection to the hub
+        self._task = None
+
+    async def start(self, on_message):
+        await super().start(on_message)
+        self._task = asyncio.create_task(self._run())
+
+    def _try_lock(self):
+        import fcntl
+        f = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f  # held for this worker's lifetime
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                if self._try_lock():
+                    # Lock held: any socket file left at the path is stale
+                    self._server = await asyncio.start_unix_server(self._serve_peer, self.path)
+                    self.role = 'hub'
+                    print(f"Admin pub/sub: hub on {self.path}")
+                    await self._server.serve_forever()
+                    return
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                self._writer, self.role = writer, 'client'
+                while line := await reader.readline():
+                    self._receive(line)
+            except asyncio.CancelledError:
+                raise
+            except OSError as e:
+                self.stats['errors'] += 1
+                print(f"Admin pub/sub: hub unavailable ({e}), retrying")
+            self._writer = self.role = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                self._receive(line)
+                self._relay(line, exclude=writer)
+        except OSError:
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    def _relay(self, frame, exclude=None):
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            try:
+                peer.write(frame)
+            except OSError:
+                self._peers.discard(peer)
+
+    async def publish(self, message):
+        frame = encode_frame(self.origin, message)
+        if self.role == 'hub':
+            self._relay(frame)
+        elif self._writer is not None:
+            try:
+                self._writer.write(frame)
+                await self._writer.drain()
+            except OSError as e:
+                self.stats['errors'] += 1
+                print(f"Admin pub/sub publish failed: {e}")
+                return
+        else:
+            return  # between hubs; local dashboards still got the event
+        self.stats['published'] += 1
+
+    async def stop(self):
+        for peer in list(self._peers):
+            peer.close()  # peers see EOF and reconnect to the next hub
+        await asyncio.sleep(0)
+        if self._task:
+            self._task.cancel()
+        if self._server:
+            self._server.close()
+        if self._writer:
+            self._writer.close()
+        if self._lock_file:
+            self._lock_file.close()
+
+
+class RedisBridge(PubSubBridge):
+    name = 'redis'
+
+    def __init__(self, url=ADMIN_PUBSUB_REDIS_URL, channel=ADMIN_PUBSUB_CHANNEL):
+        super().__init__()
+        self.client = RedisClient(url)
+        self.channel = channel
+        self._loop = None
+        self._conn = None
+        self._stopping = threading.Event()
+
+    async def start(self, on_message):
+        await super().start(on_message)
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._subscribe_loop, name="admin-pubsub", daemon=True).start()
+
+    def _subscribe_loop(self):
+        # SUBSCRIBE takes over its connection, so it gets a dedicated blocking socket on its own thread
+        while not self._stopping.is_set():
+            try:
+                self._conn = self.client.connect(blocking_reads=True)
+                self._conn.execute('SUBSCRIBE', self.channel)
+                while True:
+                    reply = self._conn.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        self._loop.call_soon_threadsafe(self._receive, reply[2])
+            except Exception as e:
+                if self._stopping.is_set():
+                    return
+                self.stats['errors'] += 1
+                print(f"Admin pub/sub: subscriber disconnected ({e}), retrying")
+            finally:
+                if self._conn:
+                    self._conn.close()
+            self._stopping.wait(RECONNECT_DELAY)
+
+    async def publish(self, message):
+        try:
+            await asyncio.to_thread(self.client.execute, 'PUBLISH', self.channel, encode_frame(self.origin, message))
+            self.stats['published'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Admin pub/sub publish failed: {e}")
+
+    async def stop(self):
+        self._stopping.set()
+        if self._conn:
+            self._conn.close()
+
+
+BRIDGES = {
+    'local': PubSubBridge,
+    'unix': UnixSocketBridge,
+    'redis': RedisBridge,
+}
+
+
+def make_bridge(name=ADMIN_PUBSUB):
+    try:
+        return BRIDGES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown ADMIN_PUBSUB {name!r}; expected one of {', '.join(BRIDGES)}")
@@ -0,0 +1,84 @@
+"""
+purchase_profile.py
+Per-customer purchase profile behind Smart Reorder (user_product_stats):
+one row per (phone, product) with the total quantity bought, the number
+of orders it was in, the number of distinct months it was bought in and
+when it was last ordered. get_user_frequent_items,
+get_user_monthly_essentials and get_forgotten_items read a customer's
+rows through an index instead of aggregating their whole order history.
+
+create_order adds each order inside its own write transaction. Orders
+only ever arrive with the current time, so a new month is one whose
+YYYY-MM is past the row's last order. delete_order recomputes just the
+deleted order's products for that customer from their remaining orders.
+
+scripts/reset_demo_db.py rebuilds the profiles after clearing order
+items. If orders or order_items are edited by hand, recompute
+everything with: python purchase_profile.py --rebuild
+"""
+import sys
+
+from db_pool import connection
+
+_PROFILE_SELECT = '''
+    SELECT o.customer_phone, oi.product_id, SUM(oi.quantity), COUNT(DISTINCT o.id),
+           COUNT(DISTINCT strftime('%Y-%m', o.created_at)), MAX(o.created_at)
+    FROM orders o JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.customer_phone IS NOT NULL'''
+
+
+def record_purchases(c, order_id, lines):
+    """Add a just-inserted order. `lines` is [(product_id, quantity), ...]. Runs in the caller's transaction."""
+    per_product = {}
+    for product_id, qty in lines:
+        per_product[product_id] = per_product.get(product_id, 0) + qty
+    c.executemany('''INSERT INTO user_product_stats (phone, product_id, total_qty, order_count, month_count, last_ordered)
+                     SELECT customer_phone, ?, ?, 1, 1, created_at FROM orders
+                     WHERE id = ? AND customer_phone IS NOT NULL
+                     ON CONFLICT(phone, product_id) DO UPDATE SET
+                         total_qty = total_qty + excluded.total_qty,
+                         order_count = order_count + 1,
+                         month_count = month_count + (strftime('%Y-%m', excluded.last_ordered) > strftime('%Y-%m', last_ordered)),
+                         last_ordered = MAX(last_ordered, excluded.last_ordered)''',
+                  [(product_id, qty, order_id) for product_id, qty in per_product.items()])
+
+
+def unrecord_purchases(c, order_id):
+    """Recompute the rows an order that is about to be deleted contributed to (call before deleting its rows)."""
+    c.execute('SELECT customer_phone FROM orders WHERE id = ?', (order_id,))
+    row = c.fetchone()
+    if row is None or row[0] is None:
+        return
+    phone = row[0]
+    c.execute('''DELETE FROM user_product_stats
+                 WHERE phone = ? AND product_id IN (SELECT product_id FROM order_items WHERE order_id = ?)''',
+              (phone, order_id))
+    c.execute(f'''INSERT INTO user_product_stats (phone, product_id, total_qty, order_count, month_count, last_ordered)
+                  {_PROFILE_SELECT}
+                    AND o.customer_phone = ? AND o.id != ?
+                    AND oi.product_id IN (SELECT product_id FROM order_items WHERE order_id = ?)
+                  GROUP BY oi.product_id''',
+              (phone, order_id, order_id))
+
+
+def rebuild_purchase_profiles(c):
+    """Recompute every profile row from orders and order_items. Runs in the caller's transaction."""
+    c.execute('DELETE FROM user_product_stats')
+    c.execute(f'''INSERT INTO user_product_stats (phone, product_id, total_qty, order_count, month_count, last_ordered)
+                  {_PROFILE_SELECT}
+                  GROUP BY o.customer_phone, oi.product_id''')
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print("Usage: python purchase_profile.py --rebuild")
+        sys.exit(1)
+    from migrations import migrate
+    with connection() as conn:
+        migrate(conn)
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        rebuild_purchase_profiles(c)
+        conn.commit()
+        c.execute('SELECT COUNT(DISTINCT phone), COUNT(*) FROM user_product_stats')
+        print("Purchase profiles rebuilt: %d customers, %d products" % c.fetchone())
@@ -0,0 +1,119 @@
+"""
+redis_client.py
+Minimal blocking client for the Redis wire protocol (RESP2), so CartTalk
+can share state across workers without adding a dependency. Works with
+Redis, Valkey, KeyDB or any local stand-in that speaks RESP.
+One socket per thread; a command that fails on a dropped connection is
+retried once on a fresh socket.
+
+URL format: redis://[:password@]host[:port][/db]
+"""
+import socket
+import threading
+from urllib.parse import urlparse
+
+DEFAULT_PORT = 6379
+
+
+class RedisError(Exception):
+    """Error reply from the server (-ERR ...)."""
+
+
+def encode_command(*args):
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif not isinstance(arg, (bytes, bytearray)):
+            arg = str(arg).encode('ascii')
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+class RedisConnection:
+    def __init__(self, host, port, password=None, db=0, timeout=2.0, blocking_reads=False):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+        if blocking_reads:
+            # Connect and handshake keep the short timeout; after that reads wait
+            # as long as it takes, and keepalive notices a peer that went away
+            self.sock.settimeout(None)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def send(self, *args):
+        self.sock.sendall(encode_command(*args))
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self.reader.read(n + 2)
+            return data[:-2]
+        if kind == b'*':
+            n = int(rest)
+            return None if n < 0 else [self.read_reply() for _ in range(n)]
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    def execute(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # also wakes a thread blocked reading
+        except OSError:
+            pass
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisClient:
+    def __init__(self, url, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or DEFAULT_PORT
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self, timeout=None, blocking_reads=False):
+        """
+        Open a dedicated connection (e.g. for SUBSCRIBE, which takes over the socket).
+        `timeout` bounds the connect and handshake (None: the client default);
+        with blocking_reads, later reads have no timeout, as an idle subscriber needs.
+        """
+        return RedisConnection(self.host, self.port, self.password, self.db,
+                               self.timeout if timeout is None else timeout, blocking_reads)
+
+    def execute(self, *args):
+        conn = getattr(self._local, 'conn', None)
+        for attempt in (0, 1):
+            if conn is None:
+                conn = self._local.conn = self.connect()
+            try:
+                return conn.execute(*args)
+            except (ConnectionError, OSError):
+                conn.close()
+                conn = self._local.conn = None
+                if attempt:
+                    raise
@@ -0,0 +1,217 @@
+"""
+response_parser.py
+Parsing of Gemini's sectioned reply format:
+    TRANSCRIPT: / DATA: / COMMAND: / RESPONSE_TEXT: / RESPONSE_AUDIO:
+A single pass over the section headers (all patterns compiled once at
+import) splits the reply; ParsedResponse is the typed result used by
+GeminiService for both buffered and streamed turns.
+IncrementalResponseParser consumes the reply as it streams in and reports
+each section as soon as the next header shows that it is complete, so the
+call socket can forward the transcript and cart before the model has
+finished writing the spoken reply. SentenceChunker turns the streaming
+RESPONSE_AUDIO text into speakable sentences for TTS.
+
+Benchmark: python scripts/bench_response_parser.py
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# Sections appear in this order; a header only opens a new section if it
+# ranks after the current one, so words like "data:" inside a reply are text.
+SECTION_RANKS = {
+    'TRANSCRIPT': 0,
+    'DATA': 1,
+    'COMMAND': 2,
+    'RESPONSE_TEXT': 3,
+    'RESPONSE': 3,        # older single-response format
+    'RESPONSE_AUDIO': 4,
+}
+
+# Header at the start of a line, tolerating markdown decoration ("**DATA:**")
+_HEADER_RE = re.compile(
+    r'^[ \t*#>_]*(RESPONSE_AUDIO|RESPONSE_TEXT|RESPONSE|TRANSCRIPT|DATA|COMMAND)[ \t*_]*:[ \t*_]*',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Sentence ends: . ! ? (and the danda some Indic text uses), followed by space
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?।])\s+')
+
+_FENCE_RE = re.compile(r'```(?:json)?', re.IGNORECASE)
+_TRAILING_FENCE_RE = re.compile(r'```.*', re.DOTALL)
+_WORD_RE = re.compile(r'\w+')
+_PAREN_RE = re.compile(r'\(.*?\)')
+_MARKUP_RE = re.compile(r'[#\*`]')
+
+# Fragments shorter than this are merged into the next sentence; very short
+# clips sound choppy and cost a full synthesis round trip each.
+MIN_SENTENCE_CHARS = 24
+
+
+class IncrementalResponseParser:
+    """
+    feed() text chunks as they arrive; it returns the (name, text) sections
+    completed by that chunk. close() returns whatever was still open.
+    While RESPONSE_AUDIO (always the last section) is streaming, take_audio()
+    returns the text that arrived since the previous call.
+    """
+
+    def __init__(self):
+        self.raw = ''
+        self.sections = {}
+        self._current = None        # name of the open section
+        self._content_start = 0     # where the open section's text begins
+        self._scan_pos = 0          # headers before this have been handled
+        self._audio_taken = 0       # offset into raw already returned by take_audio()
+
+    def feed(self, chunk):
+        if not chunk:
+            return []
+        self.raw += chunk
+        completed = []
+        rank = SECTION_RANKS.get(self._current, -1)
+        for m in _HEADER_RE.finditer(self.raw, self._scan_pos):
+            name = m.group(1).upper()
+            if SECTION_RANKS[name] <= rank:
+                continue
+            if self._current is not None:
+                completed.append(self._complete(self.raw[self._content_start:m.start()]))
+            self._current = name
+            self._content_start = m.end()
+            self._scan_pos = m.end()
+            rank = SECTION_RANKS[name]
+            if name == 'RESPONSE_AUDIO':
+                self._audio_taken = m.end()
+                break  # nothing can follow it
+        if self._current != 'RESPONSE_AUDIO':
+            # Re-scan the unfinished last line next time; a header may be split across chunks
+            self._scan_pos = max(self._scan_pos, self.raw.rfind('\n') + 1)
+        return completed
+
+    def take_audio(self):
+        if self._current != 'RESPONSE_AUDIO':
+            return ''
+        delta = self.raw[self._audio_taken:]
+        self._audio_taken = len(self.raw)
+        return delta
+
+    def close(self):
+        if self._current is None:
+            return []
+        completed = [self._complete(self.raw[self._content_start:])]
+        self._current = None
+        return completed
+
+    def _complete(self, text):
+        section = (self._current, text.strip())
+        self.sections[self._current] = section[1]
+        return section
+
+
+def clean_for_speech(text):
+    """Drop parenthesised asides and markdown symbols from a reply before it is shown or spoken."""
+    return _MARKUP_RE.sub('', _PAREN_RE.sub('', text)).strip()
+
+
+def parse_data(text):
+    """Decode a DATA section. Returns (dict or None, error message or None)."""
+    try:
+        return json.loads(_FENCE_RE.sub('', text).strip()), None
+    except ValueError as e:
+        return None, str(e)
+
+
+@dataclass
+class ParsedResponse:
+    transcript: str = ''
+    data_text: Optional[str] = None   # raw DATA section, None if the model sent none
+    data: Optional[dict] = None       # decoded DATA JSON
+    data_error: Optional[str] = None
+    command: str = 'NONE'
+    ai_text: str = ''                 # on-screen reply (uncleaned)
+    ai_audio: str = ''                # spoken reply (uncleaned)
+
+    @classmethod
+    def from_sections(cls, sections, raw, decode_data=True):
+        if 'RESPONSE_TEXT' not in sections and 'RESPONSE_AUDIO' not in sections:
+            # Fallback to RESPONSE if the model ignores the split-response instructions
+            ai_text = ai_audio = sections.get('RESPONSE') or raw.strip()
+        else:
+            ai_text = sections.get('RESPONSE_TEXT', '')
+            ai_audio = sections.get('RESPONSE_AUDIO') or ai_text
+        command = _WORD_RE.search(sections.get('COMMAND', ''))
+        parsed = cls(
+            transcript=sections.get('TRANSCRIPT', ''),
+            data_text=sections.get('DATA'),
+            command=command.group(0).upper() if command else 'NONE',
+            ai_text=_TRAILING_FENCE_RE.sub('', ai_text).strip(),
+            ai_audio=ai_audio,
+        )
+        if decode_data and parsed.data_text is not None:
+            parsed.data, parsed.data_error = parse_data(parsed.data_text)
+        return parsed
+
+
+def split_sections(raw):
+    """Single pass over the section headers. Returns {section name: stripped text}."""
+    sections = {}
+    current, start, rank = None, 0, -1
+    for m in _HEADER_RE.finditer(raw):
+        name = m.group(1).upper()
+        if SECTION_RANKS[name] <= rank:
+            continue
+        if current is not None:
+            sections[current] = raw[start:m.start()].strip()
+        current, start, rank = name, m.end(), SECTION_RANKS[name]
+        if name == 'RESPONSE_AUDIO':
+            break
+    if current is not None:
+        sections[current] = raw[start:].strip()
+    return sections
+
+
+def parse_response(raw):
+    """Parse a complete Gemini reply into a ParsedResponse."""
+    return ParsedResponse.from_sections(split_sections(raw or ''), raw or '')
+
+
+class SentenceChunker:
+    """Accumulates streaming text and hands out complete sentences, merging very short ones."""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._tail = ''      # text after the last sentence end seen so far
+        self._pending = ''   # complete but too-short sentences waiting to be merged
+
+    def feed(self, text):
+        self._tail += text
+        parts = _SENTENCE_END_RE.split(self._tail)
+        self._tail = parts.pop()
+        ready = []
+        for part in parts:
+            part = part.strip()
+            if not part:
+                continue
+            self._pending = f"{self._pending} {part}" if self._pending else part
+            if len(self._pending) >= self.min_chars:
+                ready.append(self._pending)
+                self._pending = ''
+        return ready
+
+    def close(self):
+        rest = ' '.join(p for p in (self._pending, self._tail.strip()) if p)
+        self._pending = self._tail = ''
+        return [rest] if rest else []
+
+
+def split_sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """Split a complete reply into speakable sentences, merging fragments that are too short."""
+    chunker = SentenceChunker(min_chars)
+    sentences = chunker.feed((text or '').strip())
+    rest = chunker.close()
+    if rest and sentences and len(rest[0]) < min_chars:
+        sentences[-1] = f"{sentences[-1]} {rest[0]}"
+    else:
+        sentences += rest
+    return sentences
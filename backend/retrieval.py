@@ -0,0 +1,196 @@
+"""
+retrieval.py
+Relevance filtering of the inventory context sent to Gemini.
+For large catalogs, shipping every product on every turn makes prompt
+size (and model latency) grow with SKU count. This module picks the
+products that matter for the current turn: items named in the
+utterance (English or Malayalam), whole categories the user asks about
+or that a mentioned recipe needs, everything already in the cart, the
+products named in the last couple of turns, and the user's frequent /
+essential items — trimmed to a token budget.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from search_index import product_index
+
+# Catalogs at or below this size always get the full list
+FULL_CONTEXT_MAX_PRODUCTS = int(os.getenv("FULL_CONTEXT_MAX_PRODUCTS", "150"))
+
+# Approximate prompt-token budget for the filtered inventory section
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Search-index candidates taken per utterance term, and their minimum similarity
+MATCHES_PER_TERM = 5
+MIN_MATCH_SCORE = 0.5
+
+# Recent chat lines ("User: ..." / "Model: ...", i.e. the last two exchanges)
+# whose products stay pinned, so follow-ups like "and onions too" keep the
+# item under discussion; at most RECENT_PINS of them, newest lines first
+RECENT_TURN_LINES = 4
+RECENT_PINS = 8
+LINE_CACHE_SIZE = 1024
+
+# Dishes mapped to the categories whose items the assistant usually adds
+RECIPE_CATEGORIES = {
+    "curry": ("Spices", "Oils", "Vegetables", "Meat"),
+    "കറി": ("Spices", "Oils", "Vegetables", "Meat"),
+    "biryani": ("Rice", "Spices", "Meat", "Vegetables", "Oils", "Dairy"),
+    "ബിരിയാണി": ("Rice", "Spices", "Meat", "Vegetables", "Oils", "Dairy"),
+    "sambar": ("Vegetables", "Spices", "Pantry", "Oils"),
+    "സാമ്പാർ": ("Vegetables", "Spices", "Pantry", "Oils"),
+    "avial": ("Vegetables", "Spices", "Dairy", "Oils"),
+    "അവിയൽ": ("Vegetables", "Spices", "Dairy", "Oils"),
+    "payasam": ("Dairy", "Pantry", "Cereals"),
+    "പായസം": ("Dairy", "Pantry", "Cereals"),
+    "breakfast": ("Cereals", "Dairy", "Beverages", "Fruits"),
+    "salad": ("Vegetables", "Fruits"),
+    "tea": ("Beverages", "Dairy", "Pantry"),
+    "ചായ": ("Beverages", "Dairy", "Pantry"),
+}
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "for", "in", "on", "with", "some",
+    "i", "me", "my", "we", "you", "your", "it", "is", "are", "be", "do", "does",
+    "want", "need", "like", "would", "please", "add", "give", "get", "buy", "can",
+    "have", "has", "any", "also", "more", "less", "kg", "kilo", "kilos", "gram",
+    "grams", "packet", "packets", "pcs", "one", "two", "three", "half", "what",
+    "how", "much", "many", "remove", "cart", "yes", "no", "ok", "okay",
+}
+
+_line_matches = OrderedDict()   # (catalog version, history line) -> product ids
+_line_lock = threading.Lock()
+
+_SPLIT_RE = re.compile(r"[\s\.,!?;:/()\[\]\-\"'&+]+")
+
+
+def tokenize(text):
+    """Split on whitespace/punctuation only (Malayalam vowel signs are not \\w)."""
+    return [t for t in _SPLIT_RE.split((text or "").casefold()) if t]
+
+
+def _terms(text):
+    return [t for t in tokenize(text) if t not in STOPWORDS and (len(t) >= 3 or not t.isascii())]
+
+
+def _token_match(a, b):
+    # Prefix match tolerates plurals / inflections ("tomato" vs "tomatoes")
+    if len(a) < 3 or len(b) < 3:
+        return a == b
+    return a.startswith(b) or b.startswith(a)
+
+
+def estimate_tokens(text):
+    # ~4 UTF-8 bytes per token; Malayalam (3 bytes/char) naturally costs more
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def score_products(catalog, query):
+    """Return ({product_id: score}, {category}) for products/categories the query mentions."""
+    terms = _terms(query)
+    if not terms:
+        return {}, set()
+
+    categories = set()
+    for cat in catalog.by_category:
+        cat_terms = tokenize(cat)
+        if any(_token_match(t, ct) for t in terms for ct in cat_terms):
+            categories.add(cat)
+    for t in terms:
+        for dish, cats in RECIPE_CATEGORIES.items():
+            if _token_match(t, dish):
+                categories.update(c for c in cats if c in catalog.by_category)
+
+    # Product names come from the bilingual search index; single terms and
+    # adjacent pairs ("coconut oil", "manjal podi") are looked up separately.
+    phrases = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    return _name_scores(catalog, phrases), categories
+
+
+def _name_scores(catalog, phrases):
+    scores = {}
+    for phrase in phrases:
+        for pid, score in product_index.search_ids(phrase, limit=MATCHES_PER_TERM, min_score=MIN_MATCH_SCORE):
+            if pid in catalog.by_id and score > scores.get(pid, 0.0):
+                scores[pid] = score
+    return scores
+
+
+def _line_product_ids(catalog, line):
+    # A line stays in the window for two turns, so its matches are memoized
+    # per catalog version. Single terms are enough to spot a named product.
+    key = (catalog.version, line)
+    with _line_lock:
+        ids = _line_matches.get(key)
+    if ids is None:
+        scores = _name_scores(catalog, dict.fromkeys(_terms(line.split(": ", 1)[-1])))
+        ids = sorted(scores, key=lambda pid: -scores[pid])
+        with _line_lock:
+            _line_matches[key] = ids
+            while len(_line_matches) > LINE_CACHE_SIZE:
+                _line_matches.popitem(last=False)
+    return ids
+
+
+def recent_product_ids(catalog, history):
+    """Ids of the products named in the last RECENT_TURN_LINES history lines, newest first."""
+    ids = []
+    for line in reversed(history[-RECENT_TURN_LINES:]):
+        ids += [pid for pid in _line_product_ids(catalog, line) if pid not in ids]
+    return ids[:RECENT_PINS]
+
+
+def select_products(catalog, query, pinned_ids=(), suggested_ids=(), token_budget=None, render_line=None,
+                    history=()):
+    """
+    Pick the products to show the model for this turn.
+    Priority: pinned (cart, then products named in the last couple of
+    turns of `history`) > named in the utterance > mentioned categories /
+    recipes > suggested (frequent / essentials). Pinned items are never
+    dropped; the rest stop once the token budget is used up.
+    Returns a list of products in catalog order, or None when the
+    utterance names no product or category — a follow-up like "two kilos"
+    or "the 5 kg one" (caller should use the full list).
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    by_id = catalog.by_id
+    scores, categories = score_products(catalog, query)
+    if not scores and not categories:
+        return None
+    pinned = [pid for pid in pinned_ids if pid in by_id] + recent_product_ids(catalog, history)
+
+    ordered = list(dict.fromkeys(pinned))
+    ordered += sorted((pid for pid in scores if pid not in pinned), key=lambda pid: -scores[pid])
+    for cat, products in catalog.by_category.items():
+        if cat in categories:
+            ordered += [p['id'] for p in products]
+    ordered += [pid for pid in suggested_ids if pid in by_id]
+
+    chosen = set()
+    used = 0
+    for pid in ordered:
+        if pid in chosen:
+            continue
+        cost = estimate_tokens(render_line(by_id[pid])) if render_line else 12
+        if pid not in pinned and used + cost > budget:
+            continue
+        chosen.add(pid)
+        used += cost
+
+    return [p for p in catalog.products if p['id'] in chosen]
+
+
+def cart_product_ids(items):
+    """Product ids from a cart list, tolerant of the id/product_id/item_id aliases."""
+    ids = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        pid_raw = item.get('id') or item.get('product_id') or item.get('item_id')
+        try:
+            ids.append(int(pid_raw))
+        except (ValueError, TypeError):
+            continue
+    return ids
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark for response_parser.parse_response against the regex
+chain _handle_ai_logic used before it, over a corpus of recorded Gemini
+replies (one {"raw": ...} JSON object per line).
+
+Usage (from backend/):
+    python scripts/bench_response_parser.py [corpus.jsonl] [iterations]
+"""
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+# Ensure we are in the backend directory context if run from scripts/
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from response_parser import clean_for_speech, parse_response
+
+DEFAULT_CORPUS = os.path.join(CURRENT_DIR, 'gemini_responses_sample.jsonl')
+
+
+def legacy_parse(raw_text):
+    """The previous per-turn parsing in _handle_ai_logic, kept here for comparison."""
+    t_match = re.search(r'TRANSCRIPT:\s*(.*)', raw_text, re.IGNORECASE)
+    d_match = re.search(r'DATA:\s*(.*?)(?=\s*COMMAND:|\Z)', raw_text, re.DOTALL | re.IGNORECASE)
+    c_match = re.search(r'COMMAND:\s*(\w+)', raw_text, re.IGNORECASE)
+    r_text_match = re.search(r'RESPONSE_TEXT:\s*(.*?)(?=\s*RESPONSE_AUDIO:|\Z)', raw_text, re.DOTALL | re.IGNORECASE)
+    r_audio_match = re.search(r'RESPONSE_AUDIO:\s*(.*)', raw_text, re.DOTALL | re.IGNORECASE)
+    if not r_text_match and not r_audio_match:
+        r_fallback = re.search(r'RESPONSE:\s*(.*)', raw_text, re.DOTALL | re.IGNORECASE)
+        ai_text = ai_audio = r_fallback.group(1).strip() if r_fallback else raw_text
+    else:
+        ai_text = r_text_match.group(1).strip() if r_text_match else ""
+        ai_audio = r_audio_match.group(1).strip() if r_audio_match else ai_text
+    transcript = t_match.group(1).strip() if t_match else ""
+    ai_text = re.sub(r'TRANSCRIPT:.*?\n', '', ai_text, flags=re.DOTALL | re.IGNORECASE)
+    ai_text = re.sub(r'DATA:.*?```', '', ai_text, flags=re.DOTALL | re.IGNORECASE)
+    ai_text = re.sub(r'COMMAND:.*?\n', '', ai_text, flags=re.IGNORECASE)
+    ai_text = ai_text.replace('RESPONSE_TEXT:', '').strip()
+    ai_text = re.sub(r'```.*', '', ai_text, flags=re.DOTALL).strip()
+    ai_audio = ai_audio.replace('RESPONSE_AUDIO:', '').strip()
+    data = None
+    if d_match:
+        json_str = d_match.group(1).strip().replace('```json', '').replace('```', '').strip()
+        try:
+            data = json.loads(json_str)
+        except ValueError:
+            pass
+    command = c_match.group(1).strip() if c_match else "NONE"
+    clean_text = re.sub(r'[#\*`]', '', re.sub(r'\(.*?\)', '', ai_text)).strip()
+    clean_audio = re.sub(r'[#\*`]', '', re.sub(r'\(.*?\)', '', ai_audio)).strip()
+    return transcript, data, command, clean_text, clean_audio
+
+
+def current_parse(raw_text):
+    parsed = parse_response(raw_text)
+    return (parsed.transcript, parsed.data, parsed.command,
+            clean_for_speech(parsed.ai_text), clean_for_speech(parsed.ai_audio))
+
+
+def bench(fn, corpus, iterations):
+    samples = []
+    for _ in range(iterations):
+        for raw in corpus:
+            start = time.perf_counter_ns()
+            fn(raw)
+            samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return {
+        'mean_us': statistics.fmean(samples) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[int(len(samples) * 0.99)] / 1000,
+    }
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CORPUS
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with open(path, encoding='utf-8') as f:
+        corpus = [json.loads(line)['raw'] for line in f if line.strip()]
+
+    print(f"Corpus: {len(corpus)} replies x {iterations} iterations")
+    for name, fn in (('legacy regex chain', legacy_parse), ('parse_response', current_parse)):
+        fn(corpus[0])  # warm up (legacy compiles its patterns on first use)
+        r = bench(fn, corpus, iterations)
+        print(f"  {name:<20} mean {r['mean_us']:7.1f} us   p50 {r['p50_us']:7.1f} us   p99 {r['p99_us']:7.1f} us")
+
+    diffs = [i for i, raw in enumerate(corpus) if legacy_parse(raw) != current_parse(raw)]
+    if diffs:
+        print(f"Replies parsed differently from the legacy chain: {diffs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark for the Malayalam TTS preprocessing in tts_text.py against
+the sequential str.replace loop and per-character language check it
+replaced, on long mixed Malayalam / English replies.
+
+Usage (from backend/):
+    python scripts/bench_tts_text.py [reply_words] [extra_products] [iterations]
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+# Ensure we are in the backend directory context if run from scripts/
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from response_parser import clean_for_speech, parse_response
+from tts_text import ML_TTS_REPLACEMENTS, PhoneticMatcher, detect_tts_lang, product_terms
+
+RECORDED_REPLIES = os.path.join(CURRENT_DIR, 'gemini_responses_sample.jsonl')
+
+WORDS = (
+    "ശരി , ഞാൻ നിങ്ങളുടെ Cart ലേക്ക് 2 kg Basmati Rice ചേർത്തു . Chicken Masala 1 packet ഉം ."
+    " ആകെ തുക 450 രൂപ ആണ് . Milma പാൽ വേണോ ? Apple , Banana , Mango എന്നിവയും ഉണ്ട് ."
+    " Welcome back to CartTalk ! Coriander Powder ഇപ്പോൾ സ്റ്റോക്കിൽ ഇല്ല ."
+).split()
+
+
+def legacy_lexicon(lexicon):
+    """The old table listed lower-case variants separately; str.replace is case-sensitive."""
+    table = {}
+    for term, spoken in lexicon.items():
+        table[term] = spoken
+        table[term.lower()] = spoken
+    return table
+
+
+def legacy_rewrite(text, table):
+    for eng, mal in table.items():
+        text = text.replace(eng, mal)
+    return text
+
+
+def legacy_detect(text):
+    return 'ml' if any('\u0D00' <= c <= '\u0D7F' for c in text) else 'en'
+
+
+def bench(fn, texts, iterations):
+    samples = []
+    for _ in range(iterations):
+        for text in texts:
+            start = time.perf_counter_ns()
+            fn(text)
+            samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return {
+        'mean_us': statistics.fmean(samples) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[int(len(samples) * 0.99)] / 1000,
+    }
+
+
+def report(name, result):
+    print(f"  {name:<24} mean {result['mean_us']:8.1f} us   p50 {result['p50_us']:8.1f} us   p99 {result['p99_us']:8.1f} us")
+
+
+def main():
+    reply_words = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    extra_products = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    rng = random.Random(7)
+    texts = [' '.join(rng.choice(WORDS) for _ in range(reply_words)) for _ in range(20)]
+    products = [{'name_en': f"Brand{i} Item{i}", 'name_ml': f"ബ്രാൻഡ് {i}"} for i in range(extra_products)]
+    print(f"{len(texts)} replies of {reply_words} words (~{len(texts[0])} chars) x {iterations} iterations")
+
+    for label, lexicon in (("built-in lexicon", ML_TTS_REPLACEMENTS),
+                           (f"+ {extra_products} products", {**ML_TTS_REPLACEMENTS, **product_terms(products)})):
+        table = legacy_lexicon(lexicon)
+        matcher = PhoneticMatcher(lexicon)
+        print(f"{label} ({len(table)} legacy entries, {matcher.size} terms):")
+        report("str.replace loop", bench(lambda t: legacy_rewrite(t, table), texts, iterations))
+        report("Aho-Corasick rewrite", bench(matcher.rewrite, texts, iterations))
+
+    with open(RECORDED_REPLIES, encoding='utf-8') as f:
+        spoken = [clean_for_speech(parse_response(json.loads(line)['raw']).ai_audio) for line in f if line.strip()]
+    recorded = [text for text in spoken if detect_tts_lang(text) == 'ml']
+    table, matcher = legacy_lexicon(ML_TTS_REPLACEMENTS), PhoneticMatcher(ML_TTS_REPLACEMENTS)
+    print(f"recorded Malayalam replies ({len(recorded)}, built-in lexicon):")
+    report("str.replace loop", bench(lambda t: legacy_rewrite(t, table), recorded, iterations * 10))
+    report("Aho-Corasick rewrite", bench(matcher.rewrite, recorded, iterations * 10))
+
+    english = [t.encode('ascii', 'ignore').decode() for t in texts]
+    print("language detection (English reply, worst case for the old scan):")
+    report("per-character generator", bench(legacy_detect, english, iterations))
+    report("detect_tts_lang", bench(detect_tts_lang, english, iterations))
+
+
+if __name__ == "__main__":
+    main()
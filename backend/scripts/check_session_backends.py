@@ -0,0 +1,199 @@
+"""
+Round-trip check for the shared session backends in sessions.py, as two
+workers would use them: a call started on one worker is picked up, changed
+and ended on the other. The Redis backend runs against a minimal RESP
+stand-in started by this script (GET / SET EX / DEL), so no server is
+needed; the SQLite backend uses a scratch database file.
+
+Also checks that a slow backend never holds up the event loop, that
+concurrent touches are coalesced, and that end() during an in-flight save
+still leaves nothing behind.
+
+Usage (from backend/):
+    python scripts/check_session_backends.py
+"""
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Ensure we are in the backend directory context if run from scripts/
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import db_pool
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='cartalk-sessions-')
+db_pool.DB_FILE = os.path.join(SCRATCH_DIR, 'sessions.db')
+
+from migrations import migrate
+from sessions import RedisSessionBackend, SessionStore, SQLiteSessionBackend
+
+failures = []
+
+
+def check(label, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        failures.append(label)
+
+
+# ─── RESP stand-in ───────────────────────────────────────────
+
+class RespStandIn:
+    """Just enough of the Redis protocol for RedisSessionBackend."""
+
+    def __init__(self):
+        self.store = {}
+        self.lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        f = conn.makefile('rb')
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                size = int(f.readline()[1:-2])
+                args.append(f.read(size + 2)[:-2])
+            conn.sendall(self._command(args[0].upper(), args[1:]))
+
+    def _command(self, cmd, args):
+        with self.lock:
+            if cmd == b'GET':
+                value, expires = self.store.get(args[0], (None, None))
+                if value is not None and expires is not None and expires < time.time():
+                    del self.store[args[0]]
+                    value = None
+                return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+            if cmd == b'SET':
+                ttl = int(args[3]) if len(args) > 3 and args[2].upper() == b'EX' else None
+                self.store[args[0]] = (args[1], time.time() + ttl if ttl else None)
+                return b'+OK\r\n'
+            if cmd == b'DEL':
+                return b':%d\r\n' % (self.store.pop(args[0], None) is not None)
+            if cmd == b'PING':
+                return b'+PONG\r\n'
+            return b'-ERR unknown command\r\n'
+
+
+# ─── Checks ──────────────────────────────────────────────────
+
+class SlowBackend:
+    """Wraps a backend so every call blocks for `delay` seconds."""
+
+    def __init__(self, backend, delay):
+        self.inner, self.delay = backend, delay
+        self.name, self.shared = backend.name, True
+        self.saves = 0
+
+    async def run(self, fn, *args):
+        return await self.inner.run(fn, *args)
+
+    def load(self, call_id):
+        time.sleep(self.delay)
+        return self.inner.load(call_id)
+
+    def save(self, call_id, payload, ttl):
+        time.sleep(self.delay)
+        self.saves += 1
+        self.inner.save(call_id, payload, ttl)
+
+    def delete(self, call_id):
+        time.sleep(self.delay)
+        self.inner.delete(call_id)
+
+
+async def max_loop_gap(coro):
+    """Run `coro` while measuring the longest stall of the event loop."""
+    gap, stop = 0.0, False
+
+    async def ticker():
+        nonlocal gap
+        last = time.perf_counter()
+        while not stop:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gap = max(gap, now - last)
+            last = now
+
+    tick = asyncio.create_task(ticker())
+    await coro
+    stop = True
+    await tick
+    return gap
+
+
+async def check_backend(backend):
+    print(f"{backend.name}:")
+    worker_a, worker_b = SessionStore(backend=backend), SessionStore(backend=backend)
+
+    await worker_a.start('call-1', user_id='9000000001')
+    check("start() writes only to the backend", len(worker_a) == 0 and backend.load('call-1') is not None)
+
+    session = await worker_b.get_or_create('call-1')
+    check("the other worker loads the session", session.user_id == '9000000001' and worker_b.stats()['loaded'] == 1)
+
+    session.history.append("User: രണ്ട് കിലോ അരി")
+    session.data['cart'] = [{'id': 1, 'name': 'Basmati Rice', 'quantity': 2}]
+    await worker_b.touch(session)
+    again = await worker_a.get('call-1')
+    check("a touch is visible to the first worker", again is not None and again.history == session.history
+          and again.cart == session.cart)
+
+    await worker_b.end('call-1')
+    check("end() deletes it from the backend", backend.load('call-1') is None)
+
+    slow = SlowBackend(backend, 0.1)
+    store = SessionStore(backend=slow)
+    session = await store.get_or_create('call-2')
+
+    async def turns():
+        await asyncio.gather(*(store.touch(session) for _ in range(10)))
+        while store._writing:
+            await asyncio.sleep(0.01)
+
+    gap = await max_loop_gap(turns())
+    check(f"slow backend does not stall the loop (max gap {gap * 1000:.0f} ms)", gap < 0.05)
+    check(f"10 concurrent touches coalesced into {slow.saves} writes", slow.saves <= 2)
+
+    session.data['cart'] = ['late']
+    touching = asyncio.create_task(store.touch(session))
+    await asyncio.sleep(0.02)  # the write is now in flight
+    await store.end('call-2')
+    await touching
+    check("end() during an in-flight save leaves nothing behind", backend.load('call-2') is None)
+
+
+async def main():
+    migrate()
+    await check_backend(SQLiteSessionBackend())
+    standin = RespStandIn()
+    await check_backend(RedisSessionBackend(f"redis://127.0.0.1:{standin.port}/0"))
+    print("All checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    try:
+        status = asyncio.run(main())
+    finally:
+        db_pool.close_all()
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    sys.exit(status)
@@ -1,6 +1,11 @@
+import os
 import sqlite3
+import sys
 import json
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics import rebuild_aggregates
+
 db_file = 'cartalk.db'
 conn = sqlite3.connect(db_file)
 c = conn.cursor()
@@ -29,6 +34,9 @@ for o in orders:
     total = c.fetchone()[0] or 0.0
     c.execute('UPDATE orders SET total = ? WHERE id = ?', (total, oid))
 
+# Revenue aggregates were built from the old totals
+rebuild_aggregates(c)
+
 conn.commit()
 conn.close()
 print("Fixed DB prices and totals!")
@@ -6,6 +6,10 @@ import sys
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.dirname(CURRENT_DIR)
 DB_PATH = os.path.join(BACKEND_DIR, 'cartalk.db')
+sys.path.insert(0, BACKEND_DIR)
+
+from analytics import rebuild_aggregates
+from purchase_profile import rebuild_purchase_profiles
 
 def reset_and_seed():
     if not os.path.exists(DB_PATH):
@@ -45,6 +49,10 @@ def reset_and_seed():
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', premium_products)
 
+        # Product sales and purchase profiles refer to the order items cleared above
+        rebuild_aggregates(c)
+        rebuild_purchase_profiles(c)
+
         conn.commit()
         print(f"Success! {len(premium_products)} beautiful products seeded.")
 
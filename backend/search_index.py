@@ -0,0 +1,340 @@
+"""
+search_index.py
+Bilingual (English + Malayalam) fuzzy product name search for CartTalk.
+Each product is indexed under its English name, its Malayalam name (both
+in script and romanized), the individual words of those names, and its
+category. Text is folded to a phonetic skeleton so that spoken-style
+transliterations ("thakkali", "manjal podi") and Malayalam spellings of
+English names ("ബനാന") still land on the right product. Candidates come
+from a trigram inverted index and are ranked by Dice similarity.
+
+The index is built lazily from the catalog cache and then kept current
+by add_product / update_product / delete_product in db.py.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from itertools import islice
+
+# ─── Malayalam normalization & romanization ─────────────────
+
+VIRAMA = '\u0D4D'
+ZW_CHARS = {'\u200C', '\u200D'}  # ZWNJ / ZWJ
+
+# Atomic chillu letters -> consonant + virama (older text uses that + ZWJ)
+CHILLU = {
+    '\u0D7A': 'ണ' + VIRAMA,  # ൺ
+    '\u0D7B': 'ന' + VIRAMA,  # ൻ
+    '\u0D7C': 'ര' + VIRAMA,  # ർ
+    '\u0D7D': 'ല' + VIRAMA,  # ൽ
+    '\u0D7E': 'ള' + VIRAMA,  # ൾ
+    '\u0D7F': 'ക' + VIRAMA,  # ൿ
+}
+
+ML_VOWELS = {
+    'അ': 'a', 'ആ': 'aa', 'ഇ': 'i', 'ഈ': 'ii', 'ഉ': 'u', 'ഊ': 'uu', 'ഋ': 'ru',
+    'എ': 'e', 'ഏ': 'ee', 'ഐ': 'ai', 'ഒ': 'o', 'ഓ': 'oo', 'ഔ': 'au',
+}
+ML_VOWEL_SIGNS = {
+    'ാ': 'aa', 'ി': 'i', 'ീ': 'ii', 'ു': 'u', 'ൂ': 'uu', 'ൃ': 'ru', 'െ': 'e',
+    'േ': 'ee', 'ൈ': 'ai', 'ൊ': 'o', 'ോ': 'oo', 'ൌ': 'au', 'ൗ': 'au',
+}
+ML_CONSONANTS = {
+    'ക': 'k', 'ഖ': 'kh', 'ഗ': 'g', 'ഘ': 'gh', 'ങ': 'ng', 'ച': 'ch', 'ഛ': 'chh',
+    'ജ': 'j', 'ഝ': 'jh', 'ഞ': 'nj', 'ട': 't', 'ഠ': 'th', 'ഡ': 'd', 'ഢ': 'dh',
+    'ണ': 'n', 'ത': 'th', 'ഥ': 'th', 'ദ': 'd', 'ധ': 'dh', 'ന': 'n', 'പ': 'p',
+    'ഫ': 'ph', 'ബ': 'b', 'ഭ': 'bh', 'മ': 'm', 'യ': 'y', 'ര': 'r', 'റ': 'r',
+    'ല': 'l', 'ള': 'l', 'ഴ': 'zh', 'വ': 'v', 'ശ': 'sh', 'ഷ': 'sh', 'സ': 's',
+    'ഹ': 'h',
+}
+ML_OTHER = {'ം': 'm', 'ഃ': 'h'}
+
+# Latin phonetic folding, applied in order to both English names and romanized Malayalam
+LATIN_FOLDS = (
+    ('ch', '\x00'), ('ck', 'k'), ('c', 'k'), ('\x00', 'c'),
+    ('th', 't'), ('dh', 'd'), ('kh', 'k'), ('gh', 'g'), ('bh', 'b'), ('ph', 'f'),
+    ('sh', 's'), ('zh', 'l'), ('w', 'v'), ('q', 'k'), ('x', 'ks'), ('z', 's'),
+    ('ee', 'i'), ('ii', 'i'), ('oo', 'u'), ('uu', 'u'), ('aa', 'a'),
+)
+_DOUBLE_RE = re.compile(r'([a-z])\1+')
+_NON_LATIN_RE = re.compile(r'[^a-z ]+')
+_SPACE_RE = re.compile(r'\s+')
+_WORD_SPLIT_RE = re.compile(r"[\s\.,!?;:/()\[\]\-\"'&+]+")
+
+
+def has_malayalam(text):
+    return any('\u0D00' <= ch <= '\u0D7F' for ch in text)
+
+
+def normalize_ml(text):
+    """Canonical Malayalam script form: NFC, no ZWJ/ZWNJ, chillus expanded."""
+    text = unicodedata.normalize('NFC', text or '')
+    return ''.join(CHILLU.get(ch, ch) for ch in text if ch not in ZW_CHARS).casefold()
+
+
+@lru_cache(maxsize=65536)
+def romanize_ml(text):
+    """Rough phonetic romanization of Malayalam script (Latin passes through)."""
+    text = normalize_ml(text)
+    out = []
+    n = len(text)
+    for i, ch in enumerate(text):
+        if ch in ML_CONSONANTS:
+            out.append(ML_CONSONANTS[ch])
+            nxt = text[i + 1] if i + 1 < n else ''
+            if nxt not in ML_VOWEL_SIGNS and nxt != VIRAMA:
+                out.append('a')  # inherent vowel
+        elif ch in ML_VOWEL_SIGNS:
+            out.append(ML_VOWEL_SIGNS[ch])
+        elif ch == VIRAMA:
+            # Word-final virama is pronounced as a short 'u' ("ഉപ്പ്" -> "uppu")
+            nxt = text[i + 1] if i + 1 < n else ' '
+            if nxt.isspace():
+                out.append('u')
+        elif ch in ML_VOWELS:
+            out.append(ML_VOWELS[ch])
+        elif ch in ML_OTHER:
+            out.append(ML_OTHER[ch])
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+
+@lru_cache(maxsize=65536)
+def fold_latin(text):
+    """Phonetic skeleton of Latin text: lowercase, digraphs and long vowels folded, doubles collapsed."""
+    text = _NON_LATIN_RE.sub(' ', (text or '').casefold())
+    for src, dst in LATIN_FOLDS:
+        text = text.replace(src, dst)
+    text = _DOUBLE_RE.sub(r'\1', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+@lru_cache(maxsize=65536)
+def trigrams(text):
+    """Padded character trigrams of each word in text."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return frozenset(grams)
+
+
+# ─── Index ───────────────────────────────────────────────────
+
+# Single-word and category matches rank below whole-name matches
+WORD_WEIGHT = 0.95
+CATEGORY_WEIGHT = 0.8
+
+# Upper bound on fuzzy candidates scored per query form. Candidates are
+# drawn from the rarest trigrams first, which keeps latency flat on big
+# catalogs where a common word ("milk") appears in thousands of names.
+MAX_CANDIDATES = 256
+
+
+class ProductSearchIndex:
+    """
+    Every searchable string of a product (full names, their words, the
+    category) is an index "key" with its own id. Keys are reachable by exact
+    folded text and through a trigram -> key-id inverted index.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built = False
+        self._pending = {}     # product id -> fields or None (removed), changed before the build finished
+        self._next_kid = 0
+        self._fields = {}      # product id -> (name_en, name_ml, category)
+        self._pid_keys = {}    # product id -> [key ids]
+        self._keys = {}        # key id -> (product id, text, gram set, weight)
+        self._exact = {}       # key text -> set(key ids)
+        self._postings = {}    # trigram -> set(key ids)
+
+    # ── building ──
+    @staticmethod
+    def _key_texts(name_en, name_ml, category):
+        texts = []
+
+        def add(text, weight, min_word):
+            if not text:
+                return
+            texts.append((text, weight))
+            words = text.split()
+            if len(words) > 1:
+                texts.extend((w, weight * WORD_WEIGHT) for w in words if len(w) >= min_word)
+
+        add(fold_latin(name_en), 1.0, 3)
+        if name_ml:
+            add(normalize_ml(' '.join(_WORD_SPLIT_RE.split(name_ml)).strip()), 1.0, 2)
+            add(fold_latin(romanize_ml(name_ml)), 1.0, 3)
+        add(fold_latin(category), CATEGORY_WEIGHT, 3)
+        return texts
+
+    def _insert(self, pid, name_en, name_ml, category):
+        self._remove(pid)
+        self._fields[pid] = (name_en or '', name_ml or '', category or '')
+        kids = []
+        seen = set()
+        for text, weight in self._key_texts(name_en or '', name_ml or '', category or ''):
+            if text in seen:
+                continue
+            seen.add(text)
+            kid = self._next_kid
+            self._next_kid += 1
+            grams = trigrams(text)
+            self._keys[kid] = (pid, text, grams, weight)
+            self._exact.setdefault(text, set()).add(kid)
+            for g in grams:
+                self._postings.setdefault(g, set()).add(kid)
+            kids.append(kid)
+        self._pid_keys[pid] = kids
+
+    def _remove(self, pid):
+        self._fields.pop(pid, None)
+        for kid in self._pid_keys.pop(pid, ()):
+            _, text, grams, _ = self._keys.pop(kid)
+            exact = self._exact.get(text)
+            if exact is not None:
+                exact.discard(kid)
+                if not exact:
+                    del self._exact[text]
+            for g in grams:
+                posting = self._postings.get(g)
+                if posting is not None:
+                    posting.discard(kid)
+                    if not posting:
+                        del self._postings[g]
+
+    def ensure_built(self):
+        """Build the index from the catalog if it has not been built yet."""
+        if self._built:
+            return
+        with self._build_lock:
+            if self._built:
+                return
+            from db import get_catalog
+            products = get_catalog().products
+            with self._lock:
+                for p in products:
+                    self._insert(p['id'], p.get('name_en'), p.get('name_ml'), p.get('category'))
+                # Changes committed while (or before) the catalog was read may be
+                # missing from it: replay them on top
+                for pid, fields in self._pending.items():
+                    if fields is None:
+                        self._remove(pid)
+                    else:
+                        self._upsert(pid, *fields)
+                self._pending.clear()
+                self._built = True
+
+    def rebuild(self):
+        """Drop everything and re-index from the current catalog."""
+        with self._lock:
+            self._fields.clear()
+            self._pid_keys.clear()
+            self._keys.clear()
+            self._exact.clear()
+            self._postings.clear()
+            self._pending.clear()
+            self._built = False
+        self.ensure_built()
+
+    # ── incremental maintenance (called from db.py after commit) ──
+    def upsert(self, pid, name_en=None, name_ml=None, category=None):
+        """Add or re-index a product; fields left as None keep their indexed value."""
+        with self._lock:
+            if self._built:
+                self._upsert(pid, name_en, name_ml, category)
+                return
+            # Queued for the build; a partial update merges into an earlier queued one
+            old = self._pending.get(pid) or (None, None, None)
+            self._pending[pid] = (
+                old[0] if name_en is None else name_en,
+                old[1] if name_ml is None else name_ml,
+                old[2] if category is None else category,
+            )
+
+    def _upsert(self, pid, name_en, name_ml, category):
+        old = self._fields.get(pid, ('', '', ''))
+        self._insert(
+            pid,
+            old[0] if name_en is None else name_en,
+            old[1] if name_ml is None else name_ml,
+            old[2] if category is None else category,
+        )
+
+    def remove(self, pid):
+        with self._lock:
+            if self._built:
+                self._remove(pid)
+            else:
+                self._pending[pid] = None
+
+    # ── querying ──
+    def _score_form(self, text, best, min_score):
+        keys = self._keys
+        # Exact key hits (whole name, single word, category) score their full weight
+        for kid in islice(self._exact.get(text, ()), MAX_CANDIDATES):
+            pid, _, _, weight = keys[kid]
+            if weight > best.get(pid, 0.0):
+                best[pid] = weight
+
+        q = trigrams(text)
+        if not q:
+            return
+        candidates = set()
+        for posting in sorted((self._postings.get(g, ()) for g in q), key=len):
+            if not posting:
+                continue
+            room = MAX_CANDIDATES - len(candidates)
+            if room <= 0:
+                break
+            if len(posting) <= room:
+                candidates.update(posting)
+            else:
+                candidates.update(islice(posting, room))
+
+        qlen = len(q)
+        for kid in candidates:
+            pid, _, grams, weight = keys[kid]
+            score = weight * 2.0 * len(q & grams) / (qlen + len(grams))
+            if score >= min_score and score > best.get(pid, 0.0):
+                best[pid] = score
+
+    def search_ids(self, query, limit=10, min_score=0.45):
+        """Return [(product_id, score)] best first."""
+        self.ensure_built()
+        query = ' '.join(_WORD_SPLIT_RE.split(query or '')).strip()
+        if not query:
+            return []
+        forms = []
+        if has_malayalam(query):
+            forms.append(normalize_ml(query))
+            forms.append(fold_latin(romanize_ml(query)))
+        else:
+            forms.append(fold_latin(query))
+
+        best = {}
+        with self._lock:
+            for text in forms:
+                if text:
+                    self._score_form(text, best, min_score)
+        return heapq.nlargest(limit, best.items(), key=lambda kv: kv[1])
+
+    def search(self, query, limit=10, min_score=0.45):
+        """Return matching products (live catalog records plus a 'score'), best first."""
+        from db import get_catalog
+        by_id = get_catalog().by_id
+        results = []
+        for pid, score in self.search_ids(query, limit, min_score):
+            p = by_id.get(pid)
+            if p is not None:
+                results.append(dict(p, score=round(score, 3)))
+        return results
+
+
+product_index = ProductSearchIndex()
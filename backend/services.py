@@ -6,31 +6,46 @@ parsing user intent, maintaining sliding window context,
 managing shopping cart state, and generating Neural TTS audio.
 """
 import os
+import re
+import sqlite3
+import threading
 from datetime import datetime
 from google import genai
-from db import get_products, create_order, get_orders
-from db import validate_cart_stock
-try:
-    import edge_tts
-    USE_EDGE_TTS = True
-    print("Using edge-tts (Neural voices)")
-except ImportError:
-    USE_EDGE_TTS = False
-    print("edge-tts not found, falling back to gTTS")
-from gtts import gTTS
-from io import BytesIO
+from db import get_products, get_catalog, create_order, get_orders
+from analytics import read_order_summary, read_top_products
+from db_pool import connection
+import db_async
+from retrieval import FULL_CONTEXT_MAX_PRODUCTS, select_products
+from response_parser import (
+    IncrementalResponseParser, ParsedResponse, SentenceChunker,
+    clean_for_speech, parse_data, parse_response,
+)
+from tts_cache import tts_cache, cache_key
+from tts_pool import USE_EDGE_TTS, TTSOverloaded, tts_pool
+from tts_text import prepare_tts_text
+from sessions import session_store
+from user_context import user_contexts
+
+_QTY_RE = re.compile(r'[\d\.]+')
+
+TTS_VOICES = {'ml': 'ml-IN-SobhanaNeural', 'en': 'en-US-AriaNeural'}
+
+
+def greeting_line(user_id):
+    """The exact opening of a call's first reply (forced by _build_prompt)."""
+    return "Welcome back to CartTalk!" if user_id else "Welcome to CartTalk!"
+
 
 class GeminiService:
     def __init__(self):
         api_key = os.getenv("GEMINI_API_KEY")
         self.client = genai.Client(api_key=api_key)
-        self.histories = {} 
-        self.summaries = {} 
+        # Per-call history, summary and cart live in the bounded session store (sessions.py)
 
     async def process_audio(self, call_id, audio_data, inventory_context, user_id=None):
         """Processes binary audio input (Legacy Support)"""
         try:
-            prompt = self._build_prompt(call_id, inventory_context, user_id)
+            prompt = await self._build_prompt(call_id, inventory_context, user_id)
             response = await self.client.aio.models.generate_content(
                 model="gemini-2.0-flash",
                 contents=[
@@ -47,7 +62,7 @@ class GeminiService:
     async def process_text(self, call_id, user_text, inventory_context, user_id=None):
         """Processes high-speed text input from browser STT (Hybrid Architecture)"""
         try:
-            prompt = self._build_prompt(call_id, inventory_context, user_id)
+            prompt = await self._build_prompt(call_id, inventory_context, user_id)
             # We append the user_text directly to the prompt to maintain the single-request flow
             full_input = f"{prompt}\n\nUSER INPUT: {user_text}"
             response = await self.client.aio.models.generate_content(
@@ -58,10 +73,105 @@ class GeminiService:
         except Exception as e:
             return self._handle_error(e)
 
-    def _build_prompt(self, call_id, inventory_context, user_id):
-        if call_id not in self.histories:
-            self.histories[call_id] = []
-        
+    async def stream_audio(self, call_id, audio_data, inventory_context, user_id=None):
+        """Streaming variant of process_audio (see _stream_turn for the events yielded)"""
+        try:
+            prompt = await self._build_prompt(call_id, inventory_context, user_id)
+        except Exception as e:
+            yield {"type": "result", "result": self._handle_error(e)}
+            return
+        contents = [
+            {"role": "user", "parts": [
+                {"text": prompt},
+                {"inline_data": {"mime_type": "audio/webm", "data": audio_data}}
+            ]}
+        ]
+        async for event in self._stream_turn(call_id, contents, user_id):
+            yield event
+
+    async def stream_text(self, call_id, user_text, inventory_context, user_id=None):
+        """Streaming variant of process_text (see _stream_turn for the events yielded)"""
+        try:
+            prompt = await self._build_prompt(call_id, inventory_context, user_id)
+        except Exception as e:
+            yield {"type": "result", "result": self._handle_error(e)}
+            return
+        full_input = f"{prompt}\n\nUSER INPUT: {user_text}"
+        async for event in self._stream_turn(call_id, [{"role": "user", "parts": [{"text": full_input}]}], user_id):
+            yield event
+
+    async def _stream_turn(self, call_id, contents, user_id):
+        """
+        Stream the model's reply and yield events as soon as each section completes:
+          {"type": "transcript", "text"}                   user's words (English)
+          {"type": "cart", "cart", "stock_violations"}     validated cart from DATA
+          {"type": "response_text", "text"}                on-screen reply
+          {"type": "audio_sentence", "text"}               spoken reply, one sentence at a time
+          {"type": "result", "result"}                     same dict process_text returns (None if empty)
+        """
+        parser = IncrementalResponseParser()
+        chunker = SentenceChunker()
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model="gemini-2.0-flash",
+                contents=contents
+            )
+            async for chunk in stream:
+                for name, text in parser.feed(chunk.text or ""):
+                    event = await self._section_event(call_id, name, text)
+                    if event:
+                        yield event
+                for sentence in chunker.feed(parser.take_audio()):
+                    sentence = clean_for_speech(sentence)
+                    if sentence:
+                        yield {"type": "audio_sentence", "text": sentence}
+
+            for sentence in chunker.feed(parser.take_audio()) + chunker.close():
+                sentence = clean_for_speech(sentence)
+                if sentence:
+                    yield {"type": "audio_sentence", "text": sentence}
+            for name, text in parser.close():
+                event = await self._section_event(call_id, name, text)
+                if event:
+                    yield event
+
+            if not parser.raw:
+                yield {"type": "result", "result": None}
+                return
+            print("Gemini response streamed.")
+            yield {"type": "result", "result": await self._finish_streamed_turn(call_id, user_id, parser)}
+        except Exception as e:
+            yield {"type": "result", "result": self._handle_error(e)}
+
+    async def _section_event(self, call_id, name, text):
+        if name == 'TRANSCRIPT':
+            return {"type": "transcript", "text": text}
+        if name == 'DATA':
+            await self._apply_cart_data(call_id, *parse_data(text))
+            data = (await session_store.get_or_create(call_id)).data
+            return {"type": "cart", "cart": data.get('cart', []), "stock_violations": data.get('stock_violations', [])}
+        if name == 'RESPONSE_TEXT':
+            return {"type": "response_text", "text": clean_for_speech(text)}
+        return None
+
+    async def _finish_streamed_turn(self, call_id, user_id, parser):
+        # DATA was already applied when its section completed
+        parsed = ParsedResponse.from_sections(parser.sections, parser.raw, decode_data=False)
+        return await self._finish_turn(call_id, user_id, parsed.transcript, parsed.ai_text, parsed.ai_audio, parsed.command)
+
+    async def get_session_cart(self, call_id):
+        """Current in-call cart (as last returned by the model) for this call."""
+        session = await session_store.get(call_id)
+        return session.cart if session else []
+
+    async def end_call(self, call_id):
+        """End-of-call hook: drop the call's session and release any stock it still holds."""
+        await session_store.end(call_id)
+        await db_async.release_reservation(call_id)
+
+    async def _build_prompt(self, call_id, inventory_context, user_id):
+        session = await session_store.get_or_create(call_id)
+
         now = datetime.now()
         time_context = now.strftime("%I:%M %p")
 
@@ -106,123 +216,97 @@ CRITICAL RULES:
 Inventory:
 {inventory_context}
 """
-        # User History (Concise)
+        # User History (Concise) — from the call's snapshot (user_context.py)
         if user_id:
-            from db import get_user_frequent_items, get_user_monthly_essentials
-            freq = get_user_frequent_items(user_id)
+            user_ctx = await user_contexts.get(call_id, user_id)
+            freq, ess = user_ctx.frequent, user_ctx.essentials
             if freq: system_instruction += f"\nFrequent: [{', '.join([i['name'] for i in freq])}]"
-            ess = get_user_monthly_essentials(user_id)
             if ess: system_instruction += f"\nEssentials: [{', '.join([i['name'] for i in ess])}]"
 
-        if not self.histories[call_id]:
-            msg = "Welcome back to CartTalk!" if user_id else "Welcome to CartTalk!"
+        if not session.history:
+            msg = greeting_line(user_id)
             system_instruction += f"\n\nSPECIAL INSTRUCTION: This is the START of the call. Regardless of the input language, you MUST respond ONLY in ENGLISH for this turn. Start exactly with '{msg}' then ask how you can help. Do NOT use Malayalam in this turn."
 
-        summary = f"Summary: {self.summaries.get(call_id, '')}\n" if call_id in self.summaries else ""
-        return system_instruction + "\n\n" + summary + "Recent Chat:\n" + "\n".join(self.histories[call_id])
+        summary = f"Summary: {session.summary}\n" if session.summary is not None else ""
+        return system_instruction + "\n\n" + summary + "Recent Chat:\n" + "\n".join(session.history)
 
     async def _handle_ai_logic(self, call_id, raw_text, user_id):
         if not raw_text: return None
         print("Gemini response received.")
 
-        import re
-        import json
-        
-        # Sections
-        t_match = re.search(r'TRANSCRIPT:\s*(.*)', raw_text, re.IGNORECASE)
-        d_match = re.search(r'DATA:\s*(.*?)(?=\s*COMMAND:|\Z)', raw_text, re.DOTALL | re.IGNORECASE)
-        c_match = re.search(r'COMMAND:\s*(\w+)', raw_text, re.IGNORECASE)
-        
-        # New split responses for screen vs audio
-        r_text_match = re.search(r'RESPONSE_TEXT:\s*(.*?)(?=\s*RESPONSE_AUDIO:|\Z)', raw_text, re.DOTALL | re.IGNORECASE)
-        r_audio_match = re.search(r'RESPONSE_AUDIO:\s*(.*)', raw_text, re.DOTALL | re.IGNORECASE)
-        
-        # Fallback to RESPONSE if the model ignores the new prompt instructions
-        if not r_text_match and not r_audio_match:
-            r_fallback = re.search(r'RESPONSE:\s*(.*)', raw_text, re.DOTALL | re.IGNORECASE)
-            ai_response = r_fallback.group(1).strip() if r_fallback else raw_text
-            ai_text = ai_response
-            ai_audio = ai_response
-        else:
-            ai_text = r_text_match.group(1).strip() if r_text_match else ""
-            ai_audio = r_audio_match.group(1).strip() if r_audio_match else ai_text
-
-        transcript = t_match.group(1).strip() if t_match else ""
-        
-        # Remove tags from ai_text if regex missed
-        ai_text = re.sub(r'TRANSCRIPT:.*?\n', '', ai_text, flags=re.DOTALL | re.IGNORECASE)
-        ai_text = re.sub(r'DATA:.*?```', '', ai_text, flags=re.DOTALL | re.IGNORECASE)
-        ai_text = re.sub(r'COMMAND:.*?\n', '', ai_text, flags=re.IGNORECASE)
-        ai_text = ai_text.replace('RESPONSE_TEXT:', '').strip()
-        ai_text = re.sub(r'```.*', '', ai_text, flags=re.DOTALL).strip()
-        
-        ai_audio = ai_audio.replace('RESPONSE_AUDIO:', '').strip()
+        parsed = parse_response(raw_text)
+        if parsed.data_text is not None:
+            await self._apply_cart_data(call_id, parsed.data, parsed.data_error)
+        return await self._finish_turn(call_id, user_id, parsed.transcript, parsed.ai_text, parsed.ai_audio, parsed.command)
 
+    async def _apply_cart_data(self, call_id, extracted, data_error=None):
+        """Merge a decoded DATA section into the session cart, clamp it to live stock and attach live prices."""
         # Session Data Management
-        self.session_data = getattr(self, 'session_data', {})
-        if call_id not in self.session_data: self.session_data[call_id] = {}
-        
-        if d_match:
-            json_str = d_match.group(1).strip().replace('```json', '').replace('```', '').strip()
-            try:
-                extracted = json.loads(json_str)
-                self.session_data[call_id].update(extracted)
-                
-                # ── STOCK VALIDATION: Clamp cart to live DB stock ──
-                raw_cart = self.session_data[call_id].get('cart', [])
-                if raw_cart:
-                    stock_check = validate_cart_stock(raw_cart)
-                    self.session_data[call_id]['cart'] = stock_check['valid_cart']
-                    self.session_data[call_id]['stock_violations'] = stock_check['violations']
-                    if stock_check['violations']:
-                        viol_names = ', '.join(
-                            f"{v['name']} (asked {v['requested']}, only {v['available']} available)"
-                            for v in stock_check['violations']
-                        )
-                        print(f"[STOCK GUARD] Violations found: {viol_names}")
-                else:
-                    self.session_data[call_id]['stock_violations'] = []
-
-                # Enrich cart with live prices
-                from db import get_products
-                db_products = {p['id']: p['price'] for p in get_products()}
-                for item in self.session_data[call_id].get('cart', []):
-                    if isinstance(item, dict):
-                        pid_raw = item.get('id') or item.get('product_id')
-                        try:
-                            if pid_raw is not None and int(pid_raw) in db_products:
-                                item['price'] = db_products[int(pid_raw)]
-                        except (ValueError, TypeError):
-                            pass
-            except Exception as parse_err:
-                print(f"[JSON PARSE ERROR] {parse_err}")
-
-        command = c_match.group(1).strip() if c_match else "NONE"
+        data = (await session_store.get_or_create(call_id)).data
+
+        if data_error is not None:
+            print(f"[JSON PARSE ERROR] {data_error}")
+            return
+        try:
+            data.update(extracted)
+            
+            # ── STOCK VALIDATION: Clamp cart to live DB stock ──
+            raw_cart = data.get('cart', [])
+            if raw_cart:
+                stock_check = await db_async.validate_cart_stock(raw_cart, reservation_id=call_id)
+                data['cart'] = stock_check['valid_cart']
+                data['stock_violations'] = stock_check['violations']
+                if stock_check['violations']:
+                    viol_names = ', '.join(
+                        f"{v['name']} (asked {v['requested']}, only {v['available']} available)"
+                        for v in stock_check['violations']
+                    )
+                    print(f"[STOCK GUARD] Violations found: {viol_names}")
+            else:
+                data['stock_violations'] = []
+
+            # Enrich cart with live prices
+            db_products = (await db_async.get_catalog()).by_id
+            for item in data.get('cart', []):
+                if isinstance(item, dict):
+                    pid_raw = item.get('id') or item.get('product_id')
+                    try:
+                        if pid_raw is not None and int(pid_raw) in db_products:
+                            item['price'] = db_products[int(pid_raw)]['price']
+                    except (ValueError, TypeError):
+                        pass
+        except Exception as parse_err:
+            print(f"[JSON PARSE ERROR] {parse_err}")
+
+    async def _finish_turn(self, call_id, user_id, transcript, ai_text, ai_audio, command):
+        """Act on the command, record history and build the turn result."""
+        session = await session_store.get_or_create(call_id)
+
         if command in ['UPDATE_CART', 'CONFIRM_ORDER'] and user_id:
-            from db import save_cart
-            cart_data = self.session_data[call_id].get('cart', [])
+            cart_data = session.data.get('cart', [])
             if isinstance(cart_data, list):
                 # Clean cart: only keep dicts with an ID
                 clean_cart = [
                     item for item in cart_data 
                     if isinstance(item, dict) and (item.get('id') or item.get('product_id') or item.get('item_id'))
                 ]
-                save_cart(user_id, clean_cart)
+                await db_async.save_cart(user_id, clean_cart)
+                user_contexts.cart_saved(user_id)
                 # Update session with cleaned cart
-                self.session_data[call_id]['cart'] = clean_cart
+                session.data['cart'] = clean_cart
             
         if command == 'CONFIRM_ORDER':
             await self._execute_order(call_id, user_id)
 
         # Update History
-        if transcript: self.histories[call_id].append(f"User: {transcript}")
-        self.histories[call_id].append(f"Model: {ai_text}")
+        if transcript: session.history.append(f"User: {transcript}")
+        session.history.append(f"Model: {ai_text}")
 
         # Keep history manageable with sliding window + background summarization
         MAX_RECENT = 12
-        if len(self.histories[call_id]) > MAX_RECENT + 6:
-            to_summarize = self.histories[call_id][:-MAX_RECENT]
-            self.histories[call_id] = self.histories[call_id][-MAX_RECENT:]
+        if len(session.history) > MAX_RECENT + 6:
+            to_summarize = session.history[:-MAX_RECENT]
+            session.history = session.history[-MAX_RECENT:]
             
             async def run_summary(cid, entries):
                 try:
@@ -231,41 +315,41 @@ Inventory:
                         model="gemini-2.0-flash",
                         contents=[{"role": "user", "parts": [{"text": f"Summarize short: {text}"}]}]
                     )
-                    self.summaries[cid] = (self.summaries.get(cid, '') + "\n" + resp.text).strip()
+                    live = await session_store.get(cid)
+                    if live is not None:  # the call may have ended meanwhile
+                        live.summary = ((live.summary or '') + "\n" + resp.text).strip()
+                        await session_store.touch(live)
                 except: pass
 
             import asyncio
             asyncio.create_task(run_summary(call_id, to_summarize))
 
-        # Clean for TTS
-        clean_text = re.sub(r'\(.*?\)', '', ai_text)
-        clean_text = re.sub(r'[#\*`]', '', clean_text).strip()
-        
-        clean_audio = re.sub(r'\(.*?\)', '', ai_audio)
-        clean_audio = re.sub(r'[#\*`]', '', clean_audio).strip()
+        await session_store.touch(session)
 
         return {
             "user_transcript": transcript,
-            "ai_text": clean_text,
-            "ai_audio": clean_audio,
+            "ai_text": clean_for_speech(ai_text),
+            "ai_audio": clean_for_speech(ai_audio),
             "terminate": (command == 'CONFIRM_ORDER'),
-            "cart": self.session_data[call_id].get('cart', []),
-            "stock_violations": self.session_data[call_id].get('stock_violations', [])
+            "cart": session.data.get('cart', []),
+            "stock_violations": session.data.get('stock_violations', [])
         }
 
     async def _execute_order(self, call_id, user_id):
-        session = self.session_data.get(call_id, {})
-        from db import get_products, create_order, validate_cart_stock
+        call = await session_store.get_or_create(call_id)
+        session = call.data
 
         # BUG 4 FIX: Re-validate stock one final time before committing the order
-        # (stock may have changed since the cart was built, e.g. concurrent users)
-        final_stock_check = validate_cart_stock(session.get('cart', []))
+        # (stock may have changed since the cart was built, e.g. concurrent users).
+        # The validated quantities are reserved under this call until the commit
+        # below consumes them, so concurrent checkouts cannot oversell them.
+        final_stock_check = await db_async.reserve_stock(call_id, session.get('cart', []))
         if final_stock_check['violations']:
             viol_names = ', '.join(f"{v['name']}" for v in final_stock_check['violations'])
             print(f"[ORDER GUARD] Final stock check found violations at checkout: {viol_names}")
         confirmed_cart = final_stock_check['valid_cart']
 
-        db_products = {p['id']: p['price'] for p in get_products()}
+        db_products = (await db_async.get_catalog()).by_id
         valid_cart = []
         total = 0
         for item in confirmed_cart:
@@ -278,10 +362,9 @@ Inventory:
                 if pid_raw is not None:
                     actual_pid = int(pid_raw)
                     if actual_pid in db_products:
-                        price = db_products[actual_pid]
+                        price = db_products[actual_pid]['price']
                         raw_qty = str(item.get('quantity', item.get('qty', 1)))
-                        import re
-                        q_match = re.search(r'[\d\.]+', raw_qty)
+                        q_match = _QTY_RE.search(raw_qty)
                         qty = float(q_match.group()) if q_match else 1.0
                         total += price * qty
                         item['price'] = price
@@ -298,11 +381,18 @@ Inventory:
             'total': round(total, 2),
             'items': valid_cart,
             'language': 'en',
-            'transcript': "\n".join(self.histories[call_id])
+            'transcript': "\n".join(call.history)
         }
-        create_order(order_payload)
-        from ws_manager import admin_ws_manager
-        await admin_ws_manager.broadcast({"type": "NEW_ORDER"})
+        try:
+            result = await db_async.create_order(order_payload, reservation_id=call_id)
+        except Exception:
+            await db_async.release_reservation(call_id)
+            raise
+        user_contexts.order_placed(user_id)
+        if result.get('failed_items'):
+            print(f"[ORDER GUARD] Lines not committed: {result['failed_items']}")
+        from admin_events import order_created
+        await order_created(result)
 
 
     def _handle_error(self, e):
@@ -324,400 +414,268 @@ Inventory:
             "command": "NONE"
         }
     @staticmethod
-    async def generate_tts(text):
-        """Generate TTS audio from text. Returns bytes or None."""
-        import re
-
-        # Detect language with a bias towards Malayalam if mixed
-        # (English voices completely fail on Malayalam Unicode characters)
-        lang = 'en'
-        ml_chars = sum(1 for c in text if '\u0D00' <= c <= '\u0D7F')
-        
-        # If more than 5% of the string is Malayalam, or if it contains any ML characters 
-        # and is reasonably long, use the Malayalam voice.
-        if ml_chars > 0:
-            lang = 'ml'
-
-        # Text fed strictly into the TTS engine (invisible to the UI transcript)
-        spoken_text = text.replace("-", " ") 
-        if lang == 'ml':
-            # Premium/Natural phonetic tuning for brand names and common items in Malayalam
-            replacements = {
-                "CartTalk": " കാർട്ട് ടോക്ക് ",
-                "Cart": " കാർട്ട് ",
-                "Welcome back to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് വീണ്ടും സ്വാഗതം ",
-                "Welcome to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് സ്വാഗതം ",
-                "Chicken": " ചിക്കൻ ",
-                "Turmeric": " മഞ്ഞൾ ",
-                "Chili": " ചില്ലി ",
-                "Powder": " പൗഡർ ",
-                "Coriander": " മല്ലി ",
-                "Masala": " മസാല ",
-                "Milma": " മിൽമ ",
-                "milma": " മിൽമ ",
-                "Nandhini": " നന്ദിനി ",
-                "nandhini": " നന്ദിനി ",
-                "Maggi": " മാഗി ",
-                "maggi": " മാഗി ",
-                "Yippee": " യിപ്പി ",
-                "yippee": " യിപ്പി ",
-                "Noodles": " നൂഡിൽസ് ",
-                "noodles": " നൂഡിൽസ് ",
-                "Atta": " ആട്ട ",
-                "atta": " ആട്ട ",
-                "Oats": " ഓട്സ് ",
-                "oats": " ഓട്സ് ",
-                "Basmati": " ബസ്മതി ",
-                "basmati": " ബസ്മതി ",
-                "Matta": " മട്ട ",
-                "matta": " മട്ട ",
-                "Apple": " ആപ്പിൾ ",
-                "apple": " ആപ്പിൾ ",
-                "Banana": " ബനാന ",
-                "banana": " ബനാന ",
-                "Orange": " ഓറഞ്ച് ",
-                "orange": " ഓറഞ്ച് ",
-                "Mango": " മാംഗോ ",
-                "mango": " മാംഗോ ",
-                "Grapes": " ഗ്രേപ്സ് ",
-                "grapes": " ഗ്രേപ്സ് ",
-                "Beef": " ബീഫ് ",
-                "beef": " ബീഫ് "
-            }
-            for eng, mal in replacements.items():
-                spoken_text = spoken_text.replace(eng, mal)
-
-        print(f"Generating TTS in lang: {lang}")
-
-        audio_bytes = None
-
+    async def generate_tts(text, lang=None):
+        """
+        Generate TTS audio from text (language auto-detected unless given).
+        Returns bytes, or None when the TTS pool is saturated (tts_pool.py).
+        """
+        lang, spoken_text = prepare_tts_text(text, lang)
         if USE_EDGE_TTS:
-            try:
-                voice = 'ml-IN-SobhanaNeural' if lang == 'ml' else 'en-US-AriaNeural'
-                communicate = edge_tts.Communicate(spoken_text, voice, rate="+0%")
-                fp = BytesIO()
-                async for chunk in communicate.stream():
-                    if chunk["type"] == "audio":
-                        fp.write(chunk["data"])
-                fp.seek(0)
-                audio_bytes = fp.read()
-                if len(audio_bytes) > 0:
-                    print(f"Edge-TTS audio: {len(audio_bytes)} bytes")
-                else:
-                    raise Exception("Edge-TTS returned empty audio")
-            except Exception as e:
-                print(f"Edge-TTS failed: {e}, falling back to gTTS")
-                audio_bytes = None
-
-        if audio_bytes is None:
-            tts = gTTS(text=spoken_text, lang=lang)
-            fp = BytesIO()
-            tts.write_to_fp(fp)
-            fp.seek(0)
-            audio_bytes = fp.read()
-            print(f"gTTS audio: {len(audio_bytes)} bytes")
+            voice, rate = TTS_VOICES[lang], "+0%"
+        else:
+            voice, rate = "gtts", ""
+        key = cache_key(spoken_text, lang, voice, rate)
+        cached = await tts_cache.get(key)
+        if cached is not None:
+            print(f"TTS cache hit ({lang}): {len(cached)} bytes")
+            return cached
 
+        print(f"Generating TTS in lang: {lang}")
+        try:
+            audio_bytes, engine = await tts_pool.synthesize(spoken_text, lang, voice, rate)
+        except TTSOverloaded as e:
+            print(f"TTS busy, skipping audio: {e}")
+            return None
+        print(f"{engine} audio: {len(audio_bytes)} bytes")
+        if engine == 'edge' or not USE_EDGE_TTS:
+            # A fallback after an edge-tts failure is not cached under the neural voice key
+            await tts_cache.put(key, audio_bytes)
         return audio_bytes
 
     @staticmethod
     async def stream_tts(text):
         """Zero-latency TTS streaming generator. Yields byte chunks."""
-        import re
-        
-        lang = 'en'
-        ml_chars = sum(1 for c in text if '\u0D00' <= c <= '\u0D7F')
-        if ml_chars > 0:
-            lang = 'ml'
-
-        spoken_text = text.replace("-", " ") 
-        if lang == 'ml':
-            replacements = {
-                "CartTalk": " കാർട്ട് ടോക്ക് ",
-                "Cart": " കാർട്ട് ",
-                "Welcome back to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് വീണ്ടും സ്വാഗതം ",
-                "Welcome to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് സ്വാഗതം ",
-                "Chicken": " ചിക്കൻ ",
-                "Turmeric": " മഞ്ഞൾ ",
-                "Chili": " ചില്ലി ",
-                "Powder": " പൗഡർ ",
-                "Coriander": " മല്ലി ",
-                "Masala": " മസാല ",
-                "Milma": " മിൽമ ",
-                "milma": " മിൽമ ",
-                "Nandhini": " നന്ദിനി ",
-                "nandhini": " നന്ദിനി ",
-                "Maggi": " മാഗി ",
-                "maggi": " മാഗി ",
-                "Yippee": " യിപ്പി ",
-                "yippee": " യിപ്പി ",
-                "Noodles": " നൂഡിൽസ് ",
-                "noodles": " നൂഡിൽസ് ",
-                "Atta": " ആട്ട ",
-                "atta": " ആട്ട ",
-                "Oats": " ഓട്സ് ",
-                "oats": " ഓട്സ് ",
-                "Basmati": " ബസ്മതി ",
-                "basmati": " ബസ്മതി ",
-                "Matta": " മട്ട ",
-                "matta": " മട്ട ",
-                "Apple": " ആപ്പിൾ ",
-                "apple": " ആപ്പിൾ ",
-                "Banana": " ബനാന ",
-                "banana": " ബനാന ",
-                "Orange": " ഓറഞ്ച് ",
-                "orange": " ഓറഞ്ച് ",
-                "Mango": " മാംഗോ ",
-                "mango": " മാംഗോ ",
-                "Grapes": " ഗ്രേപ്സ് ",
-                "grapes": " ഗ്രേപ്സ് ",
-                "Beef": " ബീഫ് ",
-                "beef": " ബീഫ് "
-            }
-            for eng, mal in replacements.items():
-                spoken_text = spoken_text.replace(eng, mal)
+        lang, spoken_text = prepare_tts_text(text)
+        if USE_EDGE_TTS:
+            voice, rate = TTS_VOICES[lang], "+10%"
+        else:
+            voice, rate = "gtts", ""
+        key = cache_key(spoken_text, lang, voice, rate)
+        cached = await tts_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
 
         print(f"Streaming TTS in lang: {lang}")
 
-        if USE_EDGE_TTS:
-            try:
-                voice = 'ml-IN-SobhanaNeural' if lang == 'ml' else 'en-US-AriaNeural'
-                communicate = edge_tts.Communicate(spoken_text, voice, rate="+10%")
-                async for chunk in communicate.stream():
-                    if chunk["type"] == "audio":
-                        yield chunk["data"]
-                return
-            except Exception as e:
-                print(f"Edge-TTS stream failed: {e}, falling back to gTTS")
-                # Fallback to standard blocking execution if edge-tts stream fails
-
-        # Fallback (non-streaming but works)
-        tts = gTTS(text=spoken_text, lang=lang)
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        fp.seek(0)
-        yield fp.read()
+        try:
+            if tts_pool.edge_available():
+                try:
+                    chunks = []
+                    async for chunk in tts_pool.stream_edge(spoken_text, voice, rate):
+                        chunks.append(chunk)
+                        yield chunk
+                    await tts_cache.put(key, b"".join(chunks))
+                    return
+                except TTSOverloaded:
+                    raise
+                except Exception:
+                    pass  # counted and logged by the pool; fall back to gTTS below
+
+            # Fallback (non-streaming but works), on the gTTS worker threads
+            audio_bytes = await tts_pool.synthesize_gtts(spoken_text, lang)
+        except TTSOverloaded as e:
+            print(f"TTS busy, skipping audio: {e}")
+            return
+        if not USE_EDGE_TTS:
+            await tts_cache.put(key, audio_bytes)
+        yield audio_bytes
 
 class InventoryService:
     def __init__(self):
-        # We re-fetch products to ensure freshness or cache it
-        pass
-    
+        # Products are served from the versioned catalog cache (see catalog.py).
+        # The rendered Gemini context is memoized per catalog version, and
+        # individual lines / category blocks are only re-rendered when the
+        # product data behind them actually changed.
+        self._lock = threading.Lock()
+        self._context_version = None
+        self._context = ""
+        self._lines = {}   # product id -> (fingerprint, rendered line)
+        self._blocks = {}  # category -> (line fingerprints, rendered block)
+
+    @staticmethod
+    def _render_line(p):
+        # Safety Stock Logic
+        buffer_val = p.get('safety_stock', 5)
+        safe_stock = max(0, p['stock'] - buffer_val)
+        s = f"({safe_stock})" if safe_stock > 0 else "(OOS)"
+        return f"#{p['id']} {p['name_en']}/{p['name_ml']} ₹{p['price']} {s}"
+
+    def _render_context(self, catalog):
+        lines = {}
+        blocks = {}
+        parts = []
+        # Catalog snapshot is already grouped by Category for better AI context
+        for cat, products in catalog.by_category.items():
+            keys = []
+            for p in products:
+                key = (p['id'], p['name_en'], p['name_ml'], p['price'], p['stock'], p.get('safety_stock', 5))
+                cached = self._lines.get(p['id'])
+                if cached is None or cached[0] != key:
+                    cached = (key, self._render_line(p))
+                lines[p['id']] = cached
+                keys.append(key)
+            keys = tuple(keys)
+
+            block = self._blocks.get(cat)
+            if block is None or block[0] != keys:
+                block = (keys, "\n".join([f"{cat}:"] + [lines[p['id']][1] for p in products]))
+            blocks[cat] = block
+            parts.append(block[1])
+
+        # Drop entries for deleted products / emptied categories
+        self._lines = lines
+        self._blocks = blocks
+        return "\n".join(parts)
+
     def get_context(self):
-        """Return inventory context for Gemini"""
-        products = get_products()
-        
-        # Group by Category for better AI context
-        grouped = {}
-        for p in products:
-            cat = p.get('category', 'General')
-            if cat not in grouped: grouped[cat] = []
-            
-            # Safety Stock Logic
-            buffer_val = p.get('safety_stock', 5)
-            safe_stock = max(0, p['stock'] - buffer_val)
-            
-            grouped[cat].append({
-                'id': p['id'],
-                'name': f"{p['name_en']}/{p['name_ml']}",
-                'price': p['price'],
-                'stock': safe_stock
-            })
-            
+        """Return inventory context for Gemini (memoized per catalog version)"""
+        catalog = get_catalog()
+        if self._context_version == catalog.version:
+            return self._context
+        with self._lock:
+            if self._context_version != catalog.version:
+                self._context = self._render_context(catalog)
+                self._context_version = catalog.version
+            return self._context
+    
+    def get_relevant_context(self, query, pinned_ids=(), suggested_ids=(), token_budget=None, history=()):
+        """
+        Inventory context filtered to what matters for this turn (see retrieval.py).
+        Falls back to the full list for small catalogs, empty queries, or when
+        the utterance names no product or category.
+        """
+        catalog = get_catalog()
+        if not query or len(catalog.products) <= FULL_CONTEXT_MAX_PRODUCTS:
+            return self.get_context()
+
+        selected = select_products(catalog, query, pinned_ids, suggested_ids, token_budget, self._render_line,
+                                   history)
+        if selected is None:
+            return self.get_context()
+
+        selected_ids = {p['id'] for p in selected}
         context_lines = []
-        for cat, items in grouped.items():
-            context_lines.append(f"{cat}:")
-            for i in items:
-                s = f"({i['stock']})" if i['stock'] > 0 else "(OOS)"
-                context_lines.append(f"#{i['id']} {i['name']} ₹{i['price']} {s}")
-            
+        for cat, products in catalog.by_category.items():
+            lines = [self._render_line(p) for p in products if p['id'] in selected_ids]
+            if lines:
+                context_lines.append(f"{cat}:")
+                context_lines.extend(lines)
+        context_lines.append(
+            f"(Showing {len(selected)} of {len(catalog.products)} products relevant to this request; "
+            "the store stocks other items too.)"
+        )
         return "\n".join(context_lines)
-    
+
     def list_all(self):
         return get_products()
 
 class OrderService:
     def create_order(self, data):
-        """Save order to database"""
-        return create_order(data)
+        """Save order to database (pass "all_or_nothing": true to reject partial orders)"""
+        return create_order(data, all_or_nothing=bool(data.get('all_or_nothing')))
     
-    def get_all(self):
-        """Get all orders"""
-        return get_orders()
+    def get_all(self, before_id=None, limit=None, fields=None):
+        """Get all orders (keyset-paginated when limit is given)"""
+        return get_orders(before_id=before_id, limit=limit, fields=fields)
 
 def get_admin_analytics():
     """
-    Service to fetch key analytics metrics for the Admin Dashboard
-    Queries the SQLite db directly.
+    Service to fetch key analytics metrics for the Admin Dashboard.
+    Order metrics come from the materialized aggregates in analytics.py, so
+    the cost does not grow with order history; product counts scan products.
     """
-    import sqlite3
-    from datetime import date, timedelta
-    from db import DB_FILE
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute('''
-        SELECT COUNT(id), SUM(total)
-        FROM orders
-    ''')
-    orders_today, revenue_today = c.fetchone()
-    
-    c.execute('''
-        SELECT 
-            COUNT(id) as total_products,
-            SUM(CASE WHEN stock < 5 THEN 1 ELSE 0 END) as low_stock_products
-        FROM products
-    ''')
-    total_products, low_stock_products = c.fetchone()
-    
-    c.execute('''
-        SELECT p.name_en, SUM(oi.quantity) as total_qty
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        GROUP BY p.id
-        ORDER BY total_qty DESC
-        LIMIT 1
-    ''')
-    most_sold_row = c.fetchone()
-    most_sold_product = most_sold_row[0] if most_sold_row else "N/A"
-    
-    orders_last_7_days = []
-    c.execute('''
-        SELECT date(created_at) as order_date, COUNT(id) as order_count
-        FROM orders
-        GROUP BY date(created_at)
-        ORDER BY date(created_at) DESC
-        LIMIT 7
-    ''')
-    db_counts_list = c.fetchall()
-    db_counts_list.reverse() # Make chronological
-    
-    for row in db_counts_list:
-        orders_last_7_days.append({
-            "date": row[0],
-            "orders": row[1]
-        })
-        
-    if not orders_last_7_days:
-        orders_last_7_days = [{"date": date.today().strftime('%Y-%m-%d'), "orders": 0}]
-        
-    conn.close()
-    
-    return {
-        "orders_today": orders_today or 0,
-        "revenue_today": revenue_today or 0,
-        "total_products": total_products or 0,
-        "low_stock_products": low_stock_products or 0,
-        "most_sold_product": most_sold_product,
-        "orders_last_7_days": orders_last_7_days
-    }
+    from datetime import date
+
+    with connection() as conn:
+        c = conn.cursor()
+        summary = read_order_summary(c)
+
+        c.execute('''
+            SELECT 
+                COUNT(id) as total_products,
+                SUM(CASE WHEN stock < 5 THEN 1 ELSE 0 END) as low_stock_products
+            FROM products
+        ''')
+        total_products, low_stock_products = c.fetchone()
+
+        orders_last_7_days = summary["daily"]
+        if not orders_last_7_days:
+            orders_last_7_days = [{"date": date.today().strftime('%Y-%m-%d'), "orders": 0}]
+
+        return {
+            "orders_today": summary["order_count"] or 0,
+            "revenue_today": summary["revenue"] or 0,
+            "total_products": total_products or 0,
+            "low_stock_products": low_stock_products or 0,
+            "most_sold_product": summary["most_sold_product"],
+            "orders_last_7_days": orders_last_7_days
+        }
 
 
 def get_recent_orders(limit=10):
-    import sqlite3
-    from db import DB_FILE
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT id, customer_name, total, status, created_at
-        FROM orders
-        ORDER BY created_at DESC
-        LIMIT ?
-    ''', (limit,))
-    
     orders = []
-    columns = [desc[0] for desc in c.description]
-    for row in c.fetchall():
-        order_dict = dict(zip(columns, row))
-        
-        # Get items for this order
-        c.execute('''
-            SELECT p.name_en, oi.quantity
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = ?
-        ''', (order_dict['id'],))
-        
-        items = [f"{item[0]} (x{item[1]})" for item in c.fetchall()]
-        
+    for order in get_orders(limit=limit, fields=('customer_name', 'total', 'status', 'created_at', 'items')):
+        items = [f"{item['name']} (x{item['quantity']})" for item in order['items']]
         orders.append({
-            "order_id": order_dict['id'],
-            "customer_name": order_dict['customer_name'] or "Unknown",
+            "order_id": order['id'],
+            "customer_name": order['customer_name'] or "Unknown",
             "items": ", ".join(items) if items else "No items",
-            "total_amount": order_dict['total'],
-            "status": order_dict['status'],
-            "created_at": order_dict['created_at'][:16] # Truncate seconds out
+            "total_amount": order['total'],
+            "status": order['status'],
+            "created_at": order['created_at'][:16] # Truncate seconds out
         })
-        
-    conn.close()
     return orders
 
 def get_low_stock_products():
-    import sqlite3
-    from db import DB_FILE
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Using safety_stock from earlier schema if available, else comparing against 5
-    c.execute('''
-        SELECT id, name_en, stock, safety_stock
-        FROM products
-        WHERE stock < COALESCE(safety_stock, 5)
-        ORDER BY stock ASC
-    ''')
-    
-    results = [{"product_id": row[0], "product_name": row[1], "stock": row[2], "safety_stock": row[3] or 5} for row in c.fetchall()]
-    conn.close()
-    return results
+    with connection() as conn:
+        c = conn.cursor()
+
+        # Using safety_stock from earlier schema if available, else comparing against 5
+        c.execute('''
+            SELECT id, name_en, stock, safety_stock
+            FROM products
+            WHERE stock < COALESCE(safety_stock, 5)
+            ORDER BY stock ASC
+        ''')
+
+        results = [{"product_id": row[0], "product_name": row[1], "stock": row[2], "safety_stock": row[3] or 5} for row in c.fetchall()]
+        return results
 
 def get_top_products(limit=5):
-    import sqlite3
-    from db import DB_FILE
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT p.name_en, SUM(oi.quantity) as total_orders
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        GROUP BY p.id
-        ORDER BY total_orders DESC
-        LIMIT ?
-    ''', (limit,))
-    
-    results = [{"product_name": row[0], "total_orders": row[1]} for row in c.fetchall()]
-    conn.close()
-    return results
+    with connection() as conn:
+        return read_top_products(conn.cursor(), limit)
 
 def log_voice_interaction(voice_input, ai_interpretation, action_performed):
-    import sqlite3
-    from db import DB_FILE
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    try:
-        c.execute('''
-            INSERT INTO voice_logs (voice_input, ai_interpretation, action_performed)
-            VALUES (?, ?, ?)
-        ''', (voice_input, ai_interpretation, action_performed))
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass # Table might not exist if init_db wasn't run recently
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute('''
+                INSERT INTO voice_logs (voice_input, ai_interpretation, action_performed)
+                VALUES (?, ?, ?)
+            ''', (voice_input, ai_interpretation, action_performed))
+            log_id = c.lastrowid
+            c.execute('SELECT timestamp FROM voice_logs WHERE id = ?', (log_id,))
+            timestamp = c.fetchone()[0]
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            return None # Table might not exist if init_db wasn't run recently
+        return {"id": log_id, "voice_input": voice_input, "ai_interpretation": ai_interpretation,
+                "action_performed": action_performed, "timestamp": timestamp}
 
 def get_voice_logs(limit=20):
-    import sqlite3
-    from db import DB_FILE
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    try:
-        c.execute('''
-            SELECT id, voice_input, ai_interpretation, action_performed, timestamp
-            FROM voice_logs
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (limit,))
-        columns = [desc[0] for desc in c.description]
-        results = [dict(zip(columns, row)) for row in c.fetchall()]
-    except sqlite3.OperationalError:
-        results = [] # In case table doesn't exist
-    conn.close()
-    return results
+    with connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute('''
+                SELECT id, voice_input, ai_interpretation, action_performed, timestamp
+                FROM voice_logs
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (limit,))
+            columns = [desc[0] for desc in c.description]
+            results = [dict(zip(columns, row)) for row in c.fetchall()]
+        except sqlite3.OperationalError:
+            results = [] # In case table doesn't exist
+        return results
@@ -0,0 +1,399 @@
+"""
+sessions.py
+Per-call session state for CartTalk voice calls.
+One CallSession per active call holds the logged-in user, the rolling
+conversation window and its summary, and the in-call cart data that
+GeminiService works with. The store is bounded: sessions are dropped
+when their call ends (websocket_endpoint calls GeminiService.end_call),
+after SESSION_IDLE_TTL_SECONDS without activity, and least-recently-used
+first once the session count or approximate memory cap is exceeded.
+
+SESSION_BACKEND picks where sessions are shared between workers:
+  memory  the in-process store is the only copy (single worker; default)
+  sqlite  call_sessions table in cartalk.db (several workers on one box)
+  redis   any Redis-protocol server at SESSION_REDIS_URL (several boxes)
+With a shared backend the in-process store is a working set for the calls
+whose socket is on this worker: a miss loads the session from the
+backend, and every completed turn (touch) writes it back, so
+/api/call/start and the call socket may land on different workers.
+The store's methods are coroutines: backend reads, writes and deletes run
+off the event loop (SQLite on the db_async executor, Redis on a worker
+thread), and at most one write per call is in flight — touches that
+arrive meanwhile are coalesced into one more write of the latest state.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import db_async
+from db_pool import connection
+from redis_client import RedisClient
+
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "5000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Rough per-item cost of cart / data entries when estimating session size
+_DATA_ITEM_BYTES = 300
+
+# ─── Serialization ───────────────────────────────────────────
+# Payload: one tag byte + JSON array [version, user_id, summary, history, data, created_at].
+# UTF-8 rather than \u escapes keeps Malayalam at ~3 bytes per character;
+# payloads above _COMPRESS_OVER bytes are zlib-compressed.
+_FORMAT_VERSION = 1
+_COMPRESS_OVER = 1024
+_TAG_JSON = b'j'
+_TAG_ZLIB = b'z'
+
+
+class CallSession:
+    __slots__ = ('call_id', 'user_id', 'history', 'summary', 'data',
+                 'created_at', 'last_active', 'approx_bytes', 'closed')
+
+    def __init__(self, call_id, user_id=None):
+        self.call_id = call_id
+        self.user_id = user_id
+        self.history = []       # "User: ..." / "Model: ..." lines (recent window)
+        self.summary = None     # summary of turns that slid out of the window
+        self.data = {}          # model-managed state: cart, stock_violations, name, address
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.approx_bytes = 0
+        self.closed = False     # set by end(); a late touch() must not resurrect it
+
+    @property
+    def cart(self):
+        return self.data.get('cart', [])
+
+    def measure(self):
+        size = sys.getsizeof(self.history) + sum(sys.getsizeof(line) for line in self.history)
+        if self.summary:
+            size += sys.getsizeof(self.summary)
+        for value in self.data.values():
+            size += _DATA_ITEM_BYTES * (len(value) if isinstance(value, (list, dict)) else 1)
+        return size + 512  # object, slots and dict overhead
+
+    def to_payload(self):
+        raw = json.dumps(
+            [_FORMAT_VERSION, self.user_id, self.summary, self.history, self.data, round(self.created_at, 3)],
+            separators=(',', ':'), ensure_ascii=False,
+        ).encode('utf-8')
+        if len(raw) > _COMPRESS_OVER:
+            return _TAG_ZLIB + zlib.compress(raw, 6)
+        return _TAG_JSON + raw
+
+    @classmethod
+    def from_payload(cls, call_id, payload):
+        tag, body = payload[:1], payload[1:]
+        if tag == _TAG_ZLIB:
+            body = zlib.decompress(body)
+        elif tag != _TAG_JSON:
+            raise ValueError(f"unknown session payload tag {tag!r}")
+        version, user_id, summary, history, data, created_at = json.loads(body)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"unsupported session payload version {version}")
+        session = cls(call_id, user_id)
+        session.summary, session.history, session.data = summary, history, data
+        session.created_at = created_at
+        return session
+
+
+# ─── Backends ────────────────────────────────────────────────
+
+class SessionBackend:
+    """Where serialized sessions are shared between workers. Methods block and may be called from any thread."""
+    name = 'base'
+    shared = True
+
+    async def run(self, fn, *args):
+        """Await a blocking backend method without holding up the event loop."""
+        return await asyncio.to_thread(fn, *args)
+
+    def load(self, call_id):
+        """Return the stored payload bytes, or None if missing or expired."""
+        raise NotImplementedError
+
+    def save(self, call_id, payload, ttl):
+        raise NotImplementedError
+
+    def delete(self, call_id):
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """Nothing is shared: the in-process store is the only copy. One worker only."""
+    name = 'memory'
+    shared = False
+
+    def load(self, call_id):
+        return None
+
+    def save(self, call_id, payload, ttl):
+        pass
+
+    def delete(self, call_id):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """call_sessions table (migration 4) in the shared cartalk.db; for workers on one host."""
+    name = 'sqlite'
+    PURGE_EVERY = 200  # saves between sweeps of expired rows
+
+    def __init__(self):
+        self._saves = 0
+
+    async def run(self, fn, *args):
+        return await db_async.run(fn, *args)  # same threads as every other query
+
+    def load(self, call_id):
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT payload FROM call_sessions WHERE call_id = ? AND expires_at > ?",
+                (call_id, time.time()),
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def save(self, call_id, payload, ttl):
+        now = time.time()
+        with connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO call_sessions (call_id, payload, expires_at) VALUES (?, ?, ?)",
+                (call_id, payload, now + ttl),
+            )
+            self._saves += 1
+            if self._saves % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM call_sessions WHERE expires_at <= ?", (now,))
+            conn.commit()
+
+    def delete(self, call_id):
+        with connection() as conn:
+            conn.execute("DELETE FROM call_sessions WHERE call_id = ?", (call_id,))
+            conn.commit()
+
+
+class RedisSessionBackend(SessionBackend):
+    """One key per call with a server-side TTL, on any Redis-protocol server."""
+    name = 'redis'
+    KEY_PREFIX = 'cartalk:session:'
+
+    def __init__(self, url=SESSION_REDIS_URL):
+        self.client = RedisClient(url)
+
+    def load(self, call_id):
+        return self.client.execute('GET', self.KEY_PREFIX + call_id)
+
+    def save(self, call_id, payload, ttl):
+        self.client.execute('SET', self.KEY_PREFIX + call_id, payload, 'EX', max(1, int(ttl)))
+
+    def delete(self, call_id):
+        self.client.execute('DEL', self.KEY_PREFIX + call_id)
+
+
+SESSION_BACKENDS = {
+    'memory': MemorySessionBackend,
+    'sqlite': SQLiteSessionBackend,
+    'redis': RedisSessionBackend,
+}
+
+
+def make_backend(name=SESSION_BACKEND):
+    try:
+        return SESSION_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown SESSION_BACKEND {name!r}; expected one of {', '.join(SESSION_BACKENDS)}")
+
+
+# ─── Store ───────────────────────────────────────────────────
+
+class SessionStore:
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL_SECONDS, max_sessions=SESSION_MAX_COUNT,
+                 max_bytes=None, backend=None):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = int(SESSION_MAX_MB * 2**20) if max_bytes is None else max_bytes
+        self.backend = backend or MemorySessionBackend()
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()   # call_id -> CallSession, least recently active first
+        self._bytes = 0
+        self._writing = {}               # call_id -> {'dirty', 'ended'} while a backend write is in flight
+        self._stats = {'created': 0, 'ended': 0, 'expired': 0, 'evicted': 0,
+                       'loaded': 0, 'saved': 0, 'backend_errors': 0}
+
+    def _drop(self, call_id, reason):
+        session = self._sessions.pop(call_id, None)
+        if session is not None:
+            self._bytes -= session.approx_bytes
+            self._stats[reason] += 1
+        return session
+
+    def _expire_idle(self, now):
+        # Ordered by last activity, so expired sessions are all at the front
+        while self._sessions:
+            call_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.idle_ttl:
+                break
+            self._drop(call_id, 'expired')
+
+    def _enforce_caps(self, keep):
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            call_id = next(iter(self._sessions))
+            if call_id == keep:
+                break
+            self._drop(call_id, 'evicted')
+
+    def _lookup(self, call_id, now):
+        self._expire_idle(now)
+        session = self._sessions.get(call_id)
+        if session is not None:
+            session.last_active = now
+            self._sessions.move_to_end(call_id)
+        return session
+
+    def _add(self, session):
+        """Insert a new or loaded session unless another caller got there first."""
+        existing = self._sessions.get(session.call_id)
+        if existing is not None:
+            return existing
+        session.approx_bytes = session.measure()
+        self._sessions[session.call_id] = session
+        self._bytes += session.approx_bytes
+        self._enforce_caps(session.call_id)
+        return session
+
+    async def _load(self, call_id):
+        """Fetch a session another worker saved. Backend I/O runs off the event loop, outside the lock."""
+        if not self.backend.shared:
+            return None
+        try:
+            payload = await self.backend.run(self.backend.load, call_id)
+            if payload is None:
+                return None
+            session = CallSession.from_payload(call_id, payload)
+        except Exception as e:
+            self._stats['backend_errors'] += 1
+            print(f"Session load failed ({self.backend.name}): {e}")
+            return None
+        self._stats['loaded'] += 1
+        return session
+
+    async def _backend_call(self, action, fn, *args):
+        try:
+            await self.backend.run(fn, *args)
+            return True
+        except Exception as e:
+            self._stats['backend_errors'] += 1
+            print(f"Session {action} failed ({self.backend.name}): {e}")
+            return False
+
+    async def _save(self, session):
+        if not self.backend.shared:
+            return
+        call_id = session.call_id
+        state = self._writing.get(call_id)
+        if state is not None:
+            state['dirty'] = True  # the write in flight saves the latest state once more
+            return
+        state = self._writing[call_id] = {'dirty': True, 'ended': False}
+        try:
+            while state['dirty'] and not state['ended']:
+                state['dirty'] = False
+                # Serialized here on the loop: turns mutate the session between awaits
+                if await self._backend_call('save', self.backend.save, call_id, session.to_payload(), self.idle_ttl):
+                    self._stats['saved'] += 1
+            if state['ended']:
+                # end() ran while we were writing: delete after our last write landed
+                await self._backend_call('delete', self.backend.delete, call_id)
+        finally:
+            del self._writing[call_id]
+
+    async def get(self, call_id):
+        """Return the live session for call_id (marking it active), or None."""
+        with self._lock:
+            session = self._lookup(call_id, time.monotonic())
+        if session is not None or not self.backend.shared:
+            return session
+        loaded = await self._load(call_id)
+        if loaded is None:
+            return None
+        with self._lock:
+            return self._add(loaded)
+
+    async def get_or_create(self, call_id, user_id=None):
+        with self._lock:
+            session = self._lookup(call_id, time.monotonic())
+        if session is None:
+            session = await self._load(call_id)
+            created = session is None
+            if created:
+                session = CallSession(call_id, user_id)
+            with self._lock:
+                added = self._add(session)
+                if added is session and created:
+                    self._stats['created'] += 1
+            session = added
+        if user_id is not None:
+            session.user_id = user_id
+        return session
+
+    async def start(self, call_id, user_id=None):
+        """
+        Register a new call. With a shared backend the session is only
+        written there: the call socket may connect to a different worker,
+        and a copy kept here would go stale.
+        """
+        if not self.backend.shared:
+            return await self.get_or_create(call_id, user_id)
+        session = CallSession(call_id, user_id)
+        await self._save(session)
+        self._stats['created'] += 1
+        return session
+
+    async def touch(self, session):
+        """Re-measure a session after a turn changed it, apply the memory cap and write it back."""
+        if session.closed:
+            return  # call already ended
+        with self._lock:
+            if self._sessions.get(session.call_id) is session:
+                size = session.measure()
+                self._bytes += size - session.approx_bytes
+                session.approx_bytes = size
+                session.last_active = time.monotonic()
+                self._sessions.move_to_end(session.call_id)
+                self._enforce_caps(session.call_id)
+            elif not self.backend.shared:
+                return  # expired or evicted, and there is no other copy to update
+        # Still saved when evicted locally mid-turn: the backend copy is the session of record
+        await self._save(session)
+
+    async def end(self, call_id):
+        """Drop a session when its call ends. Returns the removed session, if any."""
+        with self._lock:
+            session = self._drop(call_id, 'ended')
+        if session is not None:
+            session.closed = True
+        if self.backend.shared:
+            state = self._writing.get(call_id)
+            if state is not None:
+                state['ended'] = True  # deleted by the in-flight save once its write lands
+            else:
+                await self._backend_call('delete', self.backend.delete, call_id)
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, backend=self.backend.name,
+                        active=len(self._sessions), approx_bytes=self._bytes)
+
+
+session_store = SessionStore(backend=make_backend())
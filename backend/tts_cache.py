@@ -0,0 +1,205 @@
+"""
+tts_cache.py
+Content-addressed cache for synthesized TTS audio.
+Audio is keyed by a hash of (normalized spoken text, language, voice,
+rate), so repeated lines such as the greeting, stock warnings and order
+confirmations are synthesized once. Two tiers:
+  - memory: an LRU bounded by total bytes, served without any I/O
+  - disk:   one raw MP3 file per key under TTS_CACHE_DIR, capped by total
+            size with least-recently-used eviction; survives restarts
+get() and put() are coroutines: file reads, writes and evictions, and the
+one-time scan of the cache directory (warm(), run at startup), happen on
+worker threads, and only the in-memory bookkeeping is done under the lock.
+Hit/miss counters are exposed through stats().
+"""
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", "16"))
+TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", "256"))
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Whitespace- and Unicode-normalized form of the text sent to the TTS engine."""
+    return _SPACE_RE.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def cache_key(text, lang, voice, rate=''):
+    raw = '\x1f'.join((normalize_text(text), lang or '', voice or '', rate or ''))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory=TTS_CACHE_DIR, memory_bytes=None, disk_bytes=None):
+        self.directory = directory
+        self.memory_limit = int(TTS_CACHE_MEMORY_MB * 2**20) if memory_bytes is None else memory_bytes
+        self.disk_limit = int(TTS_CACHE_DISK_MB * 2**20) if disk_bytes is None else disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> audio bytes, oldest first
+        self._memory_bytes = 0
+        self._disk = None              # key -> file size, oldest first (loaded lazily)
+        self._disk_bytes = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0,
+                       'memory_evictions': 0, 'disk_evictions': 0}
+
+    # ── disk tier ──
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _scan_disk(self):
+        """Every cached file as (key, size), least recently written first."""
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.mp3'):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, name[:-4], st.st_size))
+        entries.sort()
+        return [(key, size) for _, key, size in entries]
+
+    def warm(self):
+        """Scan the cache directory once; afterwards the index is kept in memory. Blocking."""
+        if self._disk is not None:
+            return
+        entries = self._scan_disk()
+        with self._lock:
+            if self._disk is None:
+                self._disk = OrderedDict(entries)
+                self._disk_bytes = sum(size for _, size in entries)
+
+    def _read_file(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_file(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)  # readers never see a partial file
+        except OSError as e:
+            print(f"TTS cache write failed: {e}")
+            return False
+        return True
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _index_write(self, key, size):
+        """Record a written file; returns the keys evicted to stay under the cap. Call under the lock."""
+        self._disk_bytes += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+        evicted = []
+        while self._disk_bytes > self.disk_limit and self._disk:
+            old_key, old_size = self._disk.popitem(last=False)
+            self._disk_bytes -= old_size
+            self._stats['disk_evictions'] += 1
+            evicted.append(old_key)
+        return evicted
+
+    # ── memory tier ──
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_limit:
+            return
+        self._memory_bytes += len(data) - len(self._memory.pop(key, b''))
+        self._memory[key] = data
+        while self._memory_bytes > self.memory_limit:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self._stats['memory_evictions'] += 1
+
+    # ── public API ──
+    async def get(self, key):
+        """Return cached audio bytes or None. Disk hits are promoted to memory."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data
+        if self._disk is None:
+            await asyncio.to_thread(self.warm)
+        with self._lock:
+            on_disk = key in self._disk
+            if not on_disk:
+                self._stats['misses'] += 1
+                return None
+        data = await asyncio.to_thread(self._read_file, key)
+        with self._lock:
+            if data is None:
+                # Evicted or removed since the index was read
+                if key in self._disk:
+                    self._disk_bytes -= self._disk.pop(key)
+                self._stats['misses'] += 1
+                return None
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, data)
+            self._stats['disk_hits'] += 1
+            return data
+
+    async def put(self, key, data):
+        if not data:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            self._stats['stores'] += 1
+        if self.disk_limit <= 0 or len(data) > self.disk_limit:
+            return
+        if self._disk is None:
+            await asyncio.to_thread(self.warm)
+        if not await asyncio.to_thread(self._write_file, key, data):
+            return
+        with self._lock:
+            evicted = self._index_write(key, len(data))
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def clear(self):
+        """Drop both tiers. Blocking (admin and scripts only)."""
+        self.warm()
+        with self._lock:
+            keys = list(self._disk)
+            self._disk.clear()
+            self._disk_bytes = 0
+            self._memory.clear()
+            self._memory_bytes = 0
+        self._remove_files(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['memory_hits'] + self._stats['disk_hits'] + self._stats['misses']
+            hits = lookups - self._stats['misses']
+            return dict(
+                self._stats,
+                hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_entries=len(self._disk) if self._disk is not None else None,
+                disk_bytes=self._disk_bytes if self._disk is not None else None,
+            )
+
+
+tts_cache = TTSCache()
@@ -0,0 +1,214 @@
+"""
+tts_pool.py
+Bounded worker pool for TTS synthesis.
+edge-tts is async network I/O; gTTS is blocking (HTTP + MP3 assembly) and
+used to run inside the coroutine, freezing the event loop for every call
+and dashboard socket whenever edge-tts was down. All synthesis now goes
+through one lane per engine:
+  - concurrency: TTS_EDGE_CONCURRENCY / TTS_GTTS_CONCURRENCY jobs at once;
+    gTTS runs on its own thread pool of that size
+  - timeouts:    TTS_EDGE_TIMEOUT / TTS_GTTS_TIMEOUT seconds per job (for a
+                 streamed edge-tts job, the total wait for its chunks)
+  - backpressure: at most TTS_QUEUE_LIMIT jobs wait per lane; beyond that
+    TTSOverloaded is raised at once and the caller sends the reply without
+    that audio instead of queueing behind an outage
+After TTS_EDGE_FAILURES consecutive edge-tts failures, edge-tts is skipped
+for TTS_EDGE_COOLDOWN seconds and requests go straight to gTTS.
+Queue depth, running jobs, latency and failure counters: stats().
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+try:
+    import edge_tts
+    USE_EDGE_TTS = True
+    print("Using edge-tts (Neural voices)")
+except ImportError:
+    edge_tts = None
+    USE_EDGE_TTS = False
+    print("edge-tts not found, falling back to gTTS")
+from gtts import gTTS
+
+TTS_EDGE_CONCURRENCY = int(os.getenv("TTS_EDGE_CONCURRENCY", "8"))
+TTS_GTTS_CONCURRENCY = int(os.getenv("TTS_GTTS_CONCURRENCY", "4"))
+TTS_EDGE_TIMEOUT = float(os.getenv("TTS_EDGE_TIMEOUT", "10"))
+TTS_GTTS_TIMEOUT = float(os.getenv("TTS_GTTS_TIMEOUT", "15"))
+TTS_QUEUE_LIMIT = int(os.getenv("TTS_QUEUE_LIMIT", "32"))
+TTS_EDGE_FAILURES = int(os.getenv("TTS_EDGE_FAILURES", "3"))
+TTS_EDGE_COOLDOWN = float(os.getenv("TTS_EDGE_COOLDOWN", "30"))
+
+
+class TTSOverloaded(Exception):
+    """Too many synthesis jobs are already waiting for this engine."""
+
+
+class EngineLane:
+    """Concurrency limit, bounded wait queue and counters for one TTS engine."""
+
+    def __init__(self, name, concurrency, timeout, queue_limit):
+        self.name = name
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.queue_limit = queue_limit
+        self.waiting = 0
+        self.running = 0
+        self._semaphore = None  # created on first use, inside the running loop
+        self._stats = {'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0,
+                       'max_waiting': 0, 'busy_seconds': 0.0}
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the lane's slots; raises TTSOverloaded when the wait queue is full."""
+        if self.waiting >= self.queue_limit:
+            self._stats['rejected'] += 1
+            raise TTSOverloaded(f"{self.name}: {self.waiting} jobs waiting")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        self._stats['max_waiting'] = max(self._stats['max_waiting'], self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise
+        except Exception:
+            self._stats['failed'] += 1
+            raise
+        else:
+            self._stats['completed'] += 1
+        finally:
+            self.running -= 1
+            self._stats['busy_seconds'] += time.monotonic() - started
+            self._semaphore.release()
+
+    async def run(self, fn, *args):
+        """Await fn(*args) in a slot, bounded by the lane timeout. Nothing starts if the job is rejected."""
+        async with self.slot():
+            return await asyncio.wait_for(fn(*args), self.timeout)
+
+    def stats(self):
+        return dict(self._stats, busy_seconds=round(self._stats['busy_seconds'], 3),
+                    concurrency=self.concurrency, waiting=self.waiting, running=self.running)
+
+
+async def _edge_synthesize(text, voice, rate):
+    communicate = edge_tts.Communicate(text, voice, rate=rate)
+    fp = BytesIO()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            fp.write(chunk["data"])
+    if not fp.tell():
+        raise RuntimeError("Edge-TTS returned empty audio")
+    return fp.getvalue()
+
+
+def _gtts_synthesize(text, lang, timeout):
+    # Runs on the gTTS thread pool; `timeout` bounds each HTTP request so a
+    # timed-out job does not keep its thread busy indefinitely
+    fp = BytesIO()
+    gTTS(text=text, lang=lang, timeout=timeout).write_to_fp(fp)
+    return fp.getvalue()
+
+
+class TTSWorkerPool:
+    def __init__(self, edge_concurrency=TTS_EDGE_CONCURRENCY, gtts_concurrency=TTS_GTTS_CONCURRENCY,
+                 edge_timeout=TTS_EDGE_TIMEOUT, gtts_timeout=TTS_GTTS_TIMEOUT, queue_limit=TTS_QUEUE_LIMIT):
+        self.edge = EngineLane('edge', edge_concurrency, edge_timeout, queue_limit)
+        self.gtts = EngineLane('gtts', gtts_concurrency, gtts_timeout, queue_limit)
+        self._executor = ThreadPoolExecutor(max_workers=gtts_concurrency, thread_name_prefix="tts-gtts")
+        self._edge_failures = 0
+        self._edge_down_until = 0.0
+        self._stats = {'fallbacks': 0, 'edge_skipped': 0, 'edge_outages': 0}
+
+    # ─── edge-tts health ───
+    def edge_available(self):
+        return USE_EDGE_TTS and time.monotonic() >= self._edge_down_until
+
+    def _edge_failed(self, error):
+        self._edge_failures += 1
+        self._stats['fallbacks'] += 1
+        print(f"Edge-TTS failed: {error!r}, falling back to gTTS")
+        if self._edge_failures >= TTS_EDGE_FAILURES and self.edge_available():
+            self._edge_down_until = time.monotonic() + TTS_EDGE_COOLDOWN
+            self._stats['edge_outages'] += 1
+            print(f"Edge-TTS failed {self._edge_failures} times in a row, using gTTS for {TTS_EDGE_COOLDOWN:g}s")
+
+    def _edge_ok(self):
+        self._edge_failures = 0
+
+    # ─── synthesis ───
+    async def synthesize_gtts(self, text, lang):
+        """gTTS on the worker threads; the event loop stays free while it runs."""
+        loop = asyncio.get_running_loop()
+        return await self.gtts.run(loop.run_in_executor, self._executor,
+                                   _gtts_synthesize, text, lang, self.gtts.timeout)
+
+    async def synthesize(self, text, lang, voice, rate):
+        """
+        Return (audio bytes, engine): edge-tts with `voice`/`rate` while it is
+        healthy, gTTS otherwise or when it fails. Raises TTSOverloaded when
+        the engine's wait queue is full.
+        """
+        if USE_EDGE_TTS and not self.edge_available():
+            self._stats['edge_skipped'] += 1
+        elif USE_EDGE_TTS:
+            try:
+                audio = await self.edge.run(_edge_synthesize, text, voice, rate)
+                self._edge_ok()
+                return audio, 'edge'
+            except TTSOverloaded:
+                raise
+            except Exception as e:
+                self._edge_failed(e)
+        return await self.synthesize_gtts(text, lang), 'gtts'
+
+    async def stream_edge(self, text, voice, rate):
+        """
+        Yield edge-tts audio chunks as they arrive, inside an edge slot.
+        Waiting for chunks shares the lane timeout as one budget (time spent
+        by the consumer between chunks is not counted), so a hung edge-tts
+        socket frees its slot like a timed-out run() and counts as a failure.
+        """
+        async with self.edge.slot():
+            stream = None
+            try:
+                communicate = edge_tts.Communicate(text, voice, rate=rate)
+                stream = communicate.stream()
+                budget = self.edge.timeout
+                while True:
+                    started = time.monotonic()
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), max(budget, 0))
+                    except StopAsyncIteration:
+                        break
+                    budget -= time.monotonic() - started
+                    if chunk["type"] == "audio":
+                        yield chunk["data"]
+            except Exception as e:
+                self._edge_failed(e)
+                raise
+            finally:
+                if stream is not None:
+                    await stream.aclose()
+            self._edge_ok()
+
+    def busy(self):
+        """True while any synthesis is waiting for a slot."""
+        return bool(self.edge.waiting or self.gtts.waiting)
+
+    def stats(self):
+        return dict(self._stats, edge_available=self.edge_available(),
+                    edge=self.edge.stats(), gtts=self.gtts.stats())
+
+
+tts_pool = TTSWorkerPool()
@@ -0,0 +1,134 @@
+"""
+tts_prefetch.py
+Speculative TTS for the lines whose wording is known before Gemini replies.
+  greeting  /api/call/start synthesizes "Welcome (back) to CartTalk!",
+            which _build_prompt forces as the opening of the first reply
+  checkout  after an English reply that leaves items in the cart, the
+            line the checkout reply states the total with ("Your total
+            is ₹N.", rule 7 of the prompt) is synthesized for that cart
+When a reply sentence contains a speculated line at a sentence boundary,
+tts_stream sends the ready audio as its own frame and synthesizes only
+the text around it. Speculation is per call and only starts while the TTS
+pool has nothing waiting, so it never delays a real sentence; anything it
+synthesizes also lands in tts_cache. TTS_PREFETCH=0 turns it off.
+"""
+import asyncio
+import os
+import re
+from collections import OrderedDict
+
+from services import GeminiService, greeting_line
+from tts_cache import normalize_text
+from tts_pool import tts_pool
+from tts_text import detect_tts_lang
+
+TTS_PREFETCH = os.getenv("TTS_PREFETCH", "1") != "0"
+
+# Calls with speculation in flight; the least recently active is dropped beyond this
+MAX_CALLS = 1000
+
+_QTY_RE = re.compile(r'[\d.]+')
+
+
+def checkout_line(cart):
+    """The sentence a checkout reply states the cart total with, or None for an empty cart."""
+    total = 0.0
+    for item in cart or ():
+        if not isinstance(item, dict) or item.get('price') is None:
+            continue
+        q_match = _QTY_RE.search(str(item.get('quantity', item.get('qty', 1))))
+        total += float(item['price']) * (float(q_match.group()) if q_match else 1.0)
+    if total <= 0:
+        return None
+    total = round(total, 2)
+    return f"Your total is ₹{total:.0f}." if total == int(total) else f"Your total is ₹{total:.2f}."
+
+
+def _find_line(sentence, line):
+    """Index of `line` in `sentence` where it starts and ends on a sentence boundary, else -1."""
+    match = re.search(r'(?:^|(?<=[.!?।]\s))' + re.escape(line) + r'(?=\s|$)', sentence)
+    return match.start() if match else -1
+
+
+class SpeculativeTTS:
+    def __init__(self, enabled=TTS_PREFETCH, max_calls=MAX_CALLS):
+        self.enabled = enabled
+        self.max_calls = max_calls
+        self._calls = OrderedDict()   # call_id -> {slot: (normalized text, lang, task)}
+        self._stats = {'started': 0, 'skipped_busy': 0, 'hits': 0, 'wasted': 0}
+
+    def _drop(self, job):
+        if job is not None:
+            self._stats['wasted'] += 1
+            job[2].cancel()  # no-op once done; finished audio stays in tts_cache
+
+    def speculate(self, call_id, slot, text, lang):
+        """Synthesize `text` for this call in the background, replacing the slot's previous line."""
+        if not self.enabled or not text:
+            return
+        text = normalize_text(text)
+        jobs = self._calls.get(call_id, {})
+        previous = jobs.get(slot)
+        if previous is not None and previous[:2] == (text, lang):
+            return
+        self._drop(jobs.pop(slot, None))
+        if tts_pool.busy():
+            self._stats['skipped_busy'] += 1
+            return
+        jobs[slot] = (text, lang, asyncio.create_task(GeminiService.generate_tts(text, lang=lang)))
+        self._calls[call_id] = jobs
+        self._calls.move_to_end(call_id)
+        self._stats['started'] += 1
+        while len(self._calls) > self.max_calls:
+            _, old = self._calls.popitem(last=False)
+            for job in old.values():
+                self._drop(job)
+
+    def start_call(self, call_id, user_id=None):
+        self.speculate(call_id, 'greeting', greeting_line(user_id), 'en')
+
+    def after_turn(self, call_id, result):
+        """After each reply: the greeting can no longer match; speculate the total line for the new cart."""
+        jobs = self._calls.get(call_id)
+        if jobs:
+            self._drop(jobs.pop('greeting', None))
+        if not result or result.get('terminate'):
+            return
+        spoken = result.get('ai_audio') or result.get('ai_text') or ''
+        line = checkout_line(result.get('cart')) if detect_tts_lang(spoken) == 'en' else None
+        if line:
+            self.speculate(call_id, 'checkout', line, 'en')
+        elif jobs:
+            self._drop(jobs.pop('checkout', None))  # total of a cart that has changed since
+
+    def claim(self, call_id, sentence, lang):
+        """
+        Split a reply sentence around a line already synthesized for this
+        call. Returns [(text, task or None), ...] in speaking order; the
+        task resolves to that line's audio. [(sentence, None)] if nothing matches.
+        """
+        jobs = self._calls.get(call_id) if call_id else None
+        if not jobs:
+            return [(sentence, None)]
+        normalized = normalize_text(sentence)
+        for slot, (text, spec_lang, task) in jobs.items():
+            if spec_lang != lang or task.cancelled():
+                continue
+            at = _find_line(normalized, text)
+            if at < 0:
+                continue
+            del jobs[slot]
+            self._stats['hits'] += 1
+            before, after = normalized[:at].strip(), normalized[at + len(text):].strip()
+            return [(part, ready) for part, ready in ((before, None), (text, task), (after, None)) if part]
+        return [(sentence, None)]
+
+    def end_call(self, call_id):
+        for job in self._calls.pop(call_id, {}).values():
+            self._drop(job)
+
+    def stats(self):
+        return dict(self._stats, enabled=self.enabled, calls=len(self._calls))
+
+
+speculative_tts = SpeculativeTTS()
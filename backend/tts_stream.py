@@ -0,0 +1,123 @@
+"""
+tts_stream.py
+Sentence-level streaming TTS for the call WebSocket.
+The reply is split into sentences which are synthesized concurrently
+(bounded by TTS_STREAM_CONCURRENCY) and pushed to the client in order,
+so playback starts as soon as the first sentence is ready instead of
+after the whole reply has been synthesized.
+
+Wire format for one reply:
+    {"type": "audio_start", "chunks": N}   (N sentences; null while they are still streaming)
+    <binary MP3 frame> ...            (one playable MP3 per sentence, in order; a
+                                       line synthesized ahead is its own frame)
+    {"type": "audio_end", "sent": K}  (K frames sent; failed sentences are skipped,
+                                       as are sentences refused while the
+                                       TTS pool is saturated, tts_pool.py)
+"""
+import asyncio
+import os
+
+from services import GeminiService
+from tts_prefetch import speculative_tts
+from tts_text import detect_tts_lang
+from response_parser import split_sentences
+
+TTS_STREAM_CONCURRENCY = int(os.getenv("TTS_STREAM_CONCURRENCY", "3"))
+
+
+async def _iterate(sentences):
+    if hasattr(sentences, '__aiter__'):
+        async for sentence in sentences:
+            yield sentence
+    else:
+        for sentence in sentences:
+            yield sentence
+
+
+async def synthesize_sentences(sentences, lang=None, concurrency=None, call_id=None):
+    """
+    Yield audio bytes (or None for a failed sentence) in sentence order.
+    `sentences` may be a list or an async iterable still being produced.
+    Up to `concurrency` sentences are synthesized at once; later ones run
+    ahead while earlier ones are being sent. A line synthesized ahead for
+    `call_id` (tts_prefetch.py) is yielded as its own chunk.
+    """
+    semaphore = asyncio.Semaphore(concurrency or TTS_STREAM_CONCURRENCY)
+    tasks = asyncio.Queue()
+
+    async def synth(sentence, sentence_lang):
+        async with semaphore:
+            try:
+                return await GeminiService.generate_tts(sentence, lang=sentence_lang)
+            except Exception as e:
+                print(f"Sentence TTS failed: {e}")
+                return None
+
+    async def speak(sentence, sentence_lang, ready):
+        if ready is not None:
+            try:
+                audio_bytes = await ready
+            except Exception as e:
+                print(f"Speculative TTS failed: {e}")
+                audio_bytes = None
+            if audio_bytes:
+                return audio_bytes
+        return await synth(sentence, sentence_lang)
+
+    async def feed():
+        # Without a fixed language, switch to Malayalam for good once it appears
+        # (English voices fail on Malayalam script; the reverse works fine)
+        reply_lang = lang
+        try:
+            async for sentence in _iterate(sentences):
+                sentence_lang = reply_lang or detect_tts_lang(sentence)
+                if lang is None and sentence_lang == 'ml':
+                    reply_lang = 'ml'
+                for text, ready in speculative_tts.claim(call_id, sentence, sentence_lang):
+                    await tasks.put(asyncio.create_task(speak(text, sentence_lang, ready)))
+        finally:
+            await tasks.put(None)
+
+    feeder = asyncio.create_task(feed())
+    pending = []
+    try:
+        while True:
+            task = await tasks.get()
+            if task is None:
+                break
+            pending.append(task)
+            yield await task
+    finally:
+        feeder.cancel()
+        for task in pending:
+            task.cancel()
+        while not tasks.empty():
+            task = tasks.get_nowait()
+            if task is not None:
+                task.cancel()
+
+
+async def stream_reply_audio(websocket, reply, lang=None, call_id=None):
+    """
+    Synthesize a reply sentence by sentence and push ordered audio frames to
+    the call socket. `reply` is either the full text or an async iterable of
+    sentences that are still being generated.
+    """
+    if isinstance(reply, str):
+        sentences = split_sentences(reply)
+        if not sentences:
+            return 0
+        # One voice for the whole reply, so an English brand name inside a
+        # Malayalam reply does not switch speakers mid-answer
+        lang = lang or detect_tts_lang(reply)
+        chunks = len(sentences)
+    else:
+        sentences, chunks = reply, None  # count unknown while streaming
+    await websocket.send_json({"type": "audio_start", "chunks": chunks})
+    sent = 0
+    async for audio_bytes in synthesize_sentences(sentences, lang, call_id=call_id):
+        if audio_bytes:
+            await websocket.send_bytes(audio_bytes)
+            sent += 1
+    await websocket.send_json({"type": "audio_end", "sent": sent})
+    return sent
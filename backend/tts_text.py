@@ -0,0 +1,244 @@
+"""
+tts_text.py
+Text normalization for the TTS engines: language detection and the
+Malayalam phonetic rewrite of English brand and product names.
+The lexicon is the built-in table below, extended with every product
+whose name_ml is in Malayalam (name_en -> name_ml) and with merchant
+entries from the tts_lexicon table (/api/admin/tts-lexicon); later
+sources win. It is compiled into one Aho–Corasick automaton and applied
+in a single pass: whole words only, ASCII case-insensitive,
+leftmost-longest (so "Welcome to CartTalk" beats "CartTalk", which beats
+"Cart"). The automaton is rebuilt only when product names or merchant
+entries change (the shared names version in catalog_version, or
+invalidate()), off the event loop while the previous one keeps serving.
+
+Benchmark against the old str.replace loop: scripts/bench_tts_text.py
+"""
+import asyncio
+import re
+import string
+import threading
+from collections import deque
+
+from catalog import catalog_cache
+
+# Premium/Natural phonetic tuning for brand names and common items in Malayalam TTS
+ML_TTS_REPLACEMENTS = {
+    "CartTalk": " കാർട്ട് ടോക്ക് ",
+    "Cart": " കാർട്ട് ",
+    "Welcome back to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് വീണ്ടും സ്വാഗതം ",
+    "Welcome to CartTalk": " കാർട്ട് ടോക്കിലേക്ക് സ്വാഗതം ",
+    "Chicken": " ചിക്കൻ ",
+    "Turmeric": " മഞ്ഞൾ ",
+    "Chili": " ചില്ലി ",
+    "Powder": " പൗഡർ ",
+    "Coriander": " മല്ലി ",
+    "Masala": " മസാല ",
+    "Milma": " മിൽമ ",
+    "Nandhini": " നന്ദിനി ",
+    "Maggi": " മാഗി ",
+    "Yippee": " യിപ്പി ",
+    "Noodles": " നൂഡിൽസ് ",
+    "Atta": " ആട്ട ",
+    "Oats": " ഓട്സ് ",
+    "Basmati": " ബസ്മതി ",
+    "Matta": " മട്ട ",
+    "Apple": " ആപ്പിൾ ",
+    "Banana": " ബനാന ",
+    "Orange": " ഓറഞ്ച് ",
+    "Mango": " മാംഗോ ",
+    "Grapes": " ഗ്രേപ്സ് ",
+    "Beef": " ബീഫ് ",
+}
+
+_MALAYALAM_RE = re.compile('[\u0D00-\u0D7F]')
+# Case folding that keeps every index in place (str.lower() may not)
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+_WORD_CHARS = frozenset(string.ascii_lowercase + string.digits)
+
+
+def detect_tts_lang(text):
+    # Detect language with a bias towards Malayalam if mixed
+    # (English voices completely fail on Malayalam Unicode characters)
+    return 'ml' if _MALAYALAM_RE.search(text) else 'en'
+
+
+class PhoneticMatcher:
+    """Aho–Corasick automaton over a {term: spoken} lexicon. Immutable once built."""
+    __slots__ = ('size', '_goto', '_fail', '_out', '_starts')
+
+    def __init__(self, lexicon):
+        goto, fail, out = [{}], [0], [()]
+        for term, spoken in lexicon.items():
+            key = term.strip().translate(_ASCII_LOWER)
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                state = nxt
+            out[state] = ((len(key), spoken),)  # a later entry for the same term wins
+
+        # Breadth-first failure links; each state also reports the terms that end
+        # at its suffixes, so every match ending at a position is seen there
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self.size = sum(1 for o in out if o)
+        self._goto, self._fail, self._out = goto, fail, out
+        # Jumps straight to the next position where a term can begin (the scan runs in C)
+        first = ''.join(re.escape(ch) for ch in sorted(goto[0]))
+        self._starts = re.compile(f'[{first}]') if first else None
+
+    def rewrite(self, text):
+        """Replace every lexicon term in `text` in one pass (whole words, leftmost-longest)."""
+        if self._starts is None:
+            return text
+        lowered = text.translate(_ASCII_LOWER)
+        goto, fail, out, starts = self._goto, self._fail, self._out, self._starts
+        n = len(lowered)
+        matches = []
+        state = i = 0
+        while i < n:
+            if not state:
+                m = starts.search(lowered, i)
+                if m is None:
+                    break
+                i = m.start()
+            ch = lowered[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            i += 1
+            for length, spoken in out[state]:
+                matches.append((i - length, -i, spoken))
+        if not matches:
+            return text
+
+        matches.sort()
+        parts, last = [], 0
+        for start, neg_end, spoken in matches:
+            end = -neg_end
+            if start < last:
+                continue
+            if start and lowered[start] in _WORD_CHARS and lowered[start - 1] in _WORD_CHARS:
+                continue  # inside a word ("boats")
+            if end < n and lowered[end - 1] in _WORD_CHARS and lowered[end] in _WORD_CHARS:
+                if lowered[end] == 's' and (end + 1 == n or lowered[end + 1] not in _WORD_CHARS):
+                    end += 1  # plural of the term ("Apples")
+                else:
+                    continue  # prefix of a longer word ("Cartoon")
+            parts.append(text[last:start])
+            parts.append(spoken)
+            last = end
+        parts.append(text[last:])
+        return ''.join(parts)
+
+
+def product_terms(products):
+    """name_en -> name_ml for products whose Malayalam name is in Malayalam script."""
+    terms = {}
+    for p in products:
+        name_en, name_ml = (p.get('name_en') or '').strip(), (p.get('name_ml') or '').strip()
+        if name_en and name_ml and _MALAYALAM_RE.search(name_ml) and not _MALAYALAM_RE.search(name_en):
+            terms[name_en] = f" {name_ml} "
+    return terms
+
+
+class PhoneticLexicon:
+    """Built-in, product and merchant terms, compiled into a PhoneticMatcher once per change."""
+
+    def __init__(self, builtin=ML_TTS_REPLACEMENTS):
+        self._lock = threading.Lock()
+        self.builtin = dict(builtin)
+        self._local_version = 0
+        self._built_for = None   # (local version, names version) of the current matcher
+        self._building = None    # key being compiled off the event loop
+        self._entries = None
+        self._merchant_terms = 0
+        self._matcher = PhoneticMatcher(self.builtin)
+        self._stats = {'builds': 0, 'rewrites': 0}
+
+    def invalidate(self):
+        """Recompile on next use (db.py calls this after loading or editing tts_lexicon)."""
+        with self._lock:
+            self._local_version += 1
+
+    def matcher(self):
+        """
+        The current matcher. Never touches SQLite on the caller's thread: it
+        keys on the names version of whichever catalog snapshot the last reader
+        loaded. When that (or invalidate()) says the terms changed, the new
+        matcher is compiled in the default executor and the previous one keeps
+        serving until it is ready. Without a running event loop it compiles inline.
+        """
+        snap = catalog_cache.peek()
+        key = (self._local_version, snap.names_version if snap else None)
+        if key == self._built_for or key == self._building:
+            return self._matcher
+        with self._lock:
+            if key == self._built_for or self._building is not None:
+                return self._matcher  # the next call after that build picks up this key
+            self._building = key
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._build(key, snap)
+        else:
+            loop.run_in_executor(None, self._build, key, snap)
+        return self._matcher
+
+    def _build(self, key, snap):
+        try:
+            from db import get_tts_lexicon
+            # Padded like the built-in entries so a term never fuses with its neighbours
+            merchant = {term: f" {spoken.strip()} " for term, spoken in get_tts_lexicon().items()}
+            entries = {**self.builtin, **product_terms(snap.products if snap else ()), **merchant}
+            if entries != self._entries:
+                self._matcher = PhoneticMatcher(entries)
+                self._entries = entries
+                self._stats['builds'] += 1
+            self._merchant_terms = len(merchant)
+        except Exception as e:
+            # Keep the previous matcher; the next change retries
+            print(f"Phonetic lexicon rebuild failed: {e}")
+        with self._lock:
+            self._built_for = key
+            self._building = None
+
+    def rewrite(self, text):
+        self._stats['rewrites'] += 1
+        return self.matcher().rewrite(text)
+
+    def stats(self):
+        return dict(self._stats, terms=self.matcher().size, merchant_terms=self._merchant_terms,
+                    building=self._building is not None)
+
+
+phonetic_lexicon = PhoneticLexicon()
+
+
+def prepare_tts_text(text, lang=None):
+    """
+    Pick the TTS language (unless given) and build the text fed strictly into
+    the TTS engine (invisible to the UI transcript). Returns (lang, spoken_text).
+    """
+    lang = lang or detect_tts_lang(text)
+
+    spoken_text = text.replace("-", " ")
+    if lang == 'ml':
+        spoken_text = phonetic_lexicon.rewrite(spoken_text)
+    return lang, spoken_text
@@ -0,0 +1,130 @@
+"""
+user_context.py
+Per-call snapshot of what a turn's prompt needs to know about the caller:
+profile (name, address), saved cart and the Smart Reorder lists
+(frequent items, monthly essentials). It is loaded once per call — from
+/api/call/start while the client connects, or on the first turn — and
+shared by websocket_endpoint (user context, pinned and suggested
+products) and GeminiService._build_prompt, instead of four queries on
+every turn.
+Two per-phone versions keep it honest:
+  orders  bumped when the user places an order; the next turn reloads
+          the whole snapshot (the reorder lists have changed)
+  cart    bumped when the saved cart is rewritten (UPDATE_CART or
+          /api/cart/add); the next turn reloads only the cart
+Versions are in-process and kept only for phones with a live call: an
+order or cart save by anyone else is picked up when a snapshot is next
+loaded, as is one handled by another worker.
+"""
+import asyncio
+from collections import OrderedDict
+
+import db_async
+from sessions import SESSION_MAX_COUNT
+
+
+class UserContext:
+    __slots__ = ('phone', 'user', 'cart', 'frequent', 'essentials', 'orders_version', 'cart_version')
+
+    def __init__(self, phone, user, cart, frequent, essentials, versions):
+        self.phone = phone
+        self.user = user
+        self.cart = cart
+        self.frequent = frequent
+        self.essentials = essentials
+        self.orders_version, self.cart_version = versions
+
+    def suggested_ids(self):
+        return [i['id'] for i in self.frequent + self.essentials]
+
+
+class UserContextCache:
+    def __init__(self, max_calls=SESSION_MAX_COUNT):
+        self.max_calls = max_calls
+        self._calls = OrderedDict()   # call_id -> (phone, task resolving to UserContext)
+        self._versions = {}           # phone -> (orders version, cart version), live phones only
+        self._live = {}               # phone -> number of calls in _calls
+        self._stats = {'loads': 0, 'hits': 0, 'cart_reloads': 0}
+
+    async def _load(self, phone):
+        versions = self._versions.get(phone, (0, 0))  # read first: a bump during the load wins
+        self._stats['loads'] += 1
+        user, cart, frequent, essentials = await asyncio.gather(
+            db_async.get_user(phone),
+            db_async.get_cart(phone),
+            db_async.get_user_frequent_items(phone),
+            db_async.get_user_monthly_essentials(phone),
+        )
+        return UserContext(phone, user, cart, frequent, essentials, versions)
+
+    def _start(self, call_id, phone):
+        self.end_call(call_id)
+        task = asyncio.ensure_future(self._load(phone))
+        self._calls[call_id] = (phone, task)
+        self._live[phone] = self._live.get(phone, 0) + 1
+        while len(self._calls) > self.max_calls:
+            self.end_call(next(iter(self._calls)))
+        return task
+
+    def start_call(self, call_id, user_id=None):
+        """Begin loading the snapshot in the background (/api/call/start)."""
+        if user_id:
+            self._start(call_id, user_id)
+
+    async def get(self, call_id, phone):
+        """The call's snapshot for `phone`, loading or refreshing it if needed."""
+        entry = self._calls.get(call_id)
+        if entry is None or entry[0] != phone:
+            task = self._start(call_id, phone)
+        else:
+            task = entry[1]
+            self._calls.move_to_end(call_id)
+        try:
+            ctx = await task
+        except BaseException:
+            if self._calls.get(call_id, (None, None))[1] is task:
+                self.end_call(call_id)  # let the next turn retry
+            raise
+
+        orders_version, cart_version = self._versions.get(phone, (0, 0))
+        if ctx.orders_version != orders_version:
+            self.end_call(call_id)
+            return await self.get(call_id, phone)
+        if ctx.cart_version != cart_version:
+            ctx.cart = await db_async.get_cart(phone)
+            ctx.cart_version = cart_version
+            self._stats['cart_reloads'] += 1
+        elif entry is not None:
+            self._stats['hits'] += 1
+        return ctx
+
+    def _bump(self, phone, orders=0, cart=0):
+        # Without a live call there is no snapshot to invalidate: the next one loads fresh
+        if phone in self._live:
+            o, c = self._versions.get(phone, (0, 0))
+            self._versions[phone] = (o + orders, c + cart)
+
+    def order_placed(self, phone):
+        self._bump(phone, orders=1)
+
+    def cart_saved(self, phone):
+        self._bump(phone, cart=1)
+
+    def end_call(self, call_id):
+        entry = self._calls.pop(call_id, None)
+        if entry is None:
+            return
+        phone, task = entry
+        task.cancel()  # no-op once loaded
+        if self._live[phone] > 1:
+            self._live[phone] -= 1
+        else:
+            # Last call for this phone: a missing entry reads as version 0 again
+            del self._live[phone]
+            self._versions.pop(phone, None)
+
+    def stats(self):
+        return dict(self._stats, calls=len(self._calls), phones=len(self._live))
+
+
+user_contexts = UserContextCache()
@@ -1,29 +1,192 @@
+"""
+ws_manager.py
+Admin dashboard WebSocket fan-out.
+broadcast() delivers an event to this worker's dashboards and publishes
+it on the pub/sub bridge (pubsub.py) so every other worker delivers it
+to theirs. Events are coalesced per type and entity: repeats within
+ADMIN_COALESCE_MS (e.g. several stock edits of one product) reach each
+dashboard once, carrying the latest message; `seq_from` then records the
+first sequence number it supersedes (admin_events.py).
+
+broadcast() never waits on a dashboard. Each message is serialized once
+and appended to a bounded per-dashboard queue that the dashboard's own
+writer task drains, so one slow browser cannot delay the voice-turn and
+order handlers. When a queue is full, a queued message of the same type
+and entity is replaced by the newer one, otherwise the oldest is dropped; a
+dashboard whose send stalls for ADMIN_WS_SEND_TIMEOUT is disconnected.
+"""
+import asyncio
 import json
-from typing import List
+import os
+from collections import deque
 from fastapi import WebSocket
 
+from pubsub import make_bridge
+
+ADMIN_COALESCE_MS = int(os.getenv("ADMIN_COALESCE_MS", "200"))
+ADMIN_WS_QUEUE_SIZE = int(os.getenv("ADMIN_WS_QUEUE_SIZE", "64"))
+ADMIN_WS_SEND_TIMEOUT = float(os.getenv("ADMIN_WS_SEND_TIMEOUT", "5"))
+
+# Events waiting to go out on the pub/sub bridge
+PUBLISH_QUEUE_SIZE = 1024
+
+
+class DashboardClient:
+    """One dashboard socket with its bounded outbound queue and writer task."""
+    __slots__ = ('websocket', 'queue', 'wakeup', 'task', 'sent', 'dropped', 'coalesced')
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue = deque()    # (coalescing key, serialized text)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sent = self.dropped = self.coalesced = 0
+
+    def push(self, key, text, limit):
+        if len(self.queue) >= limit:
+            for i, (queued_key, _) in enumerate(self.queue):
+                if queued_key == key:
+                    # Newer state of the same entity; the dashboard sees a seq gap and resyncs
+                    self.queue[i] = (key, text)
+                    self.coalesced += 1
+                    self.wakeup.set()
+                    return
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append((key, text))
+        self.wakeup.set()
+
+
 class AdminConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, bridge=None, coalesce_ms=ADMIN_COALESCE_MS,
+                 queue_size=ADMIN_WS_QUEUE_SIZE, send_timeout=ADMIN_WS_SEND_TIMEOUT):
+        self.clients = {}     # websocket -> DashboardClient
+        self.bridge = bridge or make_bridge()
+        self.coalesce_delay = coalesce_ms / 1000
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._pending = {}    # coalescing key -> latest message waiting to be sent
+        self._outbox = None   # events waiting for the bridge, published in order
+        self._publisher = None
+        self._stats = {'events': 0, 'coalesced': 0, 'sent': 0, 'dropped': 0, 'queue_coalesced': 0,
+                       'publish_dropped': 0, 'publish_errors': 0, 'slow_disconnects': 0}
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    async def start(self):
+        await self.bridge.start(self._deliver)
+        self._outbox = asyncio.Queue(PUBLISH_QUEUE_SIZE)
+        self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def stop(self):
+        if self._publisher:
+            self._publisher.cancel()
+        for client in list(self.clients.values()):
+            client.task.cancel()
+        await self.bridge.stop()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = DashboardClient(websocket)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            self._stats['sent'] += client.sent
+            self._stats['dropped'] += client.dropped
+            self._stats['queue_coalesced'] += client.coalesced
+            if client.task is not asyncio.current_task():
+                client.task.cancel()
 
     async def broadcast(self, message: dict):
-        dead_connections = []
-        for connection in self.active_connections:
+        """Send an event to every dashboard connected to any worker. Returns without waiting on any socket."""
+        self._deliver(message)
+        if self._outbox is None:
+            return  # bridge not started (single process, e.g. scripts)
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self._stats['publish_dropped'] += 1
+
+    async def _publish_loop(self):
+        while True:
+            message = await self._outbox.get()
             try:
-                await connection.send_text(json.dumps(message))
+                await self.bridge.publish(message)
             except Exception as e:
-                print(f"Admin WS send failed, removing connection: {e}")
-                dead_connections.append(connection)
-        # BUG 5 FIX: Remove dead connections after iteration to avoid memory leak
-        for dead in dead_connections:
-            self.disconnect(dead)
+                # Local dashboards already have it; keep publishing the rest
+                self._stats['publish_errors'] += 1
+                print(f"Admin WS publish failed: {e}")
+
+    @staticmethod
+    def coalesce_key(message):
+        return message.get("type"), message.get("entity")
+
+    def _deliver(self, message):
+        """Queue an event (local or from another worker) for this worker's dashboards."""
+        self._stats['events'] += 1
+        key = self.coalesce_key(message)
+        previous = self._pending.get(key)
+        if previous is not None:
+            if "seq" in previous and "seq" in message:
+                # Keep the newest state (events from other workers may arrive out of order)
+                first = min(previous.get("seq_from", previous["seq"]), message["seq"])
+                newest = message if message["seq"] > previous["seq"] else previous
+                message = dict(newest, seq_from=first)
+            self._pending[key] = message
+            self._stats['coalesced'] += 1
+            return
+        self._pending[key] = message
+        if self.coalesce_delay > 0:
+            asyncio.get_running_loop().call_later(self.coalesce_delay, self._flush, key)
+        else:
+            self._flush(key)
+
+    def _flush(self, key):
+        message = self._pending.pop(key, None)
+        if message is None:
+            return
+        text = json.dumps(message)  # once, shared by every dashboard
+        for client in self.clients.values():
+            client.push(key, text, self.queue_size)
+
+    async def _writer(self, client):
+        try:
+            while True:
+                await client.wakeup.wait()
+                client.wakeup.clear()
+                while client.queue:
+                    _, text = client.queue.popleft()
+                    await asyncio.wait_for(client.websocket.send_text(text), self.send_timeout)
+                    client.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self._stats['slow_disconnects'] += 1
+            print("Admin WS send timed out, disconnecting slow dashboard")
+            await self._close(client.websocket)
+        except Exception as e:
+            print(f"Admin WS send failed, removing connection: {e}")
+        self.disconnect(client.websocket)
+
+    @staticmethod
+    async def _close(websocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        stats = dict(self._stats, dashboards=len(self.clients),
+                     queued=sum(len(c.queue) for c in self.clients.values()))
+        for client in self.clients.values():  # plus counters of still-connected dashboards
+            stats['sent'] += client.sent
+            stats['dropped'] += client.dropped
+            stats['queue_coalesced'] += client.coalesced
+        return stats
 
 admin_ws_manager = AdminConnectionManager()
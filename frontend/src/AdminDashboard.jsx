@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import './AdminDashboard.css';
 import AnalyticsDashboard from './components/AnalyticsDashboard';
-import { useAdminWebSocket } from './hooks/useAdminWebSocket';
+import { useAdminWebSocket, mergeRows } from './hooks/useAdminWebSocket';
 
 function AdminDashboard() {
     const [orders, setOrders] = useState([]);
@@ -13,12 +13,23 @@ function AdminDashboard() {
         setExpandedTranscripts(prev => ({ ...prev, [id]: !prev[id] }));
     };
 
+    // Apply pushed deltas; only a RESYNC (missed events) reloads from the API
     useAdminWebSocket((event) => {
-        if (event.type === 'NEW_ORDER' || event.type === 'ORDER_UPDATED') {
+        if (event.type === 'RESYNC') {
             fetchOrders();
-        }
-        if (event.type === 'INVENTORY_UPDATED') {
             fetchProducts();
+            return;
+        }
+        if (event.type === 'NEW_ORDER' && event.order) {
+            setOrders(prev => prev.some(o => o.id === event.order.id) ? prev : [event.order, ...prev]);
+        }
+        if (event.type === 'ORDER_UPDATED') {
+            setOrders(prev => event.deleted
+                ? prev.filter(o => o.id !== event.order_id)
+                : prev.map(o => o.id === event.order_id ? { ...o, status: event.status } : o));
+        }
+        if (event.products || event.deleted_product_ids) {
+            setProducts(prev => mergeRows(prev, event.products, event.deleted_product_ids));
         }
     });
 
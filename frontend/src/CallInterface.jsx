@@ -20,6 +20,9 @@ function CallInterface({ callId, onEndCall }) {
     const analyserRef = useRef(null);
     const currentAudioRef = useRef(null);
     const endCallAfterAudioRef = useRef(false);
+    // Sentence-level audio stream: chunks are queued and played back to back
+    const audioQueueRef = useRef([]);
+    const audioStreamOpenRef = useRef(false);
 
     const chatEndRef = useRef(null);
 
@@ -43,6 +46,12 @@ function CallInterface({ callId, onEndCall }) {
                     if (msg.type === 'transcript') setMessages(prev => [...prev, { role: msg.role, text: msg.text }]);
                     if (msg.type === 'cart') setCart(msg.cart || []);
                     if (msg.type === 'control' && msg.action === 'terminate') endCallAfterAudioRef.current = true;
+                    if (msg.type === 'audio_start') audioStreamOpenRef.current = true;
+                    if (msg.type === 'audio_end') {
+                        audioStreamOpenRef.current = false;
+                        // Nothing playing and nothing left (e.g. every sentence failed): end the turn now
+                        if (!currentAudioRef.current && audioQueueRef.current.length === 0) finishAiTurn();
+                    }
                     if (msg.type === 'stock_warning') {
                         setStockWarning(msg.text);
                         // Auto-dismiss after 8 seconds
@@ -58,31 +67,45 @@ function CallInterface({ callId, onEndCall }) {
             }
 
             if (event.data.size > 0) {
-                setStatusWithRef('ai_speaking');
-                if (recognitionRef.current) {
-                    try { recognitionRef.current.stop(); } catch(e) {}
+                if (statusRef.current !== 'ai_speaking') {
+                    setStatusWithRef('ai_speaking');
+                    if (recognitionRef.current) {
+                        try { recognitionRef.current.stop(); } catch(e) {}
+                    }
                 }
+                audioQueueRef.current.push(event.data);
+                if (!currentAudioRef.current) playNextChunk();
+            }
+        };
 
-                const blob = new Blob([event.data], { type: 'audio/mp3' });
-                const url = URL.createObjectURL(blob);
-                const audio = new Audio(url);
-                currentAudioRef.current = audio;
-
-                audio.onended = () => {
-                    URL.revokeObjectURL(url);
-                    currentAudioRef.current = null;
-                    if (endCallAfterAudioRef.current) {
-                        setOrderConfirmed(true);
-                    } else {
-                        setStatusWithRef('listening');
-                        startListening();
-                    }
-                };
-                audio.play().catch(e => {
-                    console.error("Audio play error", e);
-                    if (endCallAfterAudioRef.current) setOrderConfirmed(true);
-                    else startListening();
-                });
+        // Plays queued chunks in order; hands the turn back once the stream has ended and the queue is empty
+        const playNextChunk = () => {
+            const next = audioQueueRef.current.shift();
+            if (!next) {
+                currentAudioRef.current = null;
+                if (!audioStreamOpenRef.current) finishAiTurn();
+                return;
+            }
+            const url = URL.createObjectURL(new Blob([next], { type: 'audio/mp3' }));
+            const audio = new Audio(url);
+            currentAudioRef.current = audio;
+            audio.onended = () => {
+                URL.revokeObjectURL(url);
+                playNextChunk();
+            };
+            audio.play().catch(e => {
+                console.error("Audio play error", e);
+                URL.revokeObjectURL(url);
+                playNextChunk();
+            });
+        };
+
+        const finishAiTurn = () => {
+            if (endCallAfterAudioRef.current) {
+                setOrderConfirmed(true);
+            } else {
+                setStatusWithRef('listening');
+                startListening();
             }
         };
 
@@ -176,6 +199,7 @@ function CallInterface({ callId, onEndCall }) {
         if (mediaStreamRef.current) mediaStreamRef.current.getTracks().forEach(t => t.stop());
         if (audioContextRef.current) audioContextRef.current.close();
         if (recognitionRef.current) recognitionRef.current.stop();
+        audioQueueRef.current = [];
         if (currentAudioRef.current) {
             currentAudioRef.current.pause();
             currentAudioRef.current = null;
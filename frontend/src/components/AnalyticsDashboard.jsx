@@ -25,8 +25,11 @@ function AnalyticsDashboard() {
     });
     const [loading, setLoading] = useState(true);
 
+    // Order and inventory events carry the recomputed analytics
     useAdminWebSocket((event) => {
-        if (['NEW_ORDER', 'ORDER_UPDATED', 'INVENTORY_UPDATED'].includes(event.type)) {
+        if (event.analytics) {
+            setData(event.analytics);
+        } else if (event.type === 'RESYNC') {
             fetchAnalytics();
         }
     });
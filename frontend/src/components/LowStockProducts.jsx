@@ -1,13 +1,24 @@
 import React, { useState, useEffect } from 'react';
 
-import { useAdminWebSocket } from '../hooks/useAdminWebSocket';
+import { useAdminWebSocket, mergeRows } from '../hooks/useAdminWebSocket';
 
 function LowStockProducts() {
     const [lowStock, setLowStock] = useState([]);
     const [loading, setLoading] = useState(true);
 
+    // Products in order / inventory events carry their new stock level
     useAdminWebSocket((event) => {
-        if (event.type === 'NEW_ORDER' || event.type === 'ORDER_UPDATED' || event.type === 'INVENTORY_UPDATED') {
+        if (event.products || event.deleted_product_ids) {
+            const changed = event.products || [];
+            const low = changed
+                .filter(p => p.stock < (p.safety_stock ?? 5))
+                .map(p => ({ product_id: p.id, product_name: p.name_en, stock: p.stock, safety_stock: p.safety_stock ?? 5 }));
+            const removed = [
+                ...(event.deleted_product_ids || []),
+                ...changed.filter(p => p.stock >= (p.safety_stock ?? 5)).map(p => p.id)
+            ];
+            setLowStock(prev => mergeRows(prev, low, removed, 'product_id').sort((a, b) => a.stock - b.stock));
+        } else if (event.type === 'RESYNC') {
             fetchLowStock();
         }
     });
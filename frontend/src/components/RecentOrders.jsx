@@ -2,12 +2,33 @@ import React, { useState, useEffect } from 'react';
 
 import { useAdminWebSocket } from '../hooks/useAdminWebSocket';
 
+// Same shape as /api/admin/recent-orders (services.get_recent_orders)
+function toRecentOrder(order) {
+    const items = (order.items || []).map(item => `${item.name} (x${item.quantity})`);
+    return {
+        order_id: order.id,
+        customer_name: order.customer_name || 'Unknown',
+        items: items.length ? items.join(', ') : 'No items',
+        total_amount: order.total,
+        status: order.status,
+        created_at: (order.created_at || '').slice(0, 16)
+    };
+}
+
 function RecentOrders() {
     const [orders, setOrders] = useState([]);
     const [loading, setLoading] = useState(true);
 
     useAdminWebSocket((event) => {
-        if (event.type === 'NEW_ORDER' || event.type === 'ORDER_UPDATED') {
+        if (event.type === 'NEW_ORDER' && event.order) {
+            setOrders(prev => prev.some(o => o.order_id === event.order.id)
+                ? prev
+                : [toRecentOrder(event.order), ...prev].slice(0, 10));
+        } else if (event.type === 'ORDER_UPDATED') {
+            setOrders(prev => event.deleted
+                ? prev.filter(o => o.order_id !== event.order_id)
+                : prev.map(o => o.order_id === event.order_id ? { ...o, status: event.status } : o));
+        } else if (event.type === 'RESYNC') {
             fetchRecentOrders();
         }
     });
@@ -7,7 +7,9 @@ function TopProducts() {
     const [loading, setLoading] = useState(true);
 
     useAdminWebSocket((event) => {
-        if (event.type === 'NEW_ORDER' || event.type === 'ORDER_UPDATED') {
+        if (event.top_products) {
+            setProducts(event.top_products);
+        } else if (event.type === 'RESYNC') {
             fetchTopProducts();
         }
     });
@@ -7,7 +7,9 @@ function VoiceLogs() {
     const [loading, setLoading] = useState(true);
 
     useAdminWebSocket((event) => {
-        if (event.type === 'VOICE_LOG_UPDATED') {
+        if (event.type === 'VOICE_LOG_UPDATED' && event.log) {
+            setLogs(prev => prev.some(l => l.id === event.log.id) ? prev : [event.log, ...prev].slice(0, 20));
+        } else if (event.type === 'RESYNC') {
             fetchVoiceLogs();
         }
     });
@@ -1,17 +1,99 @@
 import { useEffect } from 'react';
 
+const API_BASE = 'http://localhost:8000';
+
 // Shared WebSocket instance to prevent making multiple connections per component
 let ws = null;
 const listeners = new Set();
 
+// Admin events are deltas numbered by `seq`. If one is missed (dropped for a slow
+// socket, coalesced, or sent while disconnected) the missing ones are fetched from
+// /api/admin/events; if the server no longer has them, listeners get a RESYNC
+// event and reload their data.
+let lastSeq = null;
+let catchingUp = false;
+let held = [];
+
+function dispatch(event) {
+    listeners.forEach(callback => callback(event));
+}
+
+function apply(event) {
+    if (event.seq === undefined) {
+        dispatch(event);
+        return;
+    }
+    if (lastSeq !== null && event.seq <= lastSeq) return; // already applied
+    if (lastSeq !== null && (event.seq_from ?? event.seq) > lastSeq + 1) {
+        held.push(event);
+        catchUp();
+        return;
+    }
+    lastSeq = event.seq;
+    dispatch(event);
+}
+
+async function catchUp() {
+    if (catchingUp) return;
+    catchingUp = true;
+    try {
+        const query = lastSeq === null ? '' : `?after_seq=${lastSeq}`;
+        const res = await fetch(`${API_BASE}/api/admin/events${query}`);
+        const body = await res.json();
+        if (body.reset) {
+            lastSeq = body.seq;
+            dispatch({ type: 'RESYNC', seq: body.seq });
+        } else {
+            body.events.forEach(event => {
+                if (lastSeq === null || event.seq > lastSeq) {
+                    lastSeq = event.seq;
+                    dispatch(event);
+                }
+            });
+            if (lastSeq === null) lastSeq = body.seq;
+        }
+    } catch (e) {
+        console.error("Admin WS resync failed:", e);
+        lastSeq = null;
+        dispatch({ type: 'RESYNC' });
+    } finally {
+        catchingUp = false;
+        const pending = held;
+        held = [];
+        pending.sort((a, b) => a.seq - b.seq).forEach(apply);
+    }
+}
+
+// Merge changed rows into a list by id (existing rows replaced in place, new ones appended)
+// and drop removed ids. Used by components applying delta events.
+export function mergeRows(list, rows = [], removedIds = [], key = 'id') {
+    const changed = new Map(rows.map(row => [row[key], row]));
+    const removed = new Set(removedIds);
+    const merged = list
+        .filter(row => !removed.has(row[key]))
+        .map(row => changed.has(row[key]) ? { ...row, ...changed.get(row[key]) } : row);
+    const present = new Set(merged.map(row => row[key]));
+    rows.forEach(row => {
+        if (!present.has(row[key]) && !removed.has(row[key])) merged.push(row);
+    });
+    return merged;
+}
+
 export function initAdminWebSocket() {
     if (ws) return;
     ws = new WebSocket('ws://localhost:8000/api/admin/ws');
 
+    // First connect: learn the current seq. Reconnect: fetch what was missed.
+    ws.onopen = () => catchUp();
+
     ws.onmessage = (event) => {
         try {
             const data = JSON.parse(event.data);
-            listeners.forEach(callback => callback(data));
+            if (catchingUp && data.seq !== undefined) {
+                held.push(data);
+            } else {
+                apply(data);
+            }
         } catch (e) {
             console.error("WS Message Error:", e);
         }